@@ -3,17 +3,28 @@
 set -e
 
 if [ -z "$1" ] || [ -z "$2" ] ; then
-  echo "$0 <cert dir> <chain length>"
+  echo "$0 <cert dir> <chain length> [rsa|ecdsa|ed25519]"
   exit 1
 fi
 
 CERTDIR=$1
 CHAINLEN=$2
+KEYTYPE=${3:-rsa}
+
+case $KEYTYPE in
+  rsa) NEWKEY="-newkey rsa:2048" ;;
+  ecdsa) NEWKEY="-newkey ec -pkeyopt ec_paramgen_curve:prime256v1" ;;
+  ed25519) NEWKEY="-newkey ed25519" ;;
+  *)
+    echo "Unknown key type $KEYTYPE"
+    exit 1
+    ;;
+esac
 
 mkdir -p $CERTDIR || true
 
 # Generate Root CA and certificate
-openssl req -x509 -sha256 -nodes -days 365 -newkey rsa:2048 \
+openssl req -x509 -sha256 -nodes -days 365 $NEWKEY \
   -keyout $CERTDIR/ca_0.key -out $CERTDIR/cert_0.pem \
   -subj "/O=interop runner Root Certificate Authority/" \
   -config cert_config.txt \
@@ -26,7 +37,7 @@ for i in $(seq 1 $CHAINLEN); do
   if [[ $i == $CHAINLEN ]]; then
     SUBJ="interop runner leaf"
   fi
-  openssl req -out $CERTDIR/cert.csr -new -newkey rsa:2048 -nodes -keyout $CERTDIR/ca_$i.key \
+  openssl req -out $CERTDIR/cert.csr -new $NEWKEY -nodes -keyout $CERTDIR/ca_$i.key \
     -subj "/O=$SUBJ/" \
     2> /dev/null
 
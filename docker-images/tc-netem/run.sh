@@ -2,8 +2,9 @@
 
 set -e
 
-ifconfig eth0 193.167.0.2 netmask 255.255.255.0 up
-ifconfig eth1 193.167.100.2 netmask 255.255.255.0 up
+# Parallel slots each receive their own subnet pair, defaults match the single slot setup
+ifconfig eth0 ${LEFTNET_IPV4_PREFIX:-193.167.0}.2 netmask 255.255.255.0 up
+ifconfig eth1 ${RIGHTNET_IPV4_PREFIX:-193.167.100}.2 netmask 255.255.255.0 up
 
 ifconfig -a
 
@@ -18,11 +19,18 @@ if [[ -n "$WAITFORSERVER" ]]; then
 wait-for-it-quic -t 10s $WAITFORSERVER
 fi
 
+# Reported through the HEALTHCHECK of the image, Vegvisir starts the client as soon as the shaper is healthy
+touch /tmp/vegvisir-ready
+
 
 echo "Activating sync mechanism with netcat"
 netcat -l 57832
 echo "Netcat done"
 
+# Re-arm the sync mechanism in the background before the scenario starts, clients of consecutive runs against a reused shaper
+# synchronise with it while time-varying scenarios (e.g., akamai_cellular_emulation.sh) are still running in the foreground
+( while true; do netcat -l 57832 || true; done ) &
+
 echo "Using scenario:" $SCENARIO
 
 
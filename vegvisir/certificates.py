@@ -0,0 +1,116 @@
+import logging
+import queue
+import tempfile
+import threading
+from typing import Callable
+
+from vegvisir.data import CertificateSettings
+from vegvisir.exceptions import VegvisirCertificateException
+
+
+class CertificateChain:
+	def __init__(self, directory: tempfile.TemporaryDirectory, fingerprint: str) -> None:
+		self._directory = directory
+		self.fingerprint = fingerprint
+
+	@property
+	def path(self) -> str:
+		return self._directory.name
+
+	def cleanup(self) -> None:
+		self._directory.cleanup()
+
+	def __repr__(self) -> str:
+		return f"CertificateChain<{self.path}, {self.fingerprint}>"
+
+
+class CertificatePool:
+	"""
+	Generates certificate chains on a background thread ahead of demand
+	With fresh_per_run disabled, a single chain is generated and handed out to every caller
+	generator(directory, chain_length, key_type) creates the chain in directory and returns its fingerprint (cf. BaseEnvironment.generate_cert_chain)
+	"""
+	def __init__(self, generator: Callable[[str, int, str], str], settings: CertificateSettings) -> None:
+		self._generator = generator
+		self.settings = settings
+
+		self._chains: queue.Queue = queue.Queue(maxsize=max(1, settings.pool_size))
+		self._cached_chain: CertificateChain | None = None
+		self._cached_chain_lock = threading.Lock()
+
+		self._thread: threading.Thread | None = None
+		self._stop_event = threading.Event()
+		self._generator_exception: Exception | None = None
+
+		self.logger = logging.getLogger("root.CertificatePool")
+
+	def _generate(self) -> CertificateChain:
+		directory = tempfile.TemporaryDirectory(dir="/tmp", prefix="vegvisir_certs_")
+		try:
+			fingerprint = self._generator(directory.name, self.settings.chain_length, self.settings.key_type)
+		except Exception:
+			directory.cleanup()
+			raise
+		return CertificateChain(directory, fingerprint)
+
+	def _fill(self) -> None:
+		try:
+			while not self._stop_event.is_set():
+				chain = self._generate()
+				while not self._stop_event.is_set():
+					try:
+						self._chains.put(chain, timeout=0.5)
+						break
+					except queue.Full:
+						pass
+				else:
+					chain.cleanup()
+		except Exception as e:
+			self.logger.error(f"Certificate generation failed, halting certificate pool | {e}")
+			self._generator_exception = e
+
+	def start(self) -> None:
+		if not self.settings.fresh_per_run or self._thread is not None:
+			return
+		self._stop_event.clear()
+		self._thread = threading.Thread(target=self._fill, daemon=True)
+		self._thread.start()
+
+	def acquire(self) -> CertificateChain:
+		if not self.settings.fresh_per_run:
+			with self._cached_chain_lock:
+				if self._cached_chain is None:
+					self._cached_chain = self._generate()
+					self.logger.debug(f"Generated cached certificate chain [{self._cached_chain}]")
+				return self._cached_chain
+
+		if self._thread is None:
+			self.start()
+		while True:
+			try:
+				return self._chains.get(timeout=0.5)
+			except queue.Empty:
+				if self._generator_exception is not None:
+					raise VegvisirCertificateException(f"Certificate pool can not provide a chain | {self._generator_exception}")
+
+	def release(self, chain: CertificateChain) -> None:
+		"""
+		Hand back a chain once the run(s) using it finished, fresh chains are removed from disk
+		"""
+		if chain is not self._cached_chain:
+			chain.cleanup()
+
+	def stop(self) -> None:
+		self._stop_event.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		while True:
+			try:
+				self._chains.get_nowait().cleanup()
+			except queue.Empty:
+				break
+		with self._cached_chain_lock:
+			if self._cached_chain is not None:
+				self._cached_chain.cleanup()
+				self._cached_chain = None
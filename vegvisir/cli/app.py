@@ -1,4 +1,5 @@
 import argparse
+import json
 import logging
 import math
 import random
@@ -7,13 +8,17 @@ import signal
 import sys
 import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from getpass import getpass
 
 import colour
 
 from vegvisir.configuration import Configuration
+from vegvisir.coordination import Coordinator, Worker
+from vegvisir.estimation import CampaignHistory, estimate_plan
+from vegvisir.hostinterface import StubHostInterface
 from vegvisir.housekeeping import (freeze_implementations_configuration, load_frozen_implementations)
+from vegvisir.sharding import Shard, ShardMerger
 
 from .. import __version__ as vegvisir_version
 from .. import exceptions, runner
@@ -260,6 +265,19 @@ def run(vegvisir_arguments):
     implementations_path = vegvisir_arguments.implementations
     experiment_path = vegvisir_arguments.experiment
 
+    shard = None
+    shard_history = None
+    if vegvisir_arguments.shard is not None:
+        try:
+            shard = Shard.parse(vegvisir_arguments.shard)
+        except exceptions.VegvisirShardException as e:
+            logger.error(e)
+            sys.exit(1)
+        if vegvisir_arguments.history is not None:
+            # Every host needs to be handed the same history, otherwise the shards are partitioned differently
+            shard_history = CampaignHistory(vegvisir_arguments.history, vegvisir_arguments.history_campaigns)
+            shard_history.load()
+
     flush_print((
         f"{control_sequences['ERASE_ALL']}"
         f"{control_sequences['SET_CURSOR_POSITION'].format(column=1, row=1)}"
@@ -278,7 +296,7 @@ def run(vegvisir_arguments):
     try:
         configuration = Configuration(implementations_path, experiment_path)
         r = runner.Experiment(sudo_password=sudo_pass, configuration_object=configuration)
-        for experiment in r.run():
+        for experiment in r.run(vegvisir_arguments.resume, shard, shard_history):
             tui_client_name, tui_shaper_name, tui_server_name, tui_progress_current, tui_progress_total = experiment
     except exceptions.VegvisirConfigurationException as e:
         logger.error("Vegvisir generic configuration error, halting execution")
@@ -309,13 +327,175 @@ def run(vegvisir_arguments):
     destruct_tui()
     logger.info(f"Vegvisir experiment finished. Total elapsed time {datetime.now()-tui_start_timestamp}")
 
+def format_size(size):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+def format_duration(seconds):
+    return str(timedelta(seconds=round(seconds)))
+
+def plan(vegvisir_arguments):
+    try:
+        # Configurations are only parsed, no sudo or docker is required
+        configuration = Configuration(vegvisir_arguments.implementations, vegvisir_arguments.experiment)
+        scheduler = configuration.create_scheduler()
+        planned = scheduler.plan
+        history = CampaignHistory(vegvisir_arguments.history or configuration.path_collection.log_path_root, vegvisir_arguments.history_campaigns)
+        history.load()
+        shard = None
+        if vegvisir_arguments.shard is not None:
+            # Matches the partition of run --shard, which only weighs by an explicitly provided history
+            shard = Shard.parse(vegvisir_arguments.shard)
+            assignment, _ = Shard.partition(configuration.permutations(), configuration.iterations, shard.count, history if vegvisir_arguments.history is not None else None)
+            planned = lambda: shard.select(scheduler.plan(), configuration.iterations, assignment)
+        # Plans are generated lazily, summary and estimate each take a pass over it
+        summary = scheduler.summarize(planned())
+        estimate = estimate_plan(planned(), history, configuration.parallel_slots)
+    except exceptions.VegvisirConfigurationException as e:
+        logger.error("Vegvisir generic configuration error, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirInvalidImplementationConfigurationException as e:
+        logger.error("Vegvisir implementations configuration contains incorrect data, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirInvalidExperimentConfigurationException as e:
+        logger.error("Vegvisir experiment configuration contains incorrect data, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirArgumentException as e:
+        logger.error("Vegvisir implementations or experiment configuration contains a wrongfully configured argument, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirShardException as e:
+        logger.error(e)
+        sys.exit(1)
+
+    if vegvisir_arguments.json:
+        print(json.dumps({"strategy": scheduler.name, "seed": scheduler.seed, "shard": str(shard) if shard is not None else None, "summary": summary, "estimate": estimate}, indent=4))
+        return
+
+    print(generate_banner())
+    for position, row in enumerate(estimate["permutations"]):
+        duration = format_duration(row["duration"]) if row["duration"] is not None else "?"
+        size = format_size(row["disk_usage"]) if row["disk_usage"] is not None else "?"
+        print(f"{position:>5}  {duration:>9}  {size:>10}  {row['log_name']} (run {row['run_number']})  [{row['basis']}]")
+    print()
+    if shard is not None:
+        logger.info(f"Showing shard [{shard}] of the campaign")
+    logger.info(f"{summary['permutations']} permutation(s) scheduled using the [{scheduler.name}] strategy over {configuration.parallel_slots} slot(s): {summary['stack_starts']} stack start(s), {summary['shaper_image_switches']} shaper image switch(es), {summary['host_client_setups']} host client setup(s)")
+    if len(history.campaigns) == 0:
+        logger.info(f"No earlier campaigns found in [{history.log_path_root}], duration and disk usage can not be estimated")
+        return
+    logger.info(f"Estimates based on {len(history.campaigns)} earlier campaign(s) in [{history.log_path_root}] | " + ", ".join(f"{count} by {basis}" for basis, count in estimate["bases"].items()))
+    if estimate["estimated"] < summary["permutations"]:
+        logger.warning(f"{summary['permutations'] - estimate['estimated']} permutation(s) could not be estimated and are not included in the totals")
+    logger.info(f"Estimated wall-clock time {format_duration(estimate['wall_clock_duration'])} (serial {format_duration(estimate['serial_duration'])}), estimated disk usage {format_size(estimate['disk_usage'])}")
+    if estimate["disk_free"] is not None and estimate["disk_usage"] > estimate["disk_free"]:
+        logger.warning(f"Estimated disk usage exceeds the {format_size(estimate['disk_free'])} available for [{history.log_path_root}]")
+
+def merge(vegvisir_arguments):
+    print(generate_banner())
+    try:
+        logger.info(f"Merging {len(vegvisir_arguments.shards)} shard(s) into [{vegvisir_arguments.output}]")
+        summary = ShardMerger(vegvisir_arguments.shards, vegvisir_arguments.output, vegvisir_arguments.move).merge()
+    except exceptions.VegvisirShardException as e:
+        logger.error("Merging of shards failed, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    logger.info(f"Merged {len(summary['shards'])} of {summary['shard_count']} shard(s), {summary['completed']} of {summary['planned']} planned permutation(s) completed")
+    if len(summary["incomplete"]) > 0:
+        logger.warning(f"{len(summary['incomplete'])} permutation(s) did not complete, they are listed in [{ShardMerger.SUMMARY_FILENAME}] of the merged campaign")
+
+def coordinator(vegvisir_arguments):
+    print(generate_banner())
+    try:
+        configuration = Configuration(vegvisir_arguments.implementations, vegvisir_arguments.experiment)
+        campaign_coordinator = Coordinator(configuration, vegvisir_arguments.address, vegvisir_arguments.port, vegvisir_arguments.lease_timeout, vegvisir_arguments.max_attempts)
+        port = campaign_coordinator.start(vegvisir_arguments.resume)
+    except exceptions.VegvisirConfigurationException as e:
+        logger.error("Vegvisir generic configuration error, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirInvalidImplementationConfigurationException as e:
+        logger.error("Vegvisir implementations configuration contains incorrect data, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirInvalidExperimentConfigurationException as e:
+        logger.error("Vegvisir experiment configuration contains incorrect data, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except (exceptions.VegvisirCoordinationException, OSError) as e:
+        logger.error("Coordinator could not be started, halting execution")
+        logger.error(e)
+        sys.exit(1)
+
+    logger.info(f"Serving {len(campaign_coordinator.plan)} permutation(s) to workers on {vegvisir_arguments.address}:{port}, results are journaled in [{campaign_coordinator.campaign_path}]")
+    try:
+        while not campaign_coordinator.wait(30):
+            progress = campaign_coordinator.progress()
+            logger.info(f"{progress['completed']} of {progress['planned']} permutation(s) completed, {progress['leased']} leased to {progress['workers']} worker(s), {progress['pending']} pending")
+    except KeyboardInterrupt:
+        logger.info("CTRL-C received, no longer serving permutations. Leased permutations are not journaled unless their results came in.")
+    summary = campaign_coordinator.stop()
+    logger.info(f"Coordinator finished, {summary['completed']} of {summary['planned']} permutation(s) completed by {len(summary['workers'])} worker(s)")
+    if summary["abandoned"] > 0:
+        logger.warning(f"{summary['abandoned']} permutation(s) were given up on, they are listed in [{Coordinator.SUMMARY_FILENAME}]")
+
+def worker(vegvisir_arguments):
+    print(generate_banner())
+    address, _, port = vegvisir_arguments.coordinator.rpartition(":")
+    if len(address) == 0 or not port.isdigit():
+        logger.error(f"Coordinator [{vegvisir_arguments.coordinator}] is not of the form host:port")
+        sys.exit(1)
+    host_interface = None
+    sudo_pass = ""
+    if vegvisir_arguments.dry_run:
+        logger.info("Dry run, host commands are only recorded and every permutation ends immediately")
+        host_interface = StubHostInterface()
+    else:
+        sudo_pass = getpass(f"{control_sequences['BOLD']}{control_sequences['COLOR'].format(r=211, g=215, b=207)}Vegvisir >{control_sequences['CLEAR_COLOR']} Enter password to run sudo commands: ")
+    start_timestamp = datetime.now()
+    try:
+        configuration = Configuration(vegvisir_arguments.implementations, vegvisir_arguments.experiment)
+        r = runner.Experiment(sudo_password=sudo_pass, configuration_object=configuration, host_interface=host_interface)
+        campaign_worker = Worker(r, address.strip("[]"), int(port), vegvisir_arguments.name)
+        for client_name, shaper_name, server_name, counter, _ in campaign_worker.run():
+            if client_name is not None:
+                logger.info(f"Permutation #{counter + 1}: {client_name} over {shaper_name} against {server_name}")
+    except exceptions.VegvisirConfigurationException as e:
+        logger.error("Vegvisir generic configuration error, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirInvalidImplementationConfigurationException as e:
+        logger.error("Vegvisir implementations configuration contains incorrect data, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirInvalidExperimentConfigurationException as e:
+        logger.error("Vegvisir experiment configuration contains incorrect data, halting execution")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirCoordinationException as e:
+        logger.error("Lost the coordinator, halting execution. Leases of this worker are queued again by the coordinator.")
+        logger.error(e)
+        sys.exit(1)
+    except exceptions.VegvisirException as e:
+        logger.error("Generic Vegvisir error encountered, halting exception.")
+        logger.error(e)
+        sys.exit(1)
+    logger.info(f"Coordinator has no permutations left. Total elapsed time {datetime.now() - start_timestamp}")
+
 def freeze(vegvisir_arguments):
     print(generate_banner())
     implementations_file = vegvisir_arguments.implementations
     try:
         config = Configuration(implementations_path=implementations_file)
         logger.info(f"Starting freeze of implementations file [{implementations_file}]")
-        freeze_implementations_configuration(config)
+        summary = freeze_implementations_configuration(config)
+        logger.info(f"Wrote [{summary['archive']}] using {summary['compressor']}, {summary['blobs']} layers stored and {summary['duplicate_blobs']} shared layers skipped")
         logger.info("Successfully archived the provided implementations configuration. You can now import it onto another system.")
     except exceptions.VegvisirConfigurationException as e:
         logger.error("Vegvisir generic configuration error, halting execution")
@@ -357,8 +537,41 @@ def main():
     experiment_parser = argument_subparsers.add_parser("run", aliases=["r"], help="Run an experiment using Vegvisir", description=generate_banner(), formatter_class=argparse.RawTextHelpFormatter)
     experiment_parser.add_argument("-i", "--implementations",  dest="implementations", metavar="[IMPLEMENTATIONS FILE]", help="Defaults to ./implementations.json", default="./implementations.json")
     experiment_parser.add_argument("-q", "--quiet", action="store_true", help="Only print critical warnings and errors. Logs will still be saved to the log directory.")
+    experiment_parser.add_argument("--resume", dest="resume", metavar="[LOG DIRECTORY]", help="Continue an interrupted campaign in its log directory, permutations its journal lists as completed are skipped", default=None)
+    experiment_parser.add_argument("--shard", dest="shard", metavar="[i/N]", help="Only run shard i out of N of the permutations, every host of a campaign runs a different shard into its own log directory", default=None)
+    experiment_parser.add_argument("--history", dest="history", metavar="[LOG ROOT]", help="Directory holding earlier campaigns to weigh shards by the expected duration of their permutations, every host needs the same history. Without it, shards hold an equal number of permutations", default=None)
+    experiment_parser.add_argument("--history-campaigns", dest="history_campaigns", metavar="[COUNT]", type=int, help="Number of most recent campaigns to weigh shards by, defaults to 20", default=20)
     experiment_parser.add_argument("experiment", metavar="[EXPERIMENT FILE]", default="./experiment.json")
 
+    plan_parser = argument_subparsers.add_parser("plan", aliases=["p"], help="Print the execution plan of an experiment with duration and disk usage estimates, without running it", description=generate_banner(), formatter_class=argparse.RawTextHelpFormatter)
+    plan_parser.add_argument("-i", "--implementations",  dest="implementations", metavar="[IMPLEMENTATIONS FILE]", help="Defaults to ./implementations.json", default="./implementations.json")
+    plan_parser.add_argument("--history", dest="history", metavar="[LOG ROOT]", help="Directory holding earlier campaigns to base estimates on, defaults to the log directory of the experiment label", default=None)
+    plan_parser.add_argument("--history-campaigns", dest="history_campaigns", metavar="[COUNT]", type=int, help="Number of most recent campaigns to base estimates on, defaults to 20", default=20)
+    plan_parser.add_argument("--shard", dest="shard", metavar="[i/N]", help="Only print shard i out of N of the plan, as run with run --shard and the same --history", default=None)
+    plan_parser.add_argument("--json", action="store_true", help="Print the plan and estimates as JSON")
+    plan_parser.add_argument("experiment", metavar="[EXPERIMENT FILE]", default="./experiment.json")
+
+    merge_parser = argument_subparsers.add_parser("merge", aliases=["m"], help="Merge the log directories of the shards of a campaign into a single campaign directory", description=generate_banner(), formatter_class=argparse.RawTextHelpFormatter)
+    merge_parser.add_argument("-o", "--output", dest="output", metavar="[LOG DIRECTORY]", help="Directory of the merged campaign, must not exist yet or be empty", required=True)
+    merge_parser.add_argument("--move", action="store_true", help="Move the permutation directories out of the shard directories instead of copying them")
+    merge_parser.add_argument("shards", metavar="[SHARD LOG DIRECTORY]", nargs="+")
+
+    coordinator_parser = argument_subparsers.add_parser("coordinator", aliases=["c"], help="Serve the permutations of an experiment to workers over TCP", description=generate_banner(), formatter_class=argparse.RawTextHelpFormatter)
+    coordinator_parser.add_argument("-i", "--implementations",  dest="implementations", metavar="[IMPLEMENTATIONS FILE]", help="Defaults to ./implementations.json", default="./implementations.json")
+    coordinator_parser.add_argument("--address", dest="address", metavar="[ADDRESS]", help="Address to listen on, defaults to 127.0.0.1", default="127.0.0.1")
+    coordinator_parser.add_argument("--port", dest="port", metavar="[PORT]", type=int, help=f"Port to listen on, defaults to {Coordinator.DEFAULT_PORT}", default=Coordinator.DEFAULT_PORT)
+    coordinator_parser.add_argument("--lease-timeout", dest="lease_timeout", metavar="[SECONDS]", type=float, help=f"Leases without a heartbeat for this long are queued again, defaults to {Coordinator.DEFAULT_LEASE_TIMEOUT}", default=Coordinator.DEFAULT_LEASE_TIMEOUT)
+    coordinator_parser.add_argument("--max-attempts", dest="max_attempts", metavar="[COUNT]", type=int, help=f"Leases per permutation before it is given up on, defaults to {Coordinator.DEFAULT_MAX_ATTEMPTS}", default=Coordinator.DEFAULT_MAX_ATTEMPTS)
+    coordinator_parser.add_argument("--resume", dest="resume", metavar="[LOG DIRECTORY]", help="Continue an interrupted coordinated campaign, permutations its journal lists as completed are not served", default=None)
+    coordinator_parser.add_argument("experiment", metavar="[EXPERIMENT FILE]", default="./experiment.json")
+
+    worker_parser = argument_subparsers.add_parser("worker", aliases=["w"], help="Run permutations leased from a coordinator", description=generate_banner(), formatter_class=argparse.RawTextHelpFormatter)
+    worker_parser.add_argument("-i", "--implementations",  dest="implementations", metavar="[IMPLEMENTATIONS FILE]", help="Defaults to ./implementations.json", default="./implementations.json")
+    worker_parser.add_argument("--coordinator", dest="coordinator", metavar="[HOST:PORT]", help=f"Coordinator to lease permutations from, defaults to 127.0.0.1:{Coordinator.DEFAULT_PORT}", default=f"127.0.0.1:{Coordinator.DEFAULT_PORT}")
+    worker_parser.add_argument("--name", dest="name", metavar="[NAME]", help="Name of the worker, unique among the workers of a coordinator, defaults to <hostname>-<pid>", default=None)
+    worker_parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="Leave the host untouched: no sudo, docker or clients, every leased permutation ends immediately. Exercises a coordinator and its workers, e.g., on one localhost")
+    worker_parser.add_argument("experiment", metavar="[EXPERIMENT FILE]", default="./experiment.json")
+
     freeze_parser = argument_subparsers.add_parser("freeze", aliases=["f"], help="Freeze a set of docker images defined in the provided implementations file using docker save", description=generate_banner(), formatter_class=argparse.RawTextHelpFormatter)
     freeze_parser.add_argument("-i", "--implementations",  dest="implementations", metavar="[IMPLEMENTATIONS FILE]", help="Defaults to ./implementations.json", default="./implementations.json")
     # freeze_parser.add_argument("out", metavar="OUT", help="Filename for the frozen archive")
@@ -373,9 +586,17 @@ def main():
     
     command_to_callback_map = {
         "r": run,
+        "p": plan,
+        "m": merge,
+        "c": coordinator,
+        "w": worker,
         "f": freeze,
         "l": load,
         "run": run,
+        "plan": plan,
+        "merge": merge,
+        "coordinator": coordinator,
+        "worker": worker,
         "freeze": freeze,
         "load": load,
     }
@@ -1,10 +1,14 @@
 import json
 import logging
 import os
-from typing import Dict, List, Set
-
-from vegvisir import environments
-from vegvisir.data import ExperimentPaths, VegvisirArguments
+from typing import Dict, Generator, List, Set
+
+from vegvisir import environments, scheduler
+from vegvisir.data import (CertificateSettings, ExperimentPaths,
+                           ExperimentPermutation, MetricsSettings,
+                           ResourceSamplingSettings, SchedulerSettings,
+                           VegvisirArguments)
+from vegvisir.environments import sensors
 from vegvisir.environments.base_environment import BaseEnvironment
 from vegvisir.exceptions import (
     VegvisirArgumentException, VegvisirCommandException,
@@ -13,6 +17,8 @@ from vegvisir.exceptions import (
     VegvisirInvalidImplementationConfigurationException)
 from vegvisir.implementation import (DockerImage, Endpoint, HostCommand,
                                      Parameters, Scenario, Shaper)
+from vegvisir.resources import ResourceSampler
+from vegvisir.sweep import ConfigurationSequence, SweepEntry
 
 
 class Configuration:
@@ -27,15 +33,25 @@ class Configuration:
 		self._server_endpoints: Dict[str, Endpoint] = {}
 		self._shapers: Dict[str, Shaper] = {}
 
-		self._client_configurations: List[Dict] = []
-		self._server_configurations: List[Dict] = []
-		self._shaper_configurations: List[Dict] = []
+		self._client_configurations = ConfigurationSequence()
+		self._server_configurations = ConfigurationSequence()
+		self._shaper_configurations = ConfigurationSequence()
 
 		self._www_path = None
 
 		self._iterations = 1
+		self._parallel_slots = 1
+		self._reuse_stack = False
+		self._certificate_settings = CertificateSettings()
+		self._scheduler_settings = SchedulerSettings()
+		self._hook_mode = "thread"
+		self._hook_backlog = 0
+		self._metrics_settings = MetricsSettings()
+		self._resource_sampling_settings = ResourceSamplingSettings()
 
 		self._environment: BaseEnvironment = None
+		self._environment_name: str | None = None
+		self._sensor_configurations: List[Dict] = []
 
 		self.logger = logging.getLogger("root.Configuration")
 
@@ -85,6 +101,56 @@ class Configuration:
 		self._validate_and_raise_load(self._experiment_configuration_loaded, "iterations", "experiment")
 		return self._iterations
 
+	@property
+	def parallel_slots(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "parallel_slots", "experiment")
+		return self._parallel_slots
+
+	@property
+	def reuse_stack(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "reuse_stack", "experiment")
+		return self._reuse_stack
+
+	@property
+	def certificate_settings(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "certificate_settings", "experiment")
+		return self._certificate_settings
+
+	@property
+	def scheduler_settings(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "scheduler_settings", "experiment")
+		return self._scheduler_settings
+
+	@property
+	def hook_mode(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "hook_mode", "experiment")
+		return self._hook_mode
+
+	@property
+	def hook_backlog(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "hook_backlog", "experiment")
+		return self._hook_backlog
+
+	@property
+	def metrics_settings(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "metrics_settings", "experiment")
+		return self._metrics_settings
+
+	@property
+	def resource_sampling_settings(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "resource_sampling_settings", "experiment")
+		return self._resource_sampling_settings
+
+	@property
+	def environment_name(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "environment_name", "experiment")
+		return self._environment_name
+
+	@property
+	def permutation_count(self):
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "permutation_count", "experiment")
+		return len(self._shaper_configurations) * len(self._server_configurations) * len(self._client_configurations) * self._iterations
+
 	@property
 	def environment(self):
 		self._validate_and_raise_load(self._experiment_configuration_loaded, "environment", "experiment")
@@ -106,6 +172,69 @@ class Configuration:
 			images.append(shaper.image.full)
 		return images
 
+	def permutations(self) -> Generator[ExperimentPermutation, None, None]:
+		"""
+		Expand the experiment configuration into its permutations
+		Shapers are iterated outermost, followed by servers, clients and finally the iterations
+		"""
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "permutations", "experiment")
+		index = 0
+		for shaper_config in self._shaper_configurations:
+			for server_config in self._server_configurations:
+				for client_config in self._client_configurations:
+					for run_number in range(self._iterations):
+						yield ExperimentPermutation(index, run_number, client_config, shaper_config, server_config)
+						index += 1
+
+	def create_environment(self) -> BaseEnvironment:
+		"""
+		Instantiate a fresh environment, including its sensors, from the loaded experiment configuration
+		Sensors carry per-run state, every parallel slot therefore requires its own environment object
+		"""
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "create_environment", "experiment")
+		environment = environments.available_environments[self._environment_name]()
+		for sensor in self._sensor_configurations:
+			environment.add_sensor(self._create_sensor(sensor, sensor["name"]))
+		return environment
+
+	def _create_sensor(self, sensor: Dict, label: str) -> sensors.ABCSensor:
+		"""
+		Instantiate a sensor, or a sensor expression including the sensors it combines, label is its position in the configuration (e.g., "any[1].timeout")
+		"""
+		try:
+			# Shallow copy should be fine
+			sensor_arguments = sensor.copy()
+			del sensor_arguments["name"]
+			if sensor["name"] in environments.sensor_expressions:
+				sensor_arguments["sensors"] = [self._create_sensor(child, f"{label}[{index}].{child['name']}") for index, child in enumerate(sensor["sensors"])]
+				instance = environments.sensor_expressions[sensor["name"]](**sensor_arguments)
+			else:
+				instance = environments.available_sensors[sensor["name"]](**sensor_arguments)
+		except TypeError as e:
+			raise VegvisirInvalidImplementationConfigurationException(f"Sensor [{label}] can not be initialized with the provided arguments. Make sure all required initialization parameters are provided [{e}]")
+		instance.label = label
+		return instance
+
+	def _validate_sensor_configuration(self, sensor: Dict, position: str) -> None:
+		if type(sensor) is not dict or sensor.get("name") is None:
+			raise VegvisirInvalidImplementationConfigurationException(f"Sensor {position} has no 'name' key.")
+		if sensor["name"] in environments.sensor_expressions:
+			children = sensor.get("sensors")
+			if type(children) is not list or len(children) == 0:
+				raise VegvisirInvalidExperimentConfigurationException(f"Sensor expression [{sensor['name']}] ({position}) expects a non-empty 'sensors' list.")
+			for index, child in enumerate(children):
+				self._validate_sensor_configuration(child, f"{position}[{index}]")
+		elif sensor["name"] not in environments.available_sensors:
+			raise VegvisirInvalidImplementationConfigurationException(f"Sensor [{sensor['name']}] is unknown. Make sure it is correctly loaded in the __init__ file of the environments module.")
+
+	def create_scheduler(self, cached_images: Set[str] | None = None) -> scheduler.Scheduler:
+		"""
+		Instantiate the scheduler that orders the permutations, as configured by the experiment settings
+		cached_images are the images available on the host, pulling the others is accounted for in the order (cf. Scheduler)
+		"""
+		self._validate_and_raise_load(self._experiment_configuration_loaded, "create_scheduler", "experiment")
+		return scheduler.available_schedulers[self._scheduler_settings.strategy](self, self._scheduler_settings.seed, cached_images)
+
 	def _validate_and_raise_load(self, config_bool: bool, getter: str, required_config_name: str):
 		if not config_bool:
 			raise VegvisirConfigurationException(f"Access to [{getter}] property of the Configuration is only possible after loading the {required_config_name} configuration.")
@@ -284,6 +413,13 @@ class Configuration:
 				if name in entries:
 					raise VegvisirInvalidExperimentConfigurationException(f"{debug_str.capitalize()} [{name}] duplicate detected. Please provide a 'log_name' to be able to distinguish.")
 
+		# Log names generated by a sweep may equal the log name of another entry, or one generated by another sweep
+		def _sweep_duplicate_check(name: str, sweep: SweepEntry, entries: Set[str], debug_str: str):
+			for log_name in sweep.log_names():
+				if log_name in entries:
+					raise VegvisirInvalidExperimentConfigurationException(f"{debug_str.capitalize()} [{name}] sweeps into log name [{log_name}] which is not unique.")
+				entries.add(log_name)
+
 		vegvisirDummyArguments = VegvisirArguments().dummy()
 		def _validate_command_with_real_parameters(client_endpoint: Endpoint, client_unhydrated_parameters: Dict[str, str]) -> None:
 			if client_endpoint.type == Endpoint.Type.DOCKER:
@@ -297,30 +433,43 @@ class Configuration:
 			except VegvisirArgumentException as e:
 				raise VegvisirInvalidExperimentConfigurationException(f"Client [{client_endpoint.name}] contains a command [{cmd.command}] that fails to serialize: {e}")
 		
+		# Sweep entries are validated through their first point, all points share the same arguments and only differ in value
 		duplicate_check = set()
+		client_entries = []
 		for index, client in enumerate(configuration[CLIENTS_KEY]):
 			_namecheck_dict(client, index, "client", self._client_endpoints)
 			_duplicate_check(client["name"], client.get("log_name"), duplicate_check, "client")
 			duplicate_check.add(client["log_name"] if client.get("log_name") is not None else client["name"])
+			sweep = SweepEntry(client, "client")
+			_sweep_duplicate_check(client["name"], sweep, duplicate_check, "client")
 			_parametercheck_endpoint(self._client_endpoints[client["name"]], client, "client")
-			_validate_command_with_real_parameters(self._client_endpoints[client["name"]], client.get("arguments", {}))
-			self._client_configurations.append(client)
+			_validate_command_with_real_parameters(self._client_endpoints[client["name"]], sweep[0].get("arguments", {}))
+			client_entries.append(sweep)
+		self._client_configurations = ConfigurationSequence(client_entries)
 
 		duplicate_check = set()
+		server_entries = []
 		for index, server in enumerate(configuration[SERVERS_KEY]):
 			_namecheck_dict(server, index, "server", self._server_endpoints)
 			_duplicate_check(server["name"], server.get("log_name"), duplicate_check, "server")
 			duplicate_check.add(server["log_name"] if server.get("log_name") is not None else server["name"])
 			_parametercheck_endpoint(self._server_endpoints[server["name"]], server, "server")
-			self._server_configurations.append(server)
+			sweep = SweepEntry(server, "server")
+			_sweep_duplicate_check(server["name"], sweep, duplicate_check, "server")
+			server_entries.append(sweep)
+		self._server_configurations = ConfigurationSequence(server_entries)
 
 		duplicate_check = set()
+		shaper_entries = []
 		for index, shaper in enumerate(configuration[SHAPERS_KEY]):
 			_namecheck_dict(shaper, index, "shaper", self._shapers)
 			_duplicate_check(shaper["name"], shaper.get("log_name"), duplicate_check, "shaper")
 			duplicate_check.add(shaper["log_name"] if shaper.get("log_name") is not None else shaper["name"])
 			_scenariocheck_shaper(shaper, self._shapers[shaper["name"]].scenarios)
-			self._shaper_configurations.append(shaper)
+			sweep = SweepEntry(shaper, "shaper")
+			_sweep_duplicate_check(shaper["name"], sweep, duplicate_check, "shaper")
+			shaper_entries.append(sweep)
+		self._shaper_configurations = ConfigurationSequence(shaper_entries)
 
 		if settings.get("log_dir") is not None:
 			log_dir_root = os.path.abspath(os.path.join(settings["log_dir"], "{}/"))
@@ -355,26 +504,95 @@ class Configuration:
 		if self.hook_processor_count <= 0:
 			raise VegvisirInvalidExperimentConfigurationException("Setting 'hook_processors' must be > 0.")
 
+		hook_mode = settings.get("hook_mode", "thread")
+		if hook_mode not in ["thread", "process"]:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'hook_mode' must be either 'thread' or 'process'.")
+		self._hook_mode = hook_mode
+
+		hook_backlog = settings.get("hook_backlog", 0)
+		if type(hook_backlog) is not int or hook_backlog < 0:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'hook_backlog' must be >= 0.")
+		self._hook_backlog = hook_backlog
+
+		parallel_slots = settings.get("parallel_slots", 1)
+		if type(parallel_slots) is str and not parallel_slots.isdigit():
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'parallel_slots' must be between 1 and 100.")
+		try:
+			self._parallel_slots = int(parallel_slots)
+		except ValueError:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'parallel_slots' must be between 1 and 100.")
+		if self._parallel_slots <= 0 or self._parallel_slots > 100:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'parallel_slots' must be between 1 and 100.")
+		if self._parallel_slots > 1 and any(self._client_endpoints[sweep.entry["name"]].type == Endpoint.Type.HOST for sweep in self._client_configurations.entries):
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'parallel_slots' > 1 is only supported for containerized clients, host clients share the routing table and hosts file of the host.")
+
+		reuse_stack = settings.get("reuse_stack", False)
+		if type(reuse_stack) is not bool:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'reuse_stack' must be a boolean.")
+		self._reuse_stack = reuse_stack
+
+		certificates = settings.get("certificates", {})
+		if type(certificates) is not dict:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'certificates' must be a dictionary.")
+		key_type = certificates.get("key_type", "rsa")
+		if key_type not in ["rsa", "ecdsa", "ed25519"]:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'certificates.key_type' must be one of 'rsa', 'ecdsa' or 'ed25519'.")
+		fresh_per_run = certificates.get("fresh_per_run", True)
+		if type(fresh_per_run) is not bool:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'certificates.fresh_per_run' must be a boolean.")
+		chain_length = certificates.get("chain_length", 1)
+		if type(chain_length) is not int or chain_length <= 0:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'certificates.chain_length' must be an integer > 0.")
+		# One chain ready for every slot and a spare, unless configured otherwise
+		pool_size = certificates.get("pool_size", self._parallel_slots + 1)
+		if type(pool_size) is not int or pool_size <= 0:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'certificates.pool_size' must be an integer > 0.")
+		self._certificate_settings = CertificateSettings(key_type, chain_length, fresh_per_run, pool_size)
+
+		scheduler_settings = settings.get("scheduler", {})
+		if type(scheduler_settings) is not dict:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'scheduler' must be a dictionary.")
+		strategy = scheduler_settings.get("strategy", scheduler.default_scheduler)
+		if strategy not in scheduler.available_schedulers.keys():
+			raise VegvisirInvalidExperimentConfigurationException(f"Setting 'scheduler.strategy' must be one of {', '.join(scheduler.available_schedulers.keys())}.")
+		seed = scheduler_settings.get("seed")
+		if seed is not None and type(seed) is not int:
+			raise VegvisirInvalidExperimentConfigurationException("Setting 'scheduler.seed' must be an integer.")
+		self._scheduler_settings = SchedulerSettings(strategy, seed)
+
+		metrics_settings = settings.get("metrics")
+		if metrics_settings is not None:
+			if type(metrics_settings) is not dict:
+				raise VegvisirInvalidExperimentConfigurationException("Setting 'metrics' must be a dictionary.")
+			address = metrics_settings.get("address", MetricsSettings.address)
+			if type(address) is not str:
+				raise VegvisirInvalidExperimentConfigurationException("Setting 'metrics.address' must be a string.")
+			port = metrics_settings.get("port", MetricsSettings.port)
+			if type(port) is not int or port < 0 or port > 65535:
+				raise VegvisirInvalidExperimentConfigurationException("Setting 'metrics.port' must be between 0 and 65535.")
+			self._metrics_settings = MetricsSettings(metrics_settings.get("enabled", True) == True, address, port)
+
+		resource_sampling = settings.get("resource_sampling")
+		if resource_sampling is not None:
+			if type(resource_sampling) is not dict:
+				raise VegvisirInvalidExperimentConfigurationException("Setting 'resource_sampling' must be a dictionary.")
+			interval = resource_sampling.get("interval", ResourceSamplingSettings.interval)
+			if type(interval) not in [int, float] or interval < ResourceSampler.MIN_INTERVAL:
+				raise VegvisirInvalidExperimentConfigurationException(f"Setting 'resource_sampling.interval' must be a number of at least {ResourceSampler.MIN_INTERVAL} seconds.")
+			self._resource_sampling_settings = ResourceSamplingSettings(resource_sampling.get("enabled", True) == True, interval)
+
 		environment = configuration.get("environment")
 		if environment is None:
 			raise VegvisirInvalidExperimentConfigurationException("No 'environment' key was found.")
 		environment_name = environment.get("name", environments.default_environment)
 		if environment_name not in environments.available_environments.keys():
 			raise VegvisirInvalidExperimentConfigurationException(f"Environment [{environment_name}] does not exist. Make sure it is correctly loaded in the __init__ file of the environments module.")
-		self._environment = environments.available_environments[environment_name]()
+		self._environment_name = environment_name
 				
 		environment_sensors = environment.get("sensors")
 		if environment_sensors is None:
 			raise VegvisirInvalidExperimentConfigurationException("Environment expects the key 'sensors' to be present.")
 		for index, sensor in enumerate(environment_sensors):
-			if sensor.get("name") is None:
-				raise VegvisirInvalidImplementationConfigurationException(f"Sensor #{index} has no 'name' key.")
-			if sensor["name"] not in environments.available_sensors:
-				raise VegvisirInvalidImplementationConfigurationException(f"Sensor [{sensor['name']}] is unknown. Make sure it is correctly loaded in the __init__ file of the environments module.")
-			try:
-				# Shallow copy should be fine
-				sensor_arguments = sensor.copy()
-				del sensor_arguments["name"]
-				self._environment.add_sensor(environments.available_sensors[sensor["name"]](**sensor_arguments))
-			except TypeError as e:
-				raise VegvisirInvalidImplementationConfigurationException(f"Sensor [{sensor['name']}] can not be initialized with the provided arguments. Make sure all required initialization parameters are provided [f{e}]")
+			self._validate_sensor_configuration(sensor, f"#{index}")
+			self._sensor_configurations.append(sensor)
+		self._environment = self.create_environment()
@@ -0,0 +1,46 @@
+import subprocess
+import time
+from datetime import datetime
+from typing import List
+
+from vegvisir.hostinterface import HostInterface
+
+
+class ContainerLogFollower:
+	"""
+	Streams the output of a compose service straight into a file using `docker compose logs --follow`
+	The docker CLI writes to the file descriptor directly, the output never passes through Vegvisir its memory
+	"""
+	def __init__(self, host_interface: HostInterface, compose_variables: str, service: str, output_path: str, since: datetime | None = None) -> None:
+		self.host_interface = host_interface
+		self.compose_variables = compose_variables
+		self.service = service
+		self.output_path = output_path
+		self.since = since
+		self.process: subprocess.Popen | None = None
+
+	def start(self) -> None:
+		since = f"--since {self.since.astimezone().isoformat()} " if self.since is not None else ""
+		command = self.compose_variables + " docker compose logs --follow --timestamps --no-log-prefix " + since + self.service
+		with open(self.output_path, "ab") as fp:
+			# The child process holds its own copy of the file descriptor
+			self.process = self.host_interface.spawn_parallel_subprocess(command, False, True, stdout=fp, stderr=subprocess.STDOUT)
+
+	def stop(self, grace_period: float = 0) -> None:
+		if self.process is None:
+			return
+		try:
+			self.process.wait(timeout=grace_period)
+		except subprocess.TimeoutExpired:
+			self.process.terminate()
+			self.process.wait()
+		self.process = None
+
+	@staticmethod
+	def stop_all(followers: List["ContainerLogFollower"], grace_period: float = 0) -> None:
+		"""
+		Followers exit by themselves once their container stops, those still running after the (shared) grace period are terminated
+		"""
+		deadline = time.time() + grace_period
+		for follower in followers:
+			follower.stop(max(0, deadline - time.time()))
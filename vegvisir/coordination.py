@@ -0,0 +1,514 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Deque, Dict, Iterator, List, Set, Tuple
+
+from vegvisir.data import ExperimentPermutation
+from vegvisir.exceptions import VegvisirCoordinationException
+from vegvisir.journal import PermutationJournal
+
+if TYPE_CHECKING:
+	from vegvisir.configuration import Configuration
+	from vegvisir.runner import Experiment
+
+PROTOCOL_VERSION = 1
+
+_WORKER_NAME_UNSAFE = re.compile(r"[^A-Za-z0-9.-]")
+
+
+def configuration_digest(configuration: "Configuration") -> str:
+	"""
+	Coordinator and workers need to be started with the same implementations and experiment configuration files
+	"""
+	digest = hashlib.sha256()
+	for path in [configuration.path_collection.implementations_configuration_file_path, configuration.path_collection.experiment_configuration_file_path]:
+		with open(path, "rb") as fp:
+			digest.update(hashlib.sha256(fp.read()).digest())
+	return digest.hexdigest()
+
+
+@dataclass
+class Lease:
+	lease_id: str
+	position: int  # Position of the permutation in the plan of the coordinator
+	worker: str
+	connection: int
+	deadline: float  # time.monotonic(), renewed by heartbeats
+
+
+class Coordinator:
+	"""
+	Serves the permutations of an experiment to workers over TCP, every message is a single line of JSON answered by the other side
+	Workers lease one permutation per slot at a time and renew their leases with heartbeats
+	Leases of workers that disconnect or stop sending heartbeats are queued again, up to max_attempts leases per permutation
+	Results are appended to the journal in the campaign directory of the coordinator, the output of the permutations stays in the log directories of the workers
+	"""
+	DEFAULT_PORT = 9465
+	DEFAULT_LEASE_TIMEOUT = 60  # seconds
+	DEFAULT_MAX_ATTEMPTS = 3
+	WAIT_INTERVAL = 1  # seconds, workers ask again after all remaining permutations are leased to others
+	STACK_LOOKAHEAD = 256  # Queued permutations searched for one matching the stack a worker has running
+	DRAIN_TIMEOUT = 10  # seconds, workers are given this long to pick up that the campaign is done
+	SUMMARY_FILENAME = "coordinator.json"
+
+	def __init__(self, configuration: "Configuration", address: str = "127.0.0.1", port: int = DEFAULT_PORT, lease_timeout: float = DEFAULT_LEASE_TIMEOUT, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> None:
+		self.configuration = configuration
+		self.address = address
+		self.port = port
+		self.lease_timeout = lease_timeout
+		self.max_attempts = max(1, max_attempts)
+		self.digest = configuration_digest(configuration)
+
+		self.campaign_path: str | None = None
+		self.journal: PermutationJournal | None = None
+		self.plan: List[ExperimentPermutation] = []
+
+		self._pending: Deque[int] = deque()
+		self._leases: Dict[str, Lease] = {}
+		self._completed: Set[int] = set()
+		self._attempts: Dict[int, int] = {}
+		self._abandoned: List[int] = []
+		self._workers: Dict[str, Dict] = {}  # Worker name => connection state and statistics
+		self._lock = threading.Lock()
+		self._finished = threading.Event()
+		self._stop = threading.Event()
+		self._connection_ids = itertools.count()
+
+		self._server: socketserver.ThreadingTCPServer | None = None
+		self._thread: threading.Thread | None = None
+		self._expiry_thread: threading.Thread | None = None
+		self.logger = logging.getLogger("root.Coordinator")
+
+	def _copy_configuration(self, source: str, name: str) -> None:
+		destination = os.path.join(self.campaign_path, name)
+		if os.path.exists(destination):
+			return  # Resumed campaign, permutations are matched on their configuration
+		try:
+			shutil.copy2(source, destination)
+		except IOError as e:
+			self.logger.warning(f"Could not copy over {name} to root of coordinator logs: {destination} | {e}")
+
+	def start(self, resume_path: str | None = None) -> int:
+		"""
+		Plan the experiment and start serving, returns the bound port (relevant when port 0 requests an ephemeral one)
+		Providing resume_path continues an earlier coordinated campaign, permutations its journal lists as completed are not handed out
+		"""
+		start_time = datetime.now()
+		if resume_path is not None:
+			if not os.path.isdir(resume_path):
+				raise VegvisirCoordinationException(f"Can not resume campaign, log directory [{resume_path}] does not exist.")
+			self.campaign_path = os.path.abspath(resume_path)
+		else:
+			self.campaign_path = os.path.join(self.configuration.path_collection.log_path_root, f"{start_time:%Y-%m-%dT_%H-%M-%S}_coordinator")
+		pathlib.Path(self.campaign_path).mkdir(parents=True, exist_ok=True)
+		self._copy_configuration(self.configuration.path_collection.implementations_configuration_file_path, "implementations.json")
+		self._copy_configuration(self.configuration.path_collection.experiment_configuration_file_path, "experiment.json")
+
+		self.journal = PermutationJournal(self.campaign_path)
+		self.journal.load()
+		scheduler = self.configuration.create_scheduler()
+		# Leases refer to permutations by their position in the plan
+		self.plan = list(scheduler.plan())
+		plan_path = os.path.join(self.campaign_path, "plan.json")
+		if os.path.exists(plan_path):
+			plan_path = os.path.join(self.campaign_path, f"plan_{start_time:%Y-%m-%dT_%H-%M-%S}.json")
+		scheduler.write_plan(self.plan, plan_path)
+		for position, permutation in enumerate(self.plan):
+			if self.journal.is_completed(permutation):
+				self._completed.add(position)
+			else:
+				self._pending.append(position)
+		if len(self._pending) == 0:
+			self._finished.set()
+		if resume_path is not None:
+			self.logger.info(f"Resuming campaign [{self.campaign_path}], {len(self._completed)} permutation(s) already completed")
+
+		coordinator = self
+
+		class CoordinatorHandler(socketserver.StreamRequestHandler):
+			def handle(self):
+				coordinator._serve_connection(self.rfile, self.wfile, self.client_address[0])
+
+		self._server = socketserver.ThreadingTCPServer((self.address, self.port), CoordinatorHandler, bind_and_activate=False)
+		self._server.allow_reuse_address = True
+		self._server.daemon_threads = True
+		try:
+			self._server.server_bind()
+			self._server.server_activate()
+		except OSError:
+			self._server.server_close()
+			raise
+		self.port = self._server.server_address[1]
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._server.serve_forever, name="Coordinator", daemon=True)
+		self._thread.start()
+		self._expiry_thread = threading.Thread(target=self._expire_leases, name="CoordinatorLeases", daemon=True)
+		self._expiry_thread.start()
+		return self.port
+
+	def wait(self, timeout: float | None = None) -> bool:
+		"""
+		Block until every permutation completed or was abandoned, returns False when timeout passed before
+		"""
+		return self._finished.wait(timeout)
+
+	def _counts(self) -> Dict:
+		return {
+			"planned": len(self.plan),
+			"completed": len(self._completed),
+			"leased": len(self._leases),
+			"pending": len(self._pending),
+			"abandoned": len(self._abandoned),
+		}
+
+	def progress(self) -> Dict:
+		with self._lock:
+			return {**self._counts(), "workers": sum(1 for state in self._workers.values() if state["connected"])}
+
+	def stop(self) -> Dict:
+		"""
+		Stop serving once connected workers picked up that the campaign is done (or DRAIN_TIMEOUT passed), returns the summary written to coordinator.json
+		"""
+		if self._server is None:
+			return {}
+		if self._finished.is_set():
+			deadline = time.monotonic() + Coordinator.DRAIN_TIMEOUT
+			while time.monotonic() < deadline and self.progress()["workers"] > 0:
+				time.sleep(0.1)
+		self._stop.set()
+		self._server.shutdown()
+		self._server.server_close()
+		self._thread.join()
+		self._expiry_thread.join()
+		self._server = None
+
+		with self._lock:
+			summary = {
+				**self._counts(),
+				"abandoned_permutations": [f"{self.plan[position].log_name} (run {self.plan[position].run_number})" for position in self._abandoned],
+				"workers": {name: {key: value for key, value in state.items() if key not in ["connected", "connection"]} for name, state in self._workers.items()},
+			}
+		with open(os.path.join(self.campaign_path, Coordinator.SUMMARY_FILENAME), "w") as fp:
+			json.dump(summary, fp, indent=4)
+		return summary
+
+	def _serve_connection(self, rfile, wfile, peer: str) -> None:
+		connection = next(self._connection_ids)
+		worker = None
+		try:
+			for line in rfile:
+				try:
+					message = json.loads(line)
+					if type(message) is not dict:
+						raise ValueError("message is not an object")
+				except ValueError as e:
+					reply = {"type": "error", "error": f"Malformed message | {e}"}
+				else:
+					if message.get("type") == "hello":
+						reply = self._hello(message, connection, peer) if worker is None else {"type": "error", "error": "Already introduced."}
+						if reply["type"] == "welcome":
+							worker = message["worker"]
+					elif worker is None:
+						reply = {"type": "error", "error": "Introduce the worker with a hello message first."}
+					else:
+						reply = self._handle(worker, connection, message)
+				wfile.write((json.dumps(reply) + "\n").encode())
+				wfile.flush()
+				if worker is None and reply["type"] == "error":
+					break
+		except OSError:
+			pass  # Connection reset, handled like a disconnect
+		finally:
+			if worker is not None:
+				self._disconnected(worker, connection)
+
+	def _hello(self, message: Dict, connection: int, peer: str) -> Dict:
+		name = message.get("worker")
+		if message.get("version") != PROTOCOL_VERSION:
+			return {"type": "error", "error": f"Protocol version [{message.get('version')}] is not supported, the coordinator speaks version [{PROTOCOL_VERSION}]."}
+		if type(name) is not str or len(name) == 0:
+			return {"type": "error", "error": "Worker name is missing."}
+		if message.get("digest") != self.digest:
+			return {"type": "error", "error": "Worker runs a different implementations or experiment configuration than the coordinator."}
+		with self._lock:
+			state = self._workers.setdefault(name, {"address": peer, "connected": False, "connection": None, "connections": 0, "leased": 0, "completed": 0, "failed": 0, "requeued": 0})
+			if state["connected"]:
+				return {"type": "error", "error": f"A worker named [{name}] is already connected."}
+			state.update(address=peer, connected=True, connection=connection, connections=state["connections"] + 1)
+		self.logger.info(f"Worker [{name}] connected from {peer} with {message.get('slots', 1)} slot(s)")
+		return {"type": "welcome", "campaign": self.campaign_path, "heartbeat_interval": self.lease_timeout / 3}
+
+	def _handle(self, worker: str, connection: int, message: Dict) -> Dict:
+		message_type = message.get("type")
+		with self._lock:
+			if message_type == "lease":
+				return self._lease(worker, connection, message.get("stack"))
+			if message_type == "heartbeat":
+				deadline = time.monotonic() + self.lease_timeout
+				for lease in self._leases.values():
+					if lease.connection == connection:
+						lease.deadline = deadline
+				return {"type": "ok"}
+			if message_type == "result":
+				return self._result(worker, message)
+		return {"type": "error", "error": f"Unknown message type [{message_type}]."}
+
+	def _take(self, stack: List[Dict] | None) -> int:
+		if stack is not None:
+			# Sparing the worker a stack restart, as PermutationQueue does for slots
+			for offset, position in enumerate(itertools.islice(self._pending, Coordinator.STACK_LOOKAHEAD)):
+				permutation = self.plan[position]
+				if [permutation.shaper_configuration, permutation.server_configuration] == stack:
+					del self._pending[offset]
+					return position
+		return self._pending.popleft()
+
+	def _lease(self, worker: str, connection: int, stack: List[Dict] | None) -> Dict:
+		if len(self._pending) == 0:
+			if len(self._leases) == 0:
+				return {"type": "done"}
+			# Leases held by other workers might still be queued again
+			return {"type": "wait", "retry": Coordinator.WAIT_INTERVAL}
+		position = self._take(stack)
+		lease = Lease(uuid.uuid4().hex, position, worker, connection, time.monotonic() + self.lease_timeout)
+		self._leases[lease.lease_id] = lease
+		self._attempts[position] = self._attempts.get(position, 0) + 1
+		self._workers[worker]["leased"] += 1
+		permutation = self.plan[position]
+		self.logger.debug(f"Leased [{permutation.log_name}] (run {permutation.run_number}) to worker [{worker}], attempt {self._attempts[position]}")
+		return {
+			"type": "permutation",
+			"lease": lease.lease_id,
+			"position": position,
+			"index": permutation.index,
+			"run_number": permutation.run_number,
+			"client": permutation.client_configuration,
+			"shaper": permutation.shaper_configuration,
+			"server": permutation.server_configuration,
+		}
+
+	def _result(self, worker: str, message: Dict) -> Dict:
+		lease = self._leases.pop(message.get("lease"), None)
+		position = lease.position if lease is not None else message.get("position")
+		if type(position) is not int or position < 0 or position >= len(self.plan):
+			return {"type": "error", "error": f"Result of an unknown permutation [{position}]."}
+		outcome = message.get("outcome")
+		if outcome not in PermutationJournal.OUTCOMES:
+			if lease is not None:
+				self._leases[lease.lease_id] = lease  # Left to the worker to report properly or to expire
+			return {"type": "error", "error": f"Result has an unknown outcome [{outcome}]."}
+		try:
+			started = datetime.fromisoformat(message["started"])
+			finished = datetime.fromisoformat(message["finished"])
+		except (KeyError, TypeError, ValueError):
+			if lease is not None:
+				self._leases[lease.lease_id] = lease
+			return {"type": "error", "error": "Result lacks valid 'started' and 'finished' timestamps."}
+		permutation = self.plan[position]
+		details = message.get("details") if type(message.get("details")) is dict else {}
+		self.journal.record(permutation, outcome, started, finished, None, **{**details, "worker": worker, "worker_log_path": message.get("log_path"), "attempt": self._attempts.get(position, 0)})
+
+		if outcome == PermutationJournal.OUTCOME_COMPLETED:
+			self._workers[worker]["completed"] += 1
+			self._completed.add(position)
+			if position in self._pending:
+				# Queued again after the lease expired, but the worker came through after all
+				self._pending.remove(position)
+			if position in self._abandoned:
+				# Given up on after the lease expired, the late result still counts
+				self._abandoned.remove(position)
+		else:
+			self._workers[worker]["failed"] += 1
+			if lease is not None:
+				self._requeue(position, f"{outcome} on worker [{worker}]")
+		self._check_finished()
+		return {"type": "ok"}
+
+	def _requeue(self, position: int, reason: str) -> None:
+		if position in self._completed or position in self._pending or any(lease.position == position for lease in self._leases.values()):
+			return
+		permutation = self.plan[position]
+		if self._attempts.get(position, 0) >= self.max_attempts:
+			self._abandoned.append(position)
+			self.logger.warning(f"Giving up on [{permutation.log_name}] (run {permutation.run_number}) after {self._attempts[position]} attempt(s), last one {reason}")
+			return
+		# Queued first, it would otherwise be the last permutation of the campaign
+		self._pending.appendleft(position)
+		self.logger.info(f"Queued [{permutation.log_name}] (run {permutation.run_number}) again, {reason}")
+
+	def _release(self, leases: List[Lease], reason: str) -> None:
+		for lease in leases:
+			del self._leases[lease.lease_id]
+			self._workers[lease.worker]["requeued"] += 1
+		for lease in leases:
+			self._requeue(lease.position, reason)
+		self._check_finished()
+
+	def _check_finished(self) -> None:
+		if len(self._pending) == 0 and len(self._leases) == 0:
+			self._finished.set()
+
+	def _disconnected(self, worker: str, connection: int) -> None:
+		with self._lock:
+			state = self._workers[worker]
+			if state["connection"] == connection:
+				state["connected"] = False
+			leases = [lease for lease in self._leases.values() if lease.connection == connection]
+			self._release(leases, f"worker [{worker}] disconnected")
+		self.logger.info(f"Worker [{worker}] disconnected" + (f", {len(leases)} lease(s) queued again" if len(leases) > 0 else ""))
+
+	def _expire_leases(self) -> None:
+		while not self._stop.wait(min(1, self.lease_timeout / 4)):
+			now = time.monotonic()
+			with self._lock:
+				expired = [lease for lease in self._leases.values() if lease.deadline < now]
+				if len(expired) > 0:
+					self._release(expired, "its lease expired without heartbeats")
+
+
+class Worker:
+	"""
+	Leases permutations from a coordinator and runs them with an Experiment, every slot of the experiment holds at most one lease
+	A background heartbeat keeps the leases alive, results are reported as soon as a permutation finished
+	"""
+	CONNECT_TIMEOUT = 10  # seconds
+	REPLY_TIMEOUT = 60  # seconds
+
+	def __init__(self, experiment: "Experiment", address: str, port: int = Coordinator.DEFAULT_PORT, name: str | None = None) -> None:
+		self.experiment = experiment
+		self.address = address
+		self.port = port
+		self.name = _WORKER_NAME_UNSAFE.sub("-", name if name is not None else f"{socket.gethostname()}-{os.getpid()}")
+		self.heartbeat_interval = Coordinator.DEFAULT_LEASE_TIMEOUT / 3
+
+		self._socket: socket.socket | None = None
+		self._fp = None
+		self._lock = threading.Lock()  # One request and its reply at a time, slots and the heartbeat share the connection
+		self._leases: Dict[str, Tuple[str, int]] = {}  # Journal key => (lease id, position)
+		self._stack: List[Dict] | None = None
+		self._stop = threading.Event()
+		self._heartbeat_thread: threading.Thread | None = None
+		self.logger = logging.getLogger("root.Worker")
+
+	def _request(self, message: Dict) -> Dict:
+		with self._lock:
+			if self._fp is None:
+				raise VegvisirCoordinationException(f"Not connected to coordinator {self.address}:{self.port}.")
+			try:
+				self._fp.write((json.dumps(message) + "\n").encode())
+				self._fp.flush()
+				line = self._fp.readline()
+			except OSError as e:
+				raise VegvisirCoordinationException(f"Connection to coordinator {self.address}:{self.port} failed | {e}")
+		if len(line) == 0:
+			raise VegvisirCoordinationException(f"Coordinator {self.address}:{self.port} closed the connection.")
+		try:
+			reply = json.loads(line)
+		except ValueError as e:
+			raise VegvisirCoordinationException(f"Coordinator {self.address}:{self.port} sent a malformed reply | {e}")
+		if reply.get("type") == "error":
+			raise VegvisirCoordinationException(f"Coordinator {self.address}:{self.port} refused [{message.get('type')}] | {reply.get('error')}")
+		return reply
+
+	def connect(self) -> Dict:
+		try:
+			self._socket = socket.create_connection((self.address, self.port), timeout=Worker.CONNECT_TIMEOUT)
+		except OSError as e:
+			raise VegvisirCoordinationException(f"Could not connect to coordinator {self.address}:{self.port} | {e}")
+		self._socket.settimeout(Worker.REPLY_TIMEOUT)
+		self._fp = self._socket.makefile("rwb")
+		welcome = self._request({
+			"type": "hello",
+			"version": PROTOCOL_VERSION,
+			"worker": self.name,
+			"digest": configuration_digest(self.experiment.configuration),
+			"slots": self.experiment.configuration.parallel_slots,
+		})
+		self.heartbeat_interval = welcome["heartbeat_interval"]
+		self.logger.info(f"Connected to coordinator {self.address}:{self.port} as worker [{self.name}], campaign [{welcome['campaign']}]")
+		return welcome
+
+	def close(self) -> None:
+		self._stop.set()
+		if self._heartbeat_thread is not None:
+			self._heartbeat_thread.join()
+			self._heartbeat_thread = None
+		with self._lock:
+			if self._fp is not None:
+				try:
+					self._fp.close()
+					self._socket.close()
+				except OSError:
+					pass
+				self._fp = None
+				self._socket = None
+
+	def permutations(self) -> Iterator[ExperimentPermutation]:
+		"""
+		Leased permutations, ends once the coordinator has none left
+		"""
+		while not self._stop.is_set():
+			reply = self._request({"type": "lease", "stack": self._stack})
+			if reply["type"] == "done":
+				return
+			if reply["type"] == "wait":
+				self._stop.wait(reply.get("retry", Coordinator.WAIT_INTERVAL))
+				continue
+			permutation = ExperimentPermutation(reply["index"], reply["run_number"], reply["client"], reply["shaper"], reply["server"])
+			self._leases[PermutationJournal.key(permutation)] = (reply["lease"], reply["position"])
+			self._stack = [permutation.shaper_configuration, permutation.server_configuration]
+			yield permutation
+
+	def _report(self, permutation: ExperimentPermutation, entry: Dict) -> None:
+		lease = self._leases.pop(PermutationJournal.key(permutation), None)
+		if lease is None:
+			return
+		lease_id, position = lease
+		details = {key: value for key, value in entry.items() if key not in ["key", "identity", "outcome", "started", "finished", "duration", "log_path"]}
+		log_path = os.path.join(self.experiment.configuration.path_collection.log_path_date, entry["log_path"]) if entry.get("log_path") is not None else None
+		self._request({
+			"type": "result",
+			"lease": lease_id,
+			"position": position,
+			"outcome": entry["outcome"],
+			"started": entry["started"],
+			"finished": entry["finished"],
+			"log_path": f"{socket.gethostname()}:{log_path}" if log_path is not None else None,
+			"details": details,
+		})
+
+	def _heartbeat(self) -> None:
+		while not self._stop.wait(self.heartbeat_interval):
+			try:
+				self._request({"type": "heartbeat"})
+			except VegvisirCoordinationException as e:
+				if len(self._leases) > 0:
+					self.logger.warning(f"Heartbeat failed, leases of this worker will expire | {e}")
+				return
+
+	def run(self) -> Iterator[Tuple]:
+		"""
+		Connect and run leased permutations until the coordinator runs out, yields the progress of Experiment.run
+		"""
+		self._stop.clear()
+		self.connect()
+		self.experiment.add_result_observer(self._report)
+		self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="WorkerHeartbeat", daemon=True)
+		self._heartbeat_thread.start()
+		try:
+			yield from self.experiment.run(permutations=self.permutations(), log_suffix=f"worker-{self.name}")
+		finally:
+			self.close()
@@ -1,6 +1,7 @@
 import dataclasses
+import subprocess
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Tuple
 
 
 @dataclass
@@ -25,6 +26,111 @@ class ExperimentPaths:
     www_path: str | None = None
 
 
+@dataclass
+class CertificateSettings:
+    """
+    Certificate chain generation settings of an experiment
+
+    """
+    key_type: str = "rsa"  # rsa, ecdsa or ed25519
+    chain_length: int = 1
+    fresh_per_run: bool = True  # False hands out one cached chain to every run
+    pool_size: int = 2  # Number of chains generated ahead of demand, parallel_slots + 1 unless configured (cf. Configuration)
+
+
+@dataclass
+class SchedulerSettings:
+    """
+    Permutation ordering settings of an experiment
+
+    """
+    strategy: str = "grouped"  # grouped, round-robin or randomized
+    seed: int | None = None  # Only used by the randomized strategy, drawn at random when absent
+
+
+@dataclass
+class MetricsSettings:
+    """
+    Campaign metrics exporter settings of an experiment
+
+    """
+    enabled: bool = False
+    address: str = "127.0.0.1"  # Only reachable from the host itself by default
+    port: int = 9464  # 0 binds an ephemeral port
+
+
+@dataclass
+class ResourceSamplingSettings:
+    """
+    Container resource sampling settings of an experiment
+
+    """
+    enabled: bool = False
+    interval: float = 0.1  # seconds, at least 0.01
+
+
+@dataclass
+class ExperimentPermutation:
+    """
+    Single client, shaper and server combination for one iteration of an experiment
+
+    """
+    index: int
+    run_number: int
+    client_configuration: Dict
+    shaper_configuration: Dict
+    server_configuration: Dict
+
+    @property
+    def client_log_name(self) -> str:
+        return self.client_configuration.get("log_name", self.client_configuration["name"])
+
+    @property
+    def shaper_log_name(self) -> str:
+        return self.shaper_configuration.get("log_name", self.shaper_configuration["name"])
+
+    @property
+    def server_log_name(self) -> str:
+        return self.server_configuration.get("log_name", self.server_configuration["name"])
+
+    @property
+    def log_name(self) -> str:
+        return f"{self.client_log_name}__{self.shaper_log_name}__{self.server_log_name}"
+
+
+@dataclass
+class CommandResult:
+    """
+    Outcome of a host command issued through the (async) HostInterface
+    HostInterface.spawn_blocking_subprocess used to return a Popen or CompletedProcess, their common members are kept for existing callers
+
+    """
+    command: str
+    returncode: int | None
+    stdout: str = ""
+    stderr: str = ""
+    duration: float = 0.0  # seconds
+    timed_out: bool = False
+
+    @property
+    def args(self) -> str:
+        return self.command
+
+    def poll(self) -> int | None:
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int | None:
+        # The command already finished
+        return self.returncode
+
+    def communicate(self, input=None, timeout: float | None = None) -> Tuple[str, str]:
+        return self.stdout, self.stderr
+
+    def check_returncode(self) -> None:
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.command, self.stdout, self.stderr)
+
+
 @dataclass
 class VegvisirArguments:
     """
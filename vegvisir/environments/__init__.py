@@ -7,5 +7,15 @@ available_environments = {
 
 available_sensors = {
     "timeout": sensors.TimeoutSensor,
-    "browser-file-watchdog": sensors.BrowserDownloadWatchdogSensor
+    "browser-file-watchdog": sensors.BrowserDownloadWatchdogSensor,
+    "qlog-completion": sensors.QlogCompletionSensor,
+    "pcap-idle": sensors.PcapIdleSensor
+}
+
+# Combinators of the experiment its environment.sensors, their "sensors" key holds the combined sensor configurations
+sensor_expressions = {
+    "any": sensors.AnySensor,
+    "all": sensors.AllSensor,
+    "k-of-n": sensors.KOfNSensor,
+    "then": sensors.ThenSensor
 }
@@ -3,7 +3,7 @@ import subprocess
 import threading
 from ast import List
 from enum import Enum
-from typing import Tuple
+from typing import Dict, Tuple
 
 from vegvisir.data import ExperimentPaths
 from vegvisir.environments import sensors
@@ -30,6 +30,8 @@ class BaseEnvironment:
 		self.environment_name:str = ""
 		self.sensors:List[sensors.ABCSensor] = []
 		self.sync_semaphore = None
+		self.triggered_sensor: sensors.ABCSensor | None = None  # Leaf sensor that ended the last run
+		self._trigger_lock = threading.Lock()
 
 	def get_QIR_compatibility_testcase(self, perspective: Perspective) -> str:
 		if perspective == BaseEnvironment.Perspective.CLIENT:
@@ -48,8 +50,8 @@ class BaseEnvironment:
 			self._QIR_compatibility_testcase_client = testcase
 			self._QIR_compatibility_testcase_server = testcase
 
-	def generate_cert_chain(self, directory: str, length: int = 1):
-		cmd = "./certs.sh " + directory + " " + str(length)
+	def generate_cert_chain(self, directory: str, length: int = 1, key_type: str = "rsa"):
+		cmd = "./certs.sh " + directory + " " + str(length) + " " + key_type
 		r = subprocess.run(
 			cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
 		)
@@ -78,23 +80,38 @@ class BaseEnvironment:
 		# Instead of relying on Thread.join(), we work around it by using a semaphore.
 		# Any sensor can trigger a .release() which would indicate a sensor has triggered
 		self.sync_semaphore = threading.Semaphore(0)
+		self.triggered_sensor = None
 
 		for sensor in self.sensors:
-			sensor.setup(process_to_monitor, self.forcestop_sensors, self.sync_semaphore, path_collection)
-			sensor.thread.start()
+			sensor.setup(process_to_monitor, self.forcestop_sensors, sensors.TriggerSignal(lambda sensor=sensor: self._sensor_triggered(sensor)), path_collection)
+			sensor.start()
+
+	def _sensor_triggered(self, sensor: sensors.ABCSensor) -> None:
+		with self._trigger_lock:
+			if self.triggered_sensor is None:
+				self.triggered_sensor = sensor.triggered_by or sensor
+		self.sync_semaphore.release()
+
+	def trigger_details(self) -> Dict | None:
+		"""
+		Leaf sensor that ended the last run (its position in the configured sensors, type and reason), None when the run got aborted
+		"""
+		sensor = self.triggered_sensor
+		if sensor is None:
+			return None
+		return {"sensor": sensor.label, "type": type(sensor).__name__, "reason": sensor.trigger_reason}
 
 	def forcestop_sensors(self) -> None:
 		for sensor in self.sensors:
-			sensor.terminate_sensor = True
+			sensor.stop()
 
 	def waitfor_sensors(self) -> None:
 		self.sync_semaphore.acquire()
 		
 	def clean_and_reset_sensors(self) -> None:
 		for sensor in self.sensors:
-			if sensor.thread.is_alive():
-				sensor.thread.join()
-			sensor.terminate_sensor = True
+			sensor.join()
+			sensor.stop()
 
 
 	def pre_run_hook(self, paths: ExperimentPaths):
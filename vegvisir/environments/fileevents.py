@@ -0,0 +1,182 @@
+import fnmatch
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+import pyinotify
+
+from vegvisir.environments.reactor import SensorReactor, reactor
+
+
+@dataclass
+class FileEvent:
+	directory: str
+	name: str
+	kind: str  # One of the FileEventService event kinds
+	size: int | None = None  # Only determined for subscriptions with a size threshold
+
+	@property
+	def path(self) -> str:
+		return os.path.join(self.directory, self.name)
+
+
+class FileSubscription:
+	def __init__(self, service: "FileEventService", directory: str, callback: Callable[[FileEvent], None], kinds: List[str], patterns: List[str] | None, min_size: int | None) -> None:
+		self.service = service
+		self.directory = directory
+		self.callback = callback
+		self.kinds = kinds
+		self.patterns = patterns
+		self.min_size = min_size
+		self.cancelled = False
+
+	def matches(self, kind: str, name: str) -> bool:
+		if self.cancelled or kind not in self.kinds:
+			return False
+		return self.patterns is None or any(fnmatch.fnmatchcase(name, pattern) for pattern in self.patterns)
+
+	def cancel(self) -> None:
+		self.service.unsubscribe(self)
+
+
+class FileEventService:
+	"""
+	Campaign-wide inotify service for file-based sensors
+	One inotify fd is shared by all subscriptions and read by the sensor reactor, subscribing only adds (or reference counts) a directory watch
+	Callbacks run on the reactor thread and receive a FileEvent for every file in the directory matching the subscription filters
+	"""
+	CREATED = "created"
+	MOVED_TO = "moved_to"
+	MODIFIED = "modified"
+	CLOSED = "closed"  # Closed after being opened for writing
+	EXISTING = "existing"  # Delivered once on subscription for files that are present already
+
+	_MASKS = {
+		CREATED: pyinotify.IN_CREATE,
+		MOVED_TO: pyinotify.IN_MOVED_TO,
+		MODIFIED: pyinotify.IN_MODIFY,
+		CLOSED: pyinotify.IN_CLOSE_WRITE,
+	}
+
+	def __init__(self, event_reactor: SensorReactor = reactor) -> None:
+		self.reactor = event_reactor
+		self._lock = threading.RLock()
+		self._watch_manager: pyinotify.WatchManager | None = None
+		self._notifier: pyinotify.Notifier | None = None
+		self._subscriptions: Dict[str, List[FileSubscription]] = {}
+		self._watches: Dict[str, int] = {}  # directory => watch descriptor
+		self._pending: List[pyinotify.Event] = []
+		self.logger = logging.getLogger("root.FileEventService")
+
+	def _ensure_running(self) -> None:
+		if self._watch_manager is not None:
+			return
+		service = self
+
+		class EventCollector(pyinotify.ProcessEvent):
+			def process_default(self, event):
+				service._pending.append(event)
+
+		self._watch_manager = pyinotify.WatchManager()
+		self._notifier = pyinotify.Notifier(self._watch_manager, EventCollector())
+		self.reactor.add_reader(self._watch_manager.get_fd(), self._read_events)
+
+	def _mask(self, directory: str) -> int:
+		mask = 0
+		for subscription in self._subscriptions.get(directory, []):
+			for kind in subscription.kinds:
+				mask |= FileEventService._MASKS.get(kind, 0)
+		return mask
+
+	def _update_watch(self, directory: str) -> None:
+		mask = self._mask(directory)
+		wd = self._watches.get(directory)
+		if mask == 0:
+			if wd is not None:
+				del self._watches[directory]
+				# The watch is gone already when the directory was removed
+				self._watch_manager.rm_watch(wd, quiet=True)
+			return
+		if wd is None:
+			self._watches[directory] = self._watch_manager.add_watch(directory, mask, quiet=False)[directory]
+		else:
+			self._watch_manager.update_watch(wd, mask, quiet=True)
+
+	def subscribe(self, directory: str, callback: Callable[[FileEvent], None], kinds: List[str] = [CREATED, MOVED_TO], patterns: str | List[str] | None = None, min_size: int | None = None) -> FileSubscription:
+		"""
+		Subscribe to events of the files in directory (not recursive)
+		patterns are glob patterns the file name needs to match, min_size only passes events of files of at least min_size bytes
+		Raises pyinotify.WatchManagerError when the directory can not be watched
+		"""
+		directory = os.path.abspath(directory)
+		subscription = FileSubscription(self, directory, callback, list(kinds), [patterns] if type(patterns) is str else patterns, min_size)
+		with self._lock:
+			self._ensure_running()
+			self._subscriptions.setdefault(directory, []).append(subscription)
+			try:
+				self._update_watch(directory)
+			except pyinotify.WatchManagerError:
+				self._subscriptions[directory].remove(subscription)
+				raise
+
+		if FileEventService.EXISTING in subscription.kinds:
+			# Files created before the watch was added would otherwise go unnoticed
+			try:
+				names = sorted(os.listdir(directory))
+			except OSError:
+				names = []
+			self.reactor.call_soon(lambda: [self._deliver(subscription, FileEventService.EXISTING, name) for name in names])
+		return subscription
+
+	def unsubscribe(self, subscription: FileSubscription) -> None:
+		with self._lock:
+			if subscription.cancelled:
+				return
+			subscription.cancelled = True
+			subscriptions = self._subscriptions.get(subscription.directory, [])
+			if subscription in subscriptions:
+				subscriptions.remove(subscription)
+			if len(subscriptions) == 0:
+				self._subscriptions.pop(subscription.directory, None)
+			self._update_watch(subscription.directory)
+
+	def _deliver(self, subscription: FileSubscription, kind: str, name: str) -> None:
+		if not subscription.matches(kind, name):
+			return
+		event = FileEvent(subscription.directory, name, kind)
+		if subscription.min_size is not None:
+			try:
+				event.size = os.stat(event.path).st_size
+			except OSError:
+				return
+			if event.size < subscription.min_size:
+				return
+		subscription.callback(event)
+
+	def _read_events(self) -> None:
+		with self._lock:
+			self._notifier.read_events()
+			self._notifier.process_events()
+			events, self._pending = self._pending, []
+			deliveries = []
+			for event in events:
+				if event.mask & pyinotify.IN_IGNORED:
+					# Watched directory got removed (e.g., output of an earlier attempt), a new subscription needs a new watch
+					self._watches.pop(os.path.abspath(event.path), None)
+					continue
+				if event.dir or not event.name:
+					continue
+				kind = next((kind for kind, mask in FileEventService._MASKS.items() if event.mask & mask), None)
+				if kind is None:
+					continue
+				for subscription in self._subscriptions.get(os.path.abspath(event.path), []):
+					deliveries.append((subscription, kind, event.name))
+		# Outside of the lock, callbacks are free to (un)subscribe
+		for subscription, kind, name in deliveries:
+			self._deliver(subscription, kind, name)
+
+
+# Shared by the file-based sensors of all slots
+file_events = FileEventService()
@@ -0,0 +1,119 @@
+import logging
+import struct
+from typing import List, Tuple
+
+# Magic numbers of the pcap global header, microsecond and nanosecond timestamp resolution
+_PCAP_MAGIC = {
+	b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+	b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+	b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+	b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+_PCAPNG_SECTION_HEADER = b"\x0a\x0d\x0d\x0a"
+_PCAPNG_PACKET_BLOCKS = [0x00000002, 0x00000003, 0x00000006]  # Obsolete, simple and enhanced packet blocks
+
+
+class PcapTail:
+	"""
+	Follows a single packet capture (pcap or pcapng) as it grows, only appended records are read
+	Incomplete records at the end of the file are kept until the rest of them has been written
+	"""
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self.packets = 0
+		self.bytes = 0  # Original length of all packets read so far
+		self._file = None
+		self._buffer = b""
+		self._format: str | None = None  # "pcap" or "pcapng", known once the first bytes are in
+		self._byte_order = "<"
+		self._resolution = 1e-6
+		self._corrupt = False
+
+	def read(self) -> List[Tuple[float | None, int]]:
+		"""
+		Read the records appended since the previous call, returns the (timestamp, original length) of every new packet
+		Timestamps of pcapng packets are not decoded (None)
+		"""
+		if self._corrupt:
+			return []
+		if self._file is None:
+			try:
+				self._file = open(self.path, "rb")
+			except OSError:
+				return []
+		appended = self._file.read()
+		if len(appended) == 0:
+			return []
+		self._buffer += appended
+
+		if self._format is None and not self._read_header():
+			return []
+		packets = self._read_pcap_records() if self._format == "pcap" else self._read_pcapng_blocks()
+		self.packets += len(packets)
+		self.bytes += sum(length for _, length in packets)
+		return packets
+
+	def _read_header(self) -> bool:
+		if len(self._buffer) < 4:
+			return False
+		magic = self._buffer[:4]
+		if magic == _PCAPNG_SECTION_HEADER:
+			# Section header blocks are handled along with all other blocks
+			self._format = "pcapng"
+			return True
+		if magic not in _PCAP_MAGIC:
+			logging.warning(f"[{self.path}] is neither a pcap nor a pcapng file, ignoring it")
+			self._corrupt = True
+			return False
+		if len(self._buffer) < 24:
+			return False
+		self._format = "pcap"
+		self._byte_order, self._resolution = _PCAP_MAGIC[magic]
+		self._buffer = self._buffer[24:]
+		return True
+
+	def _read_pcap_records(self) -> List[Tuple[float, int]]:
+		packets = []
+		offset = 0
+		header = struct.Struct(self._byte_order + "IIII")
+		while len(self._buffer) - offset >= header.size:
+			seconds, fraction, captured_length, original_length = header.unpack_from(self._buffer, offset)
+			if len(self._buffer) - offset - header.size < captured_length:
+				break
+			packets.append((seconds + fraction * self._resolution, original_length))
+			offset += header.size + captured_length
+		self._buffer = self._buffer[offset:]
+		return packets
+
+	def _read_pcapng_blocks(self) -> List[Tuple[None, int]]:
+		packets = []
+		offset = 0
+		while len(self._buffer) - offset >= 12:
+			block_type = self._buffer[offset:offset + 4]
+			if block_type == _PCAPNG_SECTION_HEADER:
+				# Byte order of the section follows from its byte-order magic
+				self._byte_order = "<" if self._buffer[offset + 8:offset + 12] == b"\x4d\x3c\x2b\x1a" else ">"
+			block_type, block_length = struct.unpack_from(self._byte_order + "II", self._buffer, offset)
+			if block_length < 12:
+				logging.warning(f"[{self.path}] contains a malformed pcapng block, no longer reading it")
+				self._corrupt = True
+				break
+			if len(self._buffer) - offset < block_length:
+				break
+			if block_type in _PCAPNG_PACKET_BLOCKS:
+				original_length = 0
+				if block_type == 0x00000006 and block_length >= 32:
+					original_length = struct.unpack_from(self._byte_order + "I", self._buffer, offset + 24)[0]
+				elif block_type == 0x00000003:
+					original_length = struct.unpack_from(self._byte_order + "I", self._buffer, offset + 8)[0]
+				elif block_type == 0x00000002 and block_length >= 28:
+					original_length = struct.unpack_from(self._byte_order + "I", self._buffer, offset + 24)[0]
+				packets.append((None, original_length))
+			offset += block_length
+		self._buffer = self._buffer[offset:]
+		return packets
+
+	def close(self) -> None:
+		if self._file is not None:
+			self._file.close()
+			self._file = None
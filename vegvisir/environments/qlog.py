@@ -0,0 +1,185 @@
+import codecs
+import json
+import logging
+import re
+from typing import Dict, List, Tuple
+
+# Event fields of draft-01 qlogs that do not define "event_fields" themselves
+_DEFAULT_EVENT_FIELDS = ["relative_time", "category", "event", "data"]
+
+
+def normalize_event(event: Dict | List, event_fields: List[str] = _DEFAULT_EVENT_FIELDS) -> Tuple[str, Dict]:
+	"""
+	Name ("category:event") and data of a qlog event, both object events (draft-02 and later) and array events (draft-01) are understood
+	"""
+	if type(event) is dict:
+		return str(event.get("name", "")), event.get("data") or {}
+	fields = dict(zip(event_fields, event))
+	return f"{fields.get('category', '')}:{fields.get('event', '')}", fields.get("data") or {}
+
+
+class JsonSeqScanner:
+	"""
+	Incremental parser of JSON Text Sequences (RFC 7464, .sqlog), records are separated by the RS character
+	"""
+	RECORD_SEPARATOR = "\x1e"
+
+	def __init__(self) -> None:
+		self._buffer = ""
+
+	def feed(self, text: str) -> List[Dict | List]:
+		self._buffer += text
+		records = self._buffer.split(JsonSeqScanner.RECORD_SEPARATOR)
+		# The last record might still be written
+		self._buffer = records.pop()
+		if self._buffer.endswith("\n"):
+			records.append(self._buffer)
+			self._buffer = ""
+		values = []
+		for record in records:
+			record = record.strip()
+			if len(record) == 0:
+				continue
+			try:
+				values.append(json.loads(record))
+			except json.JSONDecodeError:
+				logging.debug(f"Skipping malformed JSON-SEQ record [{record[:64]}]")
+		return values
+
+
+class JsonEventScanner:
+	"""
+	Incremental scanner of (possibly still incomplete) JSON qlogs, yields the elements of every "events" array as soon as they are complete
+	Only the text of the element currently being written is buffered, the document is never parsed as a whole
+	"""
+	_STRUCTURAL = re.compile(r'["{}\[\]:,]')
+	_STRING_SPECIAL = re.compile(r'["\\]')
+	_DECODER = json.JSONDecoder()
+
+	def __init__(self) -> None:
+		self._buffer = ""
+		self._position = 0  # Next character of the buffer to scan
+		self._stack: List[str] = []
+		self._in_string = False
+		self._escaped = False
+		self._string_start = 0
+		self._last_string: str | None = None
+		self._after_key = False  # Last significant token is a colon following _last_string
+		self._events_depths: List[int] = []  # Stack depths of the "events" arrays that are open
+		self._element_start: int | None = None
+
+	def feed(self, text: str) -> List[Dict | List]:
+		self._buffer += text
+		values = []
+		buffer = self._buffer
+		position = self._position
+		while position < len(buffer):
+			if self._escaped:
+				self._escaped = False
+				position += 1
+				continue
+			# Jump to the next character that matters in the current state
+			match = (JsonEventScanner._STRING_SPECIAL if self._in_string else JsonEventScanner._STRUCTURAL).search(buffer, position)
+			if match is None:
+				position = len(buffer)
+				break
+			position = match.start()
+			character = buffer[position]
+			if self._in_string:
+				if character == "\\":
+					self._escaped = True
+				elif character == "\"":
+					self._in_string = False
+					# Only short strings can be keys of interest
+					self._last_string = buffer[self._string_start + 1:position] if position - self._string_start <= 16 else None
+			elif character == "\"":
+				self._in_string = True
+				self._string_start = position
+				self._after_key = False
+			elif character == ":":
+				self._after_key = True
+			elif character in "{[":
+				if character == "[" and self._after_key and self._last_string == "events" and self._element_start is None:
+					self._events_depths.append(len(self._stack) + 1)
+				elif len(self._events_depths) > 0 and len(self._stack) == self._events_depths[-1] and self._element_start is None:
+					# Complete events are decoded in one go, only an event that is still being written is scanned character by character
+					try:
+						value, position = JsonEventScanner._DECODER.raw_decode(buffer, position)
+						values.append(value)
+						self._after_key = False
+						continue
+					except json.JSONDecodeError:
+						self._element_start = position
+				self._stack.append(character)
+				self._after_key = False
+			elif character in "}]":
+				if len(self._stack) > 0:
+					self._stack.pop()
+				if len(self._events_depths) > 0 and len(self._stack) == self._events_depths[-1] and self._element_start is not None:
+					try:
+						values.append(json.loads(buffer[self._element_start:position + 1]))
+					except json.JSONDecodeError:
+						pass
+					self._element_start = None
+				elif len(self._events_depths) > 0 and len(self._stack) < self._events_depths[-1]:
+					self._events_depths.pop()
+				self._after_key = False
+			elif character == ",":
+				self._after_key = False
+			position += 1
+
+		# Drop everything that has been scanned and is not part of a pending element or string
+		keep_from = position
+		if self._element_start is not None:
+			keep_from = self._element_start
+		elif self._in_string:
+			keep_from = self._string_start
+		self._buffer = buffer[keep_from:]
+		self._position = position - keep_from
+		if self._element_start is not None:
+			self._element_start -= keep_from
+		if self._in_string:
+			self._string_start -= keep_from
+		return values
+
+
+class QlogTail:
+	"""
+	Follows a single qlog file as it grows, only appended bytes are read
+	Files ending in .sqlog, or starting with the RS character, are read as JSON-SEQ, all others as JSON
+	"""
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self._file = None
+		self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+		self._scanner: JsonSeqScanner | JsonEventScanner | None = JsonSeqScanner() if path.endswith(".sqlog") else None
+		self._event_fields = _DEFAULT_EVENT_FIELDS
+
+	def read(self) -> List[Tuple[str, Dict]]:
+		"""
+		Read the bytes appended since the previous call, returns the (name, data) of every event completed in the meantime
+		"""
+		if self._file is None:
+			try:
+				self._file = open(self.path, "rb")
+			except OSError:
+				return []
+		text = self._decoder.decode(self._file.read())
+		if len(text) == 0:
+			return []
+		if self._scanner is None:
+			self._scanner = JsonSeqScanner() if text.lstrip().startswith(JsonSeqScanner.RECORD_SEPARATOR) else JsonEventScanner()
+
+		events = []
+		for value in self._scanner.feed(text):
+			if type(self._scanner) is JsonSeqScanner and type(value) is dict and "name" not in value:
+				# Header record of the sequence
+				self._event_fields = value.get("trace", {}).get("event_fields", self._event_fields)
+				continue
+			events.append(normalize_event(value, self._event_fields))
+		return events
+
+	def close(self) -> None:
+		if self._file is not None:
+			self._file.close()
+			self._file = None
@@ -0,0 +1,180 @@
+import heapq
+import itertools
+import logging
+import os
+import selectors
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Tuple
+
+
+class ReactorHandle:
+	"""
+	Registration of a callback on the reactor, cancelling it guarantees the callback is not called afterwards (unless it is running already)
+	"""
+	def __init__(self, callback: Callable[[], None], cleanup: Callable[[], None] | None = None) -> None:
+		self._callback = callback
+		self._cleanup = cleanup
+		self.cancelled = False
+
+	def cancel(self) -> None:
+		if self.cancelled:
+			return
+		self.cancelled = True
+		if self._cleanup is not None:
+			self._cleanup()
+
+	def _run(self) -> None:
+		if not self.cancelled:
+			self._callback()
+
+
+class SensorReactor:
+	"""
+	Single event loop driving the sensors of every slot, instead of one polling thread per sensor
+	Sensors register timers (monotonic clock, millisecond precision), readable file descriptors and process exits (through pidfds)
+	The loop runs on a daemon thread which is started on first use and lives as long as the campaign, callbacks should therefore never block
+	"""
+	PROCESS_POLL_INTERVAL = 0.05  # seconds, only used when pidfds are not supported (Linux < 5.3)
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._ready: Deque[ReactorHandle] = deque()
+		self._timers: List[Tuple[float, int, ReactorHandle]] = []
+		self._sequence = itertools.count()
+		self._selector: selectors.BaseSelector | None = None
+		self._wakeup: Tuple[int, int] | None = None
+		self._thread: threading.Thread | None = None
+		self.logger = logging.getLogger("root.SensorReactor")
+
+	def _ensure_running(self) -> None:
+		with self._lock:
+			if self._thread is not None:
+				return
+			self._selector = selectors.DefaultSelector()
+			# Self-pipe, wakes the loop when callbacks are scheduled from other threads
+			self._wakeup = os.pipe()
+			os.set_blocking(self._wakeup[0], False)
+			os.set_blocking(self._wakeup[1], False)
+			self._selector.register(self._wakeup[0], selectors.EVENT_READ, ReactorHandle(self._drain_wakeup))
+			self._thread = threading.Thread(target=self._run, name="SensorReactor", daemon=True)
+			self._thread.start()
+
+	def _drain_wakeup(self) -> None:
+		try:
+			while os.read(self._wakeup[0], 4096):
+				pass
+		except BlockingIOError:
+			pass
+
+	def _wake(self) -> None:
+		if threading.current_thread() is self._thread:
+			return
+		try:
+			os.write(self._wakeup[1], b"\0")
+		except BlockingIOError:
+			pass  # Pipe is full, the loop is bound to wake up anyway
+
+	def _dispatch(self, handle: ReactorHandle) -> None:
+		try:
+			handle._run()
+		except Exception as e:
+			self.logger.exception(f"Sensor callback raised an exception | {e}")
+
+	def _run(self) -> None:
+		while True:
+			with self._lock:
+				if len(self._ready) > 0:
+					timeout = 0
+				elif len(self._timers) > 0:
+					timeout = max(0, self._timers[0][0] - time.monotonic())
+				else:
+					timeout = None
+			for key, _ in self._selector.select(timeout):
+				self._dispatch(key.data)
+
+			now = time.monotonic()
+			with self._lock:
+				due = []
+				while len(self._timers) > 0 and self._timers[0][0] <= now:
+					due.append(heapq.heappop(self._timers)[2])
+				ready = list(self._ready)
+				self._ready.clear()
+			for handle in ready + due:
+				self._dispatch(handle)
+
+	def call_soon(self, callback: Callable[[], None]) -> ReactorHandle:
+		handle = ReactorHandle(callback)
+		self._ensure_running()
+		with self._lock:
+			self._ready.append(handle)
+		self._wake()
+		return handle
+
+	def call_later(self, delay: float, callback: Callable[[], None]) -> ReactorHandle:
+		handle = ReactorHandle(callback)
+		self._ensure_running()
+		with self._lock:
+			heapq.heappush(self._timers, (time.monotonic() + delay, next(self._sequence), handle))
+		self._wake()
+		return handle
+
+	def add_reader(self, fd: int, callback: Callable[[], None], on_close: Callable[[], None] | None = None) -> ReactorHandle:
+		"""
+		Call callback whenever fd is readable, until the handle is cancelled
+		Selector registrations are only touched by the loop thread, on_close (e.g., closing fd) runs on the loop thread after fd is unregistered
+		"""
+		def unregister():
+			try:
+				self._selector.unregister(fd)
+			except (KeyError, ValueError):
+				pass
+			if on_close is not None:
+				on_close()
+
+		handle = ReactorHandle(callback, lambda: self.call_soon(unregister))
+		self.call_soon(lambda: self._selector.register(fd, selectors.EVENT_READ, handle) if not handle.cancelled else None)
+		return handle
+
+	def watch_process(self, process: subprocess.Popen, callback: Callable[[], None]) -> ReactorHandle:
+		"""
+		Call callback once, as soon as process exited
+		"""
+		if process.poll() is not None:
+			return self.call_soon(callback)
+		try:
+			pidfd = os.pidfd_open(process.pid)
+		except (AttributeError, OSError):
+			return self._poll_process(process, callback)
+
+		handle = None
+
+		def exited():
+			handle.cancel()
+			callback()
+
+		handle = self.add_reader(pidfd, exited, lambda: os.close(pidfd))
+		return handle
+
+	def _poll_process(self, process: subprocess.Popen, callback: Callable[[], None]) -> ReactorHandle:
+		timer = None
+		handle = ReactorHandle(callback, lambda: timer.cancel())
+
+		def poll():
+			nonlocal timer
+			if handle.cancelled:
+				return
+			if process.poll() is not None:
+				handle.cancel()
+				callback()
+				return
+			timer = self.call_later(SensorReactor.PROCESS_POLL_INTERVAL, poll)
+
+		timer = self.call_soon(poll)
+		return handle
+
+
+# Shared by the sensors of all slots
+reactor = SensorReactor()
@@ -1,113 +1,548 @@
+import glob
 import logging
+import os
 import subprocess
 import threading
 import time
-from datetime import datetime
-from typing import List
+from typing import Callable, Dict, List, Set
 
 import pyinotify
 
+from vegvisir import metrics
 from vegvisir.data import ExperimentPaths
+from vegvisir.environments.fileevents import (FileEvent, FileEventService,
+                                              FileSubscription, file_events)
+from vegvisir.environments.pcap import PcapTail
+from vegvisir.environments.qlog import QlogTail
+from vegvisir.environments.reactor import ReactorHandle, reactor
+from vegvisir.tracing import tracer
 
 
 class ABCSensor:
+	"""
+	Thread based sensor, thread_target runs on a thread of its own for every run
+	Prefer ReactorSensor for new sensors, ABCSensor remains for sensors that need to block
+	"""
 	def __init__(self) -> None:
 		self.thread: threading.Thread = None
 		self.terminate_sensor = False
+		self.trigger_reason: str | None = None  # Set by sensors right before they end a run
+		self.label = type(self).__name__  # Position of the sensor in the experiment configuration, set when the sensor is created from it
+		self.parent: "SensorExpression | None" = None
+
+	@property
+	def triggered_by(self) -> "ABCSensor | None":
+		"""
+		Leaf sensor that caused this sensor to trigger
+		"""
+		return self if self.trigger_reason is not None else None
 
 	def setup(self, process_to_monitor: subprocess.Popen, actuator, sync_semaphore: threading.Thread, path_collection: ExperimentPaths):
-		self.thread = threading.Thread(target=self.thread_target, args=(process_to_monitor, actuator, sync_semaphore,))
+		self.thread = threading.Thread(target=self._traced_thread_target, args=(process_to_monitor, actuator, sync_semaphore,), name=type(self).__name__)
 		self.terminate_sensor = False
+		self.trigger_reason = None
 		self.path_collection = path_collection
 
+	def start(self) -> None:
+		self.thread.start()
+
+	def stop(self) -> None:
+		self.terminate_sensor = True
+
+	def join(self) -> None:
+		if self.thread is not None and self.thread.is_alive():
+			self.thread.join()
+
+	def _record_finish(self, start: float) -> None:
+		args = {}
+		if self.trigger_reason is not None:
+			args["reason"] = self.trigger_reason
+			metrics.sensor_triggers_total.inc(sensor=type(self).__name__, reason=self.trigger_reason)
+		tracer.record(type(self).__name__, "sensor", start, time.time(), **args)
+
+	def _traced_thread_target(self, client_process: subprocess.Popen, actuator, sync_semaphore: threading.Thread):
+		start = time.time()
+		try:
+			self.thread_target(client_process, actuator, sync_semaphore)
+		finally:
+			self._record_finish(start)
+
 	def thread_target(self, client_process: subprocess.Popen, actuator, sync_semaphore: threading.Thread):
 		"""
 		Needs to be overwritten, no super() callback needed
 		"""
 		sync_semaphore.release()
 
-class TimeoutSensor(ABCSensor):
+class TriggerSignal:
+	"""
+	Stands in for the run semaphore handed to a sensor, calls back with the sensor that released it
+	Sensor expressions and environments use it to learn which sensor triggered
+	"""
+	def __init__(self, callback: Callable[[], None]) -> None:
+		self.callback = callback
+
+	def release(self) -> None:
+		self.callback()
+
+class ReactorSensor(ABCSensor):
+	"""
+	Event-driven sensor, armed on the shared sensor reactor instead of running a thread of its own
+	Subclasses register timers, readers and process watches in arm() and end the run through trigger()
+	Callbacks run on the reactor thread and should never block
+	"""
+	def __init__(self) -> None:
+		super().__init__()
+		# Not set up for a run yet, stopping the sensor (e.g., a slot aborted before its first run) has nothing to end
+		self._handles: List[ReactorHandle | FileSubscription] = []
+		self._lock = threading.Lock()
+		self._finished = True
+		self._generation = 0
+		self._settled = threading.Event()
+		self._settled.set()
+
+	def setup(self, process_to_monitor: subprocess.Popen, actuator, sync_semaphore: threading.Thread, path_collection: ExperimentPaths):
+		super().setup(process_to_monitor, actuator, sync_semaphore, path_collection)
+		self.thread = None
+		self.client_process = process_to_monitor
+		self.actuator = actuator
+		self.sync_semaphore = sync_semaphore
+		self._handles: List[ReactorHandle | FileSubscription] = []
+		self._lock = threading.Lock()
+		self._finished = False
+		# Callbacks and triggers of an earlier run are ignored, join() waits for a trigger that is still ending the run
+		self._generation += 1
+		self._settled = threading.Event()
+		self._settled.set()
+		self._start_time = time.time()
+		self._start_monotonic = time.monotonic()
+
+	@property
+	def elapsed(self) -> float:
+		return time.monotonic() - self._start_monotonic
+
+	def start(self) -> None:
+		self._start_time = time.time()
+		self._start_monotonic = time.monotonic()
+		self.arm()
+
+	def arm(self) -> None:
+		"""
+		Needs to be overwritten, register the events the sensor reacts on
+		"""
+		raise NotImplementedError()
+
+	def disarm(self) -> None:
+		with self._lock:
+			handles, self._handles = self._handles, []
+		for handle in handles:
+			handle.cancel()
+
+	def _register(self, handle: ReactorHandle | FileSubscription) -> ReactorHandle | FileSubscription:
+		with self._lock:
+			self._handles.append(handle)
+		return handle
+
+	def _current(self, callback: Callable) -> Callable:
+		"""
+		Wrap callback so it is dropped once the sensor got set up for another run
+		A cancelled handle can still fire when the reactor already picked it up
+		"""
+		generation = self._generation
+		def guarded(*args):
+			if self._generation == generation:
+				callback(*args)
+		return guarded
+
+	def call_later(self, delay: float, callback: Callable[[], None]) -> ReactorHandle:
+		return self._register(reactor.call_later(delay, self._current(callback)))
+
+	def add_reader(self, fd: int, callback: Callable[[], None], on_close: Callable[[], None] | None = None) -> ReactorHandle:
+		return self._register(reactor.add_reader(fd, self._current(callback), on_close))
+
+	def subscribe_files(self, directory: str, callback: Callable[[FileEvent], None], kinds: List[str] = [FileEventService.CREATED, FileEventService.MOVED_TO], patterns: str | List[str] | None = None, min_size: int | None = None) -> FileSubscription:
+		"""
+		Subscribe to file events through the campaign-wide FileEventService, cf. FileEventService.subscribe
+		"""
+		return self._register(file_events.subscribe(directory, self._current(callback), kinds, patterns, min_size))
+
+	def watch_client_exit(self, callback: Callable[[], None]) -> ReactorHandle | None:
+		if self.client_process is None:
+			return None
+		return self._register(reactor.watch_process(self.client_process, self._current(callback)))
+
+	def _finish(self, reason: str | None = None, generation: int | None = None) -> bool:
+		with self._lock:
+			if self._finished or (generation is not None and generation != self._generation):
+				return False
+			self._finished = True
+			self.trigger_reason = reason
+			if generation is not None:
+				self._settled.clear()
+		self.disarm()
+		self._record_finish(self._start_time)
+		return True
+
+	def trigger(self, reason: str, terminate_client: bool = True) -> bool:
+		"""
+		End the run, returns False when the sensor already triggered or got stopped
+		"""
+		generation = self._generation
+		if self.terminate_sensor or not self._finish(reason, generation):
+			return False
+		try:
+			if self.parent is None:
+				# Outside of a sensor expression, which otherwise decides whether the run ends
+				if terminate_client and self.client_process is not None:
+					self.client_process.terminate()
+				# Other sensors have no reason to keep running
+				if self.actuator is not None:
+					self.actuator()
+			# Released last, the next run can only start once the actuator stopped the sensors of this one
+			if generation == self._generation:
+				self.sync_semaphore.release()
+		finally:
+			self._settled.set()
+		return True
+
+	def join(self) -> None:
+		self._settled.wait()
+
+	def stop(self) -> None:
+		super().stop()
+		self._finish()
+
+class TimeoutSensor(ReactorSensor):
 	"""
 	Timeout sensor
-	Second precision
+	Millisecond precision, the run ends immediately when the client exits before the timeout
 	"""
-	
-	def __init__(self, timeout: int) -> None:
+
+	def __init__(self, timeout: float) -> None:
 		super().__init__()
 		self.timeout_value = timeout
 
-	def thread_target(self, client_process: subprocess.Popen, actuator, sync_semaphore: threading.Semaphore):
-		sensor_start_time = datetime.now()
-		while (datetime.now() - sensor_start_time).seconds < self.timeout_value and not self.terminate_sensor:
-			if client_process is not None and client_process.poll() is not None:
-				logging.info(f'TimeoutSensor detected client exit before timeout, halting timer. Ran for {(datetime.now() - sensor_start_time).seconds} seconds.')
-				sync_semaphore.release()
-				return
-			time.sleep(1)
+	def arm(self) -> None:
+		self.call_later(self.timeout_value, self._timeout)
+		self.watch_client_exit(self._client_exited)
+
+	def _timeout(self) -> None:
+		if self.trigger("timeout"):
+			logging.info(f'TimeoutSensor timeout triggered [{self.timeout_value}sec]')
+
+	def _client_exited(self) -> None:
+		if self.trigger("client_exit", False):
+			logging.info(f'TimeoutSensor detected client exit before timeout, halting timer. Ran for {self.elapsed:.3f} seconds.')
 
-		if self.terminate_sensor:
+	def stop(self) -> None:
+		if not self.terminate_sensor and not self._finished:
 			logging.info("TimeoutSensor stop requested")
-			return
-		sync_semaphore.release()
-		logging.info(f'TimeoutSensor timeout triggered [{self.timeout_value}sec]')
-		if client_process is not None:
-			client_process.terminate()
-		if actuator is not None:
-			actuator()
+		super().stop()
 
-class BrowserDownloadWatchdogSensor(ABCSensor):
+class BrowserDownloadWatchdogSensor(ReactorSensor):
 	def __init__(self, expected_filename: str|List[str]) -> None:
 		super().__init__()
 		if type(expected_filename) == str:
 			expected_filename = [expected_filename]
 		self.expected_file = expected_filename
-	
-	def thread_target(self, client_process: subprocess.Popen, actuator, sync_semaphore: threading.Thread):
-		class EventHandler(pyinotify.ProcessEvent):
-			def my_init(self): 
-				self.expected_file = None
-				self.stop_event = None
-
-			def process_IN_MOVED_TO(self, event):
-				if self.expected_file is not None and event.name not in self.expected_file:
-					return
-				logging.info(f'BrowserDownloadWatchdogSensor detected expected file [{event.name}]')
-				if self.stop_event is not None:
-					self.stop_event.set()
-				
 
+	def arm(self) -> None:
 		# Browsers seem to create the expected file, then create a temporary file
 		# Finally they move the file contents of the temporary file to the expected file
 		# This triggers an `IN_MOVED_TO` event, which should signify the end of a download
-		wm = pyinotify.WatchManager()
-		mask = pyinotify.IN_MOVED_TO
-		event_handler = EventHandler()
-		notifier = pyinotify.ThreadedNotifier(wm, event_handler)
-		event_handler.expected_file = self.expected_file
-		event_handler.stop_event = threading.Event()
-		notifier.start()
-		watched_path = wm.add_watch(self.path_collection.download_path_client, mask)
 		try:
-			while not self.terminate_sensor and not event_handler.stop_event.is_set():
-				if client_process is not None and client_process.poll() is not None:
-					logging.info(f'BrowserDownloadWatchdogSensor detected client exit before finding expected file')
-					sync_semaphore.release()
-					wm.rm_watch(watched_path[self.path_collection.download_path_client])
-					notifier.stop()
-					return
-				time.sleep(1)
-		except Exception as e:
-			logging.error("BrowserDownloadWatchdogSensor encountered a generic exception, sensor killed")
-			logging.error(e)
-
-		wm.rm_watch(watched_path[self.path_collection.download_path_client])
-		notifier.stop()
-		if self.terminate_sensor:
+			self.subscribe_files(self.path_collection.download_path_client, self._file_moved, [FileEventService.MOVED_TO], [glob.escape(name) for name in self.expected_file])
+		except pyinotify.WatchManagerError as e:
+			logging.error(f"BrowserDownloadWatchdogSensor could not watch [{self.path_collection.download_path_client}], sensor killed | {e}")
+			return
+		self.watch_client_exit(self._client_exited)
+
+	def _file_moved(self, event: FileEvent) -> None:
+		if self.trigger("file_found"):
+			logging.info(f'BrowserDownloadWatchdogSensor detected expected file [{event.name}]')
+			logging.info('BrowserDownloadWatchdogSensor file-found triggered')
+
+	def _client_exited(self) -> None:
+		if self.trigger("client_exit", False):
+			logging.info(f'BrowserDownloadWatchdogSensor detected client exit before finding expected file')
+
+	def stop(self) -> None:
+		if not self.terminate_sensor and not self._finished:
 			logging.info("BrowserDownloadWatchdogSensor stop request handled")
+		super().stop()
+
+class QlogCompletionSensor(ReactorSensor):
+	"""
+	Ends the run as soon as an endpoint logs the configured qlog events, e.g., the connection closing or a stream being received completely
+	The qlog files (JSON and JSON-SEQ) in the qlog directory of the client or server logs are tailed incrementally while they are written
+	"""
+	PERSPECTIVES = ["client", "server"]
+
+	def __init__(self, events: str | List[str] | None = None, stream_id: int | None = None, perspective: str = "client", occurrences: int = 1, grace: float = 0) -> None:
+		super().__init__()
+		if type(events) is str:
+			events = [events]
+		if events is None and stream_id is None:
+			events = ["connection_closed"]
+		if perspective not in QlogCompletionSensor.PERSPECTIVES:
+			raise TypeError(f"perspective should be one of {QlogCompletionSensor.PERSPECTIVES}, got [{perspective}]")
+		self.events = events or []
+		self.stream_id = stream_id
+		self.perspective = perspective
+		self.occurrences = max(1, occurrences)
+		self.grace = grace
+		self._tails: Dict[str, QlogTail] = {}
+		self._dirty: Set[str] = set()
+		self._matches = 0
+
+	def arm(self) -> None:
+		self._tails = {}
+		self._dirty = set()
+		self._matches = 0
+		log_path = self.path_collection.log_path_client if self.perspective == "client" else self.path_collection.log_path_server
+		qlog_directory = os.path.join(log_path, "qlog")
+		try:
+			# Created upfront so it can be watched before the endpoint writes its first qlog
+			os.makedirs(qlog_directory, exist_ok=True)
+			self.subscribe_files(qlog_directory, self._file_changed, [FileEventService.EXISTING, FileEventService.CREATED, FileEventService.MODIFIED, FileEventService.CLOSED], ["*.qlog", "*.sqlog"])
+		except (OSError, pyinotify.WatchManagerError) as e:
+			logging.error(f"QlogCompletionSensor could not watch [{qlog_directory}], sensor killed | {e}")
 			return
-		sync_semaphore.release()
-		logging.info('BrowserDownloadWatchdogSensor file-found triggered')
-		if client_process is not None:
-			client_process.terminate()
-		if actuator is not None:
-			actuator()
+		self.watch_client_exit(self._client_exited)
+
+	def _matches_event(self, name: str, data: Dict) -> bool:
+		if name in self.events or name.split(":")[-1] in self.events:
+			return True
+		if self.stream_id is not None and name.split(":")[-1] == "packet_received":
+			for frame in data.get("frames") or []:
+				if type(frame) is dict and frame.get("frame_type") == "stream" and frame.get("stream_id") == self.stream_id and frame.get("fin"):
+					return True
+		return False
+
+	def _file_changed(self, event: FileEvent) -> None:
+		if event.path not in self._tails:
+			self._tails[event.path] = QlogTail(event.path)
+		# A single write tends to raise several events, read once they are all in
+		if len(self._dirty) == 0:
+			self.call_later(0, self._read_dirty)
+		self._dirty.add(event.path)
+
+	def _read_dirty(self) -> None:
+		paths, self._dirty = self._dirty, set()
+		matched = self._matches >= self.occurrences
+		for path in paths:
+			tail = self._tails.get(path)
+			for name, data in (tail.read() if tail is not None else []):
+				if self._matches_event(name, data):
+					self._matches += 1
+		if matched or self._matches < self.occurrences:
+			return
+		if self.grace > 0:
+			self.call_later(self.grace, self._completed)
+		else:
+			self._completed()
+
+	def _completed(self) -> None:
+		if self.trigger("qlog_event"):
+			logging.info(f'QlogCompletionSensor detected completion in the {self.perspective} qlog after {self.elapsed:.3f} seconds')
+
+	def _client_exited(self) -> None:
+		# Events logged right before the exit might not have been read yet
+		self._dirty.update(self._tails.keys())
+		self._read_dirty()
+		reason = "qlog_event" if self._matches >= self.occurrences else "client_exit"
+		if self.trigger(reason, False):
+			logging.info(f'QlogCompletionSensor detected client exit [{reason}]')
+
+	def disarm(self) -> None:
+		super().disarm()
+		tails, self._tails = self._tails, {}
+		# Tails are only ever read on the reactor thread
+		reactor.call_soon(lambda: [tail.close() for tail in tails.values()])
+
+	def stop(self) -> None:
+		if not self.terminate_sensor and not self._finished:
+			logging.info("QlogCompletionSensor stop requested")
+		super().stop()
+
+class PcapIdleSensor(ReactorSensor):
+	"""
+	Ends the run once no packets crossed the shaper for the idle window, protocol agnostic alternative to the qlog sensor
+	The packet captures in the shaper logs are tailed incrementally, the idle window only starts counting once min_packets were captured
+	"""
+
+	def __init__(self, idle: float, min_packets: int = 1, captures: str | List[str] = ["tcpdump_leftnet.pcap", "tcpdump_rightnet.pcap"]) -> None:
+		super().__init__()
+		if type(captures) is str:
+			captures = [captures]
+		self.idle = idle
+		self.min_packets = max(1, min_packets)
+		self.captures = captures
+		self._tails: Dict[str, PcapTail] = {}
+		self._dirty: Set[str] = set()
+		self._packets = 0
+		self._last_activity = 0.0
+		self._idle_timer: ReactorHandle | None = None
+
+	def arm(self) -> None:
+		self._tails = {}
+		self._dirty = set()
+		self._packets = 0
+		self._idle_timer = None
+		try:
+			self.subscribe_files(self.path_collection.log_path_shaper, self._file_changed, [FileEventService.EXISTING, FileEventService.CREATED, FileEventService.MODIFIED], [glob.escape(name) for name in self.captures])
+		except pyinotify.WatchManagerError as e:
+			logging.error(f"PcapIdleSensor could not watch [{self.path_collection.log_path_shaper}], sensor killed | {e}")
+			return
+		self.watch_client_exit(self._client_exited)
+
+	def _file_changed(self, event: FileEvent) -> None:
+		if event.path not in self._tails:
+			self._tails[event.path] = PcapTail(event.path)
+		# tcpdump flushes every packet, only read once all pending events are in
+		if len(self._dirty) == 0:
+			self.call_later(0, self._read_dirty)
+		self._dirty.add(event.path)
+
+	def _read_dirty(self) -> None:
+		paths, self._dirty = self._dirty, set()
+		captured = 0
+		for path in paths:
+			tail = self._tails.get(path)
+			if tail is not None:
+				captured += len(tail.read())
+		if captured == 0:
+			return
+		self._packets += captured
+		self._last_activity = time.monotonic()
+		# A single timer is kept, it postpones itself while packets keep coming in
+		if self._packets >= self.min_packets and self._idle_timer is None:
+			self._idle_timer = self.call_later(self.idle, self._check_idle)
+
+	def _check_idle(self) -> None:
+		remaining = self._last_activity + self.idle - time.monotonic()
+		if remaining > 0:
+			self._idle_timer = self.call_later(remaining, self._check_idle)
+			return
+		if self.trigger("traffic_idle"):
+			logging.info(f'PcapIdleSensor detected no traffic for {self.idle} seconds after {self._packets} packets, ran for {self.elapsed:.3f} seconds')
+
+	def _client_exited(self) -> None:
+		if self.trigger("client_exit", False):
+			logging.info(f'PcapIdleSensor detected client exit after {self._packets} packets')
+
+	def disarm(self) -> None:
+		super().disarm()
+		tails, self._tails = self._tails, {}
+		# Tails are only ever read on the reactor thread
+		reactor.call_soon(lambda: [tail.close() for tail in tails.values()])
+
+	def stop(self) -> None:
+		if not self.terminate_sensor and not self._finished:
+			logging.info("PcapIdleSensor stop requested")
+		super().stop()
+
+class SensorExpression(ReactorSensor):
+	"""
+	Combines sensors into a single condition, the run ends once at least `required` of them triggered
+	Child sensors report to the expression instead of ending the run themselves, the expression watches the client exit on their behalf
+	"""
+	def __init__(self, sensors: List[ABCSensor], required: int) -> None:
+		super().__init__()
+		if len(sensors) == 0:
+			raise TypeError("A sensor expression requires at least one sensor")
+		if required < 1 or required > len(sensors):
+			raise TypeError(f"A sensor expression of {len(sensors)} sensor(s) can not require {required} of them")
+		self.sensors = sensors
+		self.required = required
+		self._triggered: List[ABCSensor] = []
+		self._triggered_by: ABCSensor | None = None
+		for sensor in self.sensors:
+			sensor.parent = self
+
+	@property
+	def triggered_by(self) -> ABCSensor | None:
+		return self._triggered_by
+
+	def setup(self, process_to_monitor: subprocess.Popen, actuator, sync_semaphore: threading.Thread, path_collection: ExperimentPaths):
+		super().setup(process_to_monitor, actuator, sync_semaphore, path_collection)
+		self._triggered = []
+		self._triggered_by = None
+		for sensor in self.sensors:
+			sensor.setup(process_to_monitor, lambda: None, TriggerSignal(lambda sensor=sensor: self._sensor_triggered(sensor)), path_collection)
+
+	def arm(self) -> None:
+		self.watch_client_exit(self._client_exited)
+		for sensor in self.sensors:
+			sensor.start()
+
+	def _sensor_triggered(self, sensor: ABCSensor) -> None:
+		if sensor.trigger_reason == "client_exit":
+			return  # Handled by the expression itself
+		with self._lock:
+			if self._finished or sensor in self._triggered:
+				return
+			self._triggered.append(sensor)
+			if len(self._triggered) < self.required:
+				return
+			self._triggered_by = sensor.triggered_by
+		if self.trigger(sensor.trigger_reason or "triggered"):
+			logging.info(f"{self.label} satisfied by [{self._triggered_by.label if self._triggered_by is not None else sensor.label}]")
+
+	def _client_exited(self) -> None:
+		with self._lock:
+			if self._finished:
+				return
+			self._triggered_by = self
+		self.trigger("client_exit", False)
+
+	def disarm(self) -> None:
+		super().disarm()
+		for sensor in self.sensors:
+			sensor.stop()
+
+	def join(self) -> None:
+		super().join()
+		for sensor in self.sensors:
+			sensor.join()
+
+class AnySensor(SensorExpression):
+	"""
+	Triggers as soon as one of its sensors triggers
+	"""
+	def __init__(self, sensors: List[ABCSensor]) -> None:
+		super().__init__(sensors, 1)
+
+class AllSensor(SensorExpression):
+	"""
+	Triggers once all of its sensors triggered, in any order
+	"""
+	def __init__(self, sensors: List[ABCSensor]) -> None:
+		super().__init__(sensors, len(sensors))
+
+class KOfNSensor(SensorExpression):
+	"""
+	Triggers once k of its sensors triggered
+	"""
+	def __init__(self, sensors: List[ABCSensor], k: int) -> None:
+		super().__init__(sensors, k)
+
+class ThenSensor(SensorExpression):
+	"""
+	Starts its sensors one after the other, every sensor is only started once the previous one triggered
+	Triggers when the last sensor triggers
+	"""
+	def __init__(self, sensors: List[ABCSensor]) -> None:
+		super().__init__(sensors, len(sensors))
+
+	def arm(self) -> None:
+		self.watch_client_exit(self._client_exited)
+		self.sensors[0].start()
+
+	def _sensor_triggered(self, sensor: ABCSensor) -> None:
+		super()._sensor_triggered(sensor)
+		with self._lock:
+			if self._finished or sensor.trigger_reason == "client_exit":
+				return
+			next_sensor = self.sensors[len(self._triggered)] if len(self._triggered) < len(self.sensors) else None
+		if next_sensor is not None:
+			next_sensor.start()
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import statistics
+from typing import Dict, Iterable, List, Tuple
+
+from vegvisir.data import ExperimentPermutation
+from vegvisir.journal import PermutationJournal
+
+
+class CampaignHistory:
+	"""
+	Durations and disk usage of permutations that completed in earlier campaigns, read from the journals below a log root
+	Estimates fall back from the exact same configurations, over the same implementations (names and shaper scenario), to the average of all recorded permutations
+	"""
+	BASIS_CONFIGURATION = "configuration"
+	BASIS_IMPLEMENTATIONS = "implementations"
+	BASIS_CAMPAIGN = "campaign average"
+	BASIS_NONE = "no history"
+
+	def __init__(self, log_path_root: str, max_campaigns: int = 20) -> None:
+		self.log_path_root = log_path_root
+		self.max_campaigns = max_campaigns
+		self.campaigns: List[str] = []
+		self._durations: Dict[Tuple[str, str], List[float]] = {}
+		self._sizes: Dict[Tuple[str, str], List[int]] = {}
+		self.logger = logging.getLogger("root.CampaignHistory")
+
+	@staticmethod
+	def _configuration_key(client: Dict, shaper: Dict, server: Dict) -> str:
+		return hashlib.sha256(json.dumps({"client": client, "shaper": shaper, "server": server}, sort_keys=True).encode()).hexdigest()
+
+	@staticmethod
+	def _implementations_key(client: Dict, shaper: Dict, server: Dict) -> str:
+		return f"{client.get('name')}|{shaper.get('name')}:{shaper.get('scenario')}|{server.get('name')}"
+
+	@staticmethod
+	def _keys(client: Dict, shaper: Dict, server: Dict) -> List[Tuple[str, str]]:
+		return [
+			(CampaignHistory.BASIS_CONFIGURATION, CampaignHistory._configuration_key(client, shaper, server)),
+			(CampaignHistory.BASIS_IMPLEMENTATIONS, CampaignHistory._implementations_key(client, shaper, server)),
+			(CampaignHistory.BASIS_CAMPAIGN, ""),
+		]
+
+	@staticmethod
+	def disk_usage(path: str) -> int:
+		"""
+		Bytes allocated on disk by all files below path
+		"""
+		total = 0
+		for directory, _, filenames in os.walk(path):
+			for filename in filenames:
+				try:
+					total += os.lstat(os.path.join(directory, filename)).st_blocks * 512
+				except OSError:
+					continue
+		return total
+
+	def load(self) -> int:
+		"""
+		Read the journals of the most recent campaigns, returns the number of recorded permutations
+		"""
+		if not os.path.isdir(self.log_path_root):
+			return 0
+		campaigns = [
+			os.path.join(self.log_path_root, name) for name in os.listdir(self.log_path_root)
+			if os.path.isfile(os.path.join(self.log_path_root, name, PermutationJournal.FILENAME))
+		]
+		campaigns.sort(key=lambda path: os.path.getmtime(os.path.join(path, PermutationJournal.FILENAME)), reverse=True)
+		self.campaigns = campaigns[:self.max_campaigns]
+
+		recorded = 0
+		for campaign in self.campaigns:
+			journal = PermutationJournal(campaign)
+			for entry in journal.load():
+				if entry.get("outcome") != PermutationJournal.OUTCOME_COMPLETED:
+					continue
+				identity = entry["identity"]
+				size = None
+				if entry.get("log_path") is not None and os.path.isdir(os.path.join(campaign, entry["log_path"])):
+					size = CampaignHistory.disk_usage(os.path.join(campaign, entry["log_path"]))
+				for key in CampaignHistory._keys(identity["client"], identity["shaper"], identity["server"]):
+					self._durations.setdefault(key, []).append(entry["duration"])
+					if size is not None:
+						self._sizes.setdefault(key, []).append(size)
+				recorded += 1
+		self.logger.debug(f"Loaded {recorded} completed permutation(s) from {len(self.campaigns)} campaign(s) in [{self.log_path_root}]")
+		return recorded
+
+	def estimate(self, permutation: ExperimentPermutation) -> Tuple[float | None, int | None, str]:
+		"""
+		Median duration (seconds) and disk usage (bytes) of comparable permutations, together with the basis of the estimate
+		"""
+		for key in CampaignHistory._keys(permutation.client_configuration, permutation.shaper_configuration, permutation.server_configuration):
+			if key in self._durations:
+				sizes = self._sizes.get(key, [])
+				return statistics.median(self._durations[key]), int(statistics.median(sizes)) if len(sizes) > 0 else None, key[0]
+		return None, None, CampaignHistory.BASIS_NONE
+
+
+def estimate_plan(plan: Iterable[ExperimentPermutation], history: CampaignHistory, parallel_slots: int = 1) -> Dict:
+	"""
+	Estimate the duration and disk usage of every permutation of a plan, and of the plan as a whole
+	Parallel slots are assumed to be kept busy, the campaign takes at least as long as its slowest permutation
+	"""
+	permutations = []
+	durations = []
+	total_size = 0
+	bases: Dict[str, int] = {}
+	for permutation in plan:
+		duration, size, basis = history.estimate(permutation)
+		permutations.append({
+			"index": permutation.index,
+			"log_name": permutation.log_name,
+			"run_number": permutation.run_number,
+			"duration": duration,
+			"disk_usage": size,
+			"basis": basis,
+		})
+		bases[basis] = bases.get(basis, 0) + 1
+		if duration is not None:
+			durations.append(duration)
+		if size is not None:
+			total_size += size
+
+	serial_duration = sum(durations)
+	estimate = {
+		"permutations": permutations,
+		"estimated": len(durations),
+		"bases": bases,
+		"serial_duration": serial_duration,
+		"wall_clock_duration": max(serial_duration / max(1, parallel_slots), max(durations, default=0)),
+		"disk_usage": total_size,
+		"disk_free": None,
+	}
+
+	# Closest existing ancestor, the log root itself is created once the campaign starts
+	path = history.log_path_root
+	while not os.path.exists(path) and os.path.dirname(path) != path:
+		path = os.path.dirname(path)
+	try:
+		estimate["disk_free"] = shutil.disk_usage(path).free
+	except OSError:
+		pass
+	return estimate
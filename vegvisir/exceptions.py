@@ -16,6 +16,15 @@ class VegvisirCommandExecutionException(VegvisirException):
 class VegvisirRunFailedException(VegvisirException):
 	pass
 
+class VegvisirCertificateException(VegvisirException):
+	pass
+
+class VegvisirShardException(VegvisirException):
+	pass
+
+class VegvisirCoordinationException(VegvisirException):
+	pass
+
 ###
 
 class VegvisirParameterException(VegvisirException):
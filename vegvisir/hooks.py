@@ -0,0 +1,136 @@
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+from vegvisir import environments
+from vegvisir.data import ExperimentPaths
+from vegvisir.environments.base_environment import BaseEnvironment
+from vegvisir.tracing import tracer
+
+
+def _timed_post_hook(hook: Callable[[ExperimentPaths], None], paths: ExperimentPaths) -> float:
+	start = time.time()
+	hook(paths)
+	return time.time() - start
+
+
+def _timed_environment_post_hook(environment_name: str, paths: ExperimentPaths) -> float:
+	# Executed in a worker process, environment objects (sensors, semaphores) can not be handed over so a fresh one is created by name
+	return _timed_post_hook(environments.available_environments[environment_name]().post_run_hook, paths)
+
+
+@dataclass
+class PostHookRecord:
+	label: str
+	submitted: float
+	duration: float | None = None  # seconds the hook itself took, measured in the worker
+	latency: float | None = None  # seconds between submission and completion
+	error: str | None = None
+
+
+class PostHookExecutor:
+	"""
+	Executes environment post-run hooks on a thread or process pool
+	Process pools sidestep the GIL for CPU-bound hooks (e.g., pcap or qlog analysis), but require the environment to be registered in vegvisir.environments
+	A backlog > 0 bounds the number of hooks waiting or running, submit() blocks (i.e., the campaign pauses) until a slot frees up
+	"""
+	MODE_THREAD = "thread"
+	MODE_PROCESS = "process"
+
+	def __init__(self, workers: int, mode: str = MODE_THREAD, backlog: int = 0, environment_name: str | None = None) -> None:
+		self.mode = mode
+		self.environment_name = environment_name
+		if mode == PostHookExecutor.MODE_PROCESS:
+			# Spawned workers do not inherit the locks held by the (heavily threaded) runner
+			self._executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+		else:
+			self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="PostHook")
+		self._backlog = threading.BoundedSemaphore(backlog) if backlog > 0 else None
+
+		self._lock = threading.Lock()
+		self._records: List[PostHookRecord] = []
+		self._pending = 0
+
+		self.logger = logging.getLogger("root.PostHookExecutor")
+
+	@property
+	def pending(self) -> int:
+		with self._lock:
+			return self._pending
+
+	def submit(self, environment: BaseEnvironment, paths: ExperimentPaths, label: str) -> concurrent.futures.Future:
+		if self._backlog is not None and not self._backlog.acquire(blocking=False):
+			self.logger.debug("Post-hook backlog is full, waiting for a post-hook to finish before continuing")
+			wait_start = time.time()
+			self._backlog.acquire()
+			self.logger.debug(f"Waited {time.time() - wait_start:.2f}s for post-hook backlog")
+
+		record = PostHookRecord(label, time.time())
+		with self._lock:
+			self._records.append(record)
+			self._pending += 1
+		if self.mode == PostHookExecutor.MODE_PROCESS:
+			future = self._executor.submit(_timed_environment_post_hook, self.environment_name, paths)
+		else:
+			future = self._executor.submit(_timed_post_hook, environment.post_run_hook, paths)
+		future.add_done_callback(lambda future: self._completed(record, future))
+		return future
+
+	def _completed(self, record: PostHookRecord, future: concurrent.futures.Future) -> None:
+		record.latency = time.time() - record.submitted
+		if future.cancelled():
+			record.error = "cancelled"
+		elif future.exception() is not None:
+			record.error = repr(future.exception())
+			self.logger.error(f"Post-hook [{record.label}] encountered an exception | {future.exception()}")
+		else:
+			record.duration = future.result()
+		# Process pool workers can not write to the tracer, hooks are therefore traced on completion
+		end = time.time()
+		tracer.record("post-hook", "hook", end - record.duration if record.duration is not None else record.submitted, end, asynchronous=True, label=record.label, latency=record.latency, error=record.error)
+		with self._lock:
+			self._pending -= 1
+		if self._backlog is not None:
+			self._backlog.release()
+
+	def summary(self) -> Dict:
+		with self._lock:
+			records = list(self._records)
+		durations = [record.duration for record in records if record.duration is not None]
+		slowest = max([record for record in records if record.duration is not None], key=lambda record: record.duration, default=None)
+		return {
+			"mode": self.mode,
+			"submitted": len(records),
+			"completed": len(durations),
+			"failed": len([record for record in records if record.error is not None]),
+			"total_duration": sum(durations),
+			"mean_duration": sum(durations) / len(durations) if len(durations) > 0 else None,
+			"max_duration": slowest.duration if slowest is not None else None,
+			"slowest": slowest.label if slowest is not None else None,
+			"hooks": [record.__dict__ for record in records],
+		}
+
+	def shutdown(self, cancel_pending: bool = False) -> Dict:
+		"""
+		Block until every submitted hook finished, returns immediately once the last one completes
+		"""
+		pending = self.pending
+		if pending > 0 and not cancel_pending:
+			self.logger.info(f"Vegvisir is waiting for {pending} post-hook(s) to finish. Perform CTRL + C to cancel those that did not start yet.")
+		try:
+			self._executor.shutdown(wait=True, cancel_futures=cancel_pending)
+		except KeyboardInterrupt:
+			self.logger.info("Cancelling post-hooks that did not start yet")
+			self._executor.shutdown(wait=True, cancel_futures=True)
+		return self.summary()
+
+	def write_summary(self, output_path: str) -> Dict:
+		summary = self.summary()
+		with open(output_path, "w") as fp:
+			json.dump(summary, fp, indent=4)
+		return summary
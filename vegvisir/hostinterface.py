@@ -1,14 +1,184 @@
+import asyncio
+import concurrent.futures
 import logging
+import os
 import shlex
 import subprocess
-from typing import Tuple
+import threading
+import time
+from typing import Awaitable, Callable, List, Tuple
+
+from vegvisir.data import CommandResult
+from vegvisir.exceptions import VegvisirException
+from vegvisir.privileged import PrivilegedHelper
+from vegvisir.tracing import Tracer, tracer
+
+
+class AsyncHostInterface:
+	"""
+	Asyncio variant of the HostInterface with per-command timeouts, cancellation, bounded concurrency and streaming output callbacks
+	Coroutines run on an event loop owned by a background thread, synchronous code submits them through submit(), run_blocking() or run_concurrently()
+	"""
+	DEFAULT_MAX_CONCURRENCY = 16
+	TERMINATE_GRACE_PERIOD = 2  # seconds between SIGTERM and SIGKILL of a command that timed out or got cancelled
+
+	def __init__(self, host_interface: "HostInterface", max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> None:
+		self.host_interface = host_interface
+		self._semaphore = asyncio.Semaphore(max_concurrency)
+		self._loop: asyncio.AbstractEventLoop | None = None
+		self._thread: threading.Thread | None = None
+		self._loop_lock = threading.Lock()
+
+	def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+		with self._loop_lock:
+			if self._loop is None:
+				self._loop = asyncio.new_event_loop()
+				self._thread = threading.Thread(target=self._loop.run_forever, name="AsyncHostInterface", daemon=True)
+				self._thread.start()
+			return self._loop
+
+	def close(self) -> None:
+		with self._loop_lock:
+			if self._loop is None:
+				return
+			self._loop.call_soon_threadsafe(self._loop.stop)
+			self._thread.join()
+			self._loop.close()
+			self._loop = None
+			self._thread = None
+
+	async def _read_stream(self, stream: asyncio.StreamReader, chunks: List[str], callback: Callable[[str], None] | None) -> None:
+		while True:
+			line = await stream.readline()
+			if not line:
+				break
+			decoded = line.decode("utf-8", "replace")
+			chunks.append(decoded)
+			if callback is not None:
+				callback(decoded)
+
+	async def _terminate(self, proc: asyncio.subprocess.Process) -> None:
+		# SIGTERM first, sudo relays it to the command it runs
+		if proc.returncode is not None:
+			return
+		try:
+			proc.terminate()
+			await asyncio.wait_for(proc.wait(), AsyncHostInterface.TERMINATE_GRACE_PERIOD)
+		except ProcessLookupError:
+			pass
+		except asyncio.TimeoutError:
+			proc.kill()
+			await proc.wait()
+
+	async def run(self, command: str, root_privileges: bool = False, shell: bool = False, timeout: float | None = None, stdout_callback: Callable[[str], None] | None = None, stderr_callback: Callable[[str], None] | None = None) -> CommandResult:
+		"""
+		Execute command and collect its output, callbacks receive every output line as it arrives (on the event loop thread)
+		Commands exceeding timeout are terminated and reported with timed_out set, cancelling the coroutine terminates the command as well
+		"""
+		start = time.time()
+		result = await self._execute(command, root_privileges, shell, timeout, stdout_callback, stderr_callback)
+		# Commands overlap on the event loop thread, they are traced as asynchronous spans
+		end = time.time()
+		tracer.record(Tracer.command_name(command), "host", start, end, asynchronous=True, command=command, root=root_privileges, returncode=result.returncode, timed_out=result.timed_out, queued=max(0.0, (end - start) - result.duration))
+		return result
+
+	async def _execute(self, command: str, root_privileges: bool, shell: bool, timeout: float | None, stdout_callback: Callable[[str], None] | None, stderr_callback: Callable[[str], None] | None) -> CommandResult:
+		async with self._semaphore:
+			start = time.time()
+			helper = self.host_interface._privileged_helper
+			if root_privileges and helper is not None and helper.running and stdout_callback is None and stderr_callback is None:
+				# The helper enforces the timeout itself, a cancelled command is left to finish
+				try:
+					return await asyncio.get_running_loop().run_in_executor(None, helper.run, command, shell == True, os.getcwd(), timeout)
+				except VegvisirException as e:
+					# Helper exited (e.g., killed), reported like a failed command instead of raising into callers
+					return CommandResult(command, None, "", str(e), time.time() - start)
+
+			# cf. spawn_parallel_subprocess
+			full_command = "sudo -Skp '' " + command if root_privileges else command
+			try:
+				if shell:
+					proc = await asyncio.create_subprocess_shell(full_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+				else:
+					proc = await asyncio.create_subprocess_exec(*shlex.split(full_command), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+			except OSError as e:
+				# Reported like a failed command (cf. the privileged helper), concurrent commands are not affected
+				return CommandResult(command, None, "", f"Could not execute command | {e}", time.time() - start)
+			try:
+				if root_privileges:
+					proc.stdin.write(self.host_interface._sudo_password.encode() + b'\n')
+					await proc.stdin.drain()
+				proc.stdin.close()
+			except (BrokenPipeError, ConnectionResetError):
+				logging.error(f"Pipe broke before we could provide sudo credentials. No sudo available? [{command}]")
+
+			stdout, stderr = [], []
+			timed_out = False
+			try:
+				await asyncio.wait_for(asyncio.gather(self._read_stream(proc.stdout, stdout, stdout_callback), self._read_stream(proc.stderr, stderr, stderr_callback), proc.wait()), timeout)
+			except asyncio.TimeoutError:
+				timed_out = True
+				await self._terminate(proc)
+			except asyncio.CancelledError:
+				await self._terminate(proc)
+				raise
+			return CommandResult(command, None if timed_out else proc.returncode, "".join(stdout), "".join(stderr) + (f"Command timed out after {timeout}s" if timed_out else ""), time.time() - start, timed_out)
+
+	def submit(self, coroutine: Awaitable) -> concurrent.futures.Future:
+		"""
+		Schedule coroutine on the event loop, cancelling the returned future cancels the coroutine
+		"""
+		return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+
+	def wait(self, future: concurrent.futures.Future):
+		try:
+			return future.result()
+		except BaseException:
+			# E.g., KeyboardInterrupt in the waiting thread, the commands should not outlive the wait
+			future.cancel()
+			raise
+
+	def run_blocking(self, command: str, root_privileges: bool = False, shell: bool = False, timeout: float | None = None) -> CommandResult:
+		return self.wait(self.submit(self.run(command, root_privileges, shell, timeout)))
+
+	async def _gather(self, *coroutines: Awaitable) -> List:
+		return list(await asyncio.gather(*coroutines))
+
+	def run_concurrently(self, *coroutines: Awaitable[CommandResult]) -> List[CommandResult]:
+		"""
+		Run independent commands (i.e., run() coroutines) side by side and block until all finished, results follow the order of the coroutines
+		"""
+		return self.wait(self.submit(self._gather(*coroutines)))
 
 
 class HostInterface:
 	def __init__(self, sudo_password: str) -> None:
 		self._sudo_password = sudo_password
+		self._privileged_helper: PrivilegedHelper | None = None
+		self.aio = AsyncHostInterface(self)
+
+	def start_privileged_helper(self) -> bool:
+		"""
+		Route blocking root commands through a single long-lived privileged process instead of authenticating with sudo for every command
+		Falls back to sudo per command when the helper can not be started
+		"""
+		if self._privileged_helper is not None and self._privileged_helper.running:
+			return True
+		helper = PrivilegedHelper()
+		try:
+			helper.start(self._sudo_password)
+		except VegvisirException as e:
+			logging.warning(f"Privileged helper unavailable, root commands are issued through sudo one by one | {e}")
+			return False
+		self._privileged_helper = helper
+		return True
 
-	def spawn_parallel_subprocess(self, command: str, root_privileges: bool = False, shell: bool = False) -> subprocess.Popen:
+	def stop_privileged_helper(self) -> None:
+		if self._privileged_helper is not None:
+			self._privileged_helper.stop()
+			self._privileged_helper = None
+
+	def spawn_parallel_subprocess(self, command: str, root_privileges: bool = False, shell: bool = False, stdout = subprocess.PIPE, stderr = subprocess.PIPE) -> subprocess.Popen:
 		shell = shell == True
 		if root_privileges:
 			# -Skp makes it so sudo reads input from stdin, invalidates the privileges granted after the command is ran and removes the password prompt
@@ -16,7 +186,7 @@ class HostInterface:
 			command = "sudo -Skp '' " + command
 		debug_command = command
 		command = shlex.split(command) if shell == False else command
-		proc = subprocess.Popen(command, shell=shell, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		proc = subprocess.Popen(command, shell=shell, stdin=subprocess.PIPE, stdout=stdout, stderr=stderr)
 		if root_privileges:
 			try:
 				proc.stdin.write(self._sudo_password.encode() + b'\n')
@@ -25,11 +195,45 @@ class HostInterface:
 				logging.error(f"Pipe broke before we could provide sudo credentials. No sudo available? [{debug_command}]")
 		return proc
 
-	def spawn_blocking_subprocess(self, command: str, root_privileges: bool = False, shell: bool = False) -> Tuple[subprocess.Popen, str, str]:
-		proc = self.spawn_parallel_subprocess(command, root_privileges, shell)
-		out, err = proc.communicate()
-		return proc, out.decode("utf-8").strip(), err.decode("utf-8").strip()
+	def spawn_blocking_subprocess(self, command: str, root_privileges: bool = False, shell: bool = False, timeout: float | None = None) -> Tuple[CommandResult, str, str]:
+		"""
+		Blocking wrapper around AsyncHostInterface.run
+		"""
+		result = self.aio.run_blocking(command, root_privileges, shell == True, timeout)
+		return result, result.stdout.strip(), result.stderr.strip()
 
 	def _is_sudo_password_valid(self):
 		proc, _, _ = self.spawn_blocking_subprocess("which sudo", True, False)
 		return proc.returncode == 0
+
+
+class _StubAsyncHostInterface(AsyncHostInterface):
+	async def _execute(self, command: str, root_privileges: bool, shell: bool, timeout: float | None, stdout_callback: Callable[[str], None] | None, stderr_callback: Callable[[str], None] | None) -> CommandResult:
+		return self.host_interface.record(command, root_privileges)
+
+
+class StubHostInterface(HostInterface):
+	"""
+	HostInterface that leaves the host untouched, e.g., to exercise a coordinator and its workers on one localhost without docker or sudo
+	Commands are only recorded and succeed without output, spawned processes are stand-ins that exit right away (i.e., clients end their run immediately)
+	"""
+	OUTPUTS = {"ip -j ": "[]"}  # Output of commands starting with the key, JSON probes (cf. HostSnapshot) expect valid JSON
+
+	def __init__(self) -> None:
+		super().__init__("")
+		self.aio = _StubAsyncHostInterface(self)
+		self.commands: List[Tuple[str, bool]] = []  # (command, root_privileges) in the order they were issued
+		self._commands_lock = threading.Lock()
+
+	def record(self, command: str, root_privileges: bool = False) -> CommandResult:
+		with self._commands_lock:
+			self.commands.append((command, root_privileges))
+		stdout = next((output for prefix, output in StubHostInterface.OUTPUTS.items() if command.startswith(prefix)), "")
+		return CommandResult(command, 0, stdout)
+
+	def start_privileged_helper(self) -> bool:
+		return False
+
+	def spawn_parallel_subprocess(self, command: str, root_privileges: bool = False, shell: bool = False, stdout = subprocess.PIPE, stderr = subprocess.PIPE) -> subprocess.Popen:
+		self.record(command, root_privileges)
+		return subprocess.Popen(["true"], stdin=subprocess.PIPE, stdout=stdout, stderr=stderr)
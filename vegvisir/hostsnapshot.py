@@ -0,0 +1,105 @@
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from vegvisir.data import CommandResult
+from vegvisir.hostinterface import HostInterface
+
+
+class HostSnapshot:
+	"""
+	Structured capture of the host its network configuration, kernel parameters and docker tooling
+	The complete snapshot is taken once per campaign, runs only record how interfaces and routes differ from it
+	"""
+	# Interface keys that change without any configuration change (e.g., address lifetimes) are left out
+	_INTERFACE_KEYS = ["ifname", "flags", "mtu", "operstate", "master", "link_type", "address"]
+	_ADDRESS_KEYS = ["family", "local", "prefixlen"]
+
+	def __init__(self, host_interface: HostInterface) -> None:
+		self.host_interface = host_interface
+		self.baseline: Dict | None = None
+		self.logger = logging.getLogger("root.HostSnapshot")
+
+	_RUN_STATE_COMMANDS = ["ip -j address", "ip -j route list", "ip -j -6 route list"]
+
+	def _parse_json(self, result: CommandResult) -> List | Dict | None:
+		try:
+			return json.loads(result.stdout)
+		except json.JSONDecodeError:
+			self.logger.warning(f"Command [{result.command}] did not return valid JSON | STDERR [{result.stderr.strip()}]")
+			return None
+
+	def _interfaces(self, result: CommandResult) -> Dict[str, Dict]:
+		interfaces = {}
+		for interface in self._parse_json(result) or []:
+			entry = {key: interface[key] for key in HostSnapshot._INTERFACE_KEYS if key in interface}
+			entry["addresses"] = sorted([f"{address.get('local')}/{address.get('prefixlen')}" for address in interface.get("addr_info", [])])
+			interfaces[interface.get("ifname", str(interface.get("ifindex")))] = entry
+		return interfaces
+
+	def _routes(self, *results: CommandResult) -> List[str]:
+		routes = [route for result in results for route in (self._parse_json(result) or [])]
+		return sorted(json.dumps(route, sort_keys=True) for route in routes)
+
+	def _sysctl(self, result: CommandResult) -> Dict[str, str]:
+		parameters = {}
+		for line in result.stdout.splitlines():
+			key, separator, value = line.partition(" = ")
+			if separator:
+				parameters[key] = value
+		if len(result.stderr.strip()) > 0:
+			self.logger.debug(f"sysctl -a returned stderr output:\n{result.stderr.strip()}")
+		return parameters
+
+	def _run_state(self, addresses: CommandResult, routes: CommandResult, routes_ipv6: CommandResult) -> Dict:
+		return {
+			"interfaces": self._interfaces(addresses),
+			"routes": self._routes(routes, routes_ipv6),
+		}
+
+	def capture_run_state(self) -> Dict:
+		# The probes are independent, they are issued side by side
+		return self._run_state(*self.host_interface.aio.run_concurrently(*[self.host_interface.aio.run(command) for command in HostSnapshot._RUN_STATE_COMMANDS]))
+
+	def capture_baseline(self, output_path: str) -> Dict:
+		aio = self.host_interface.aio
+		addresses, routes, routes_ipv6, sysctl, docker_version, compose_version = aio.run_concurrently(
+			*[aio.run(command) for command in HostSnapshot._RUN_STATE_COMMANDS],
+			aio.run("sysctl -a", True),
+			aio.run("docker version --format '{{json .}}'"),
+			aio.run("docker compose version --short")
+		)
+		self.baseline = {
+			"timestamp": datetime.now().astimezone().isoformat(),
+			**self._run_state(addresses, routes, routes_ipv6),
+			"sysctl": self._sysctl(sysctl),
+			"docker_version": self._parse_json(docker_version),
+			"docker_compose_version": compose_version.stdout.strip(),
+		}
+		with open(output_path, "w") as fp:
+			json.dump(self.baseline, fp, indent=4)
+		return self.baseline
+
+	def diff_with_baseline(self) -> Dict:
+		"""
+		Interfaces that appeared, disappeared or changed and routes that were added or removed since the baseline was captured
+		"""
+		current = self.capture_run_state()
+		baseline_interfaces = self.baseline["interfaces"] if self.baseline is not None else {}
+		baseline_routes = set(self.baseline["routes"]) if self.baseline is not None else set()
+		current_routes = set(current["routes"])
+		return {
+			"timestamp": datetime.now().astimezone().isoformat(),
+			"interfaces_added": {name: interface for name, interface in current["interfaces"].items() if name not in baseline_interfaces},
+			"interfaces_removed": [name for name in baseline_interfaces if name not in current["interfaces"]],
+			"interfaces_changed": {name: interface for name, interface in current["interfaces"].items() if name in baseline_interfaces and baseline_interfaces[name] != interface},
+			"routes_added": [json.loads(route) for route in sorted(current_routes - baseline_routes)],
+			"routes_removed": [json.loads(route) for route in sorted(baseline_routes - current_routes)],
+		}
+
+	def write_run_diff(self, output_path: str) -> Dict:
+		diff = self.diff_with_baseline()
+		with open(output_path, "w") as fp:
+			json.dump(diff, fp, indent=4)
+		return diff
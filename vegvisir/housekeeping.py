@@ -1,14 +1,144 @@
+import copy
+import hashlib
+import io
 import json
 import os
+import shlex
 import shutil
+import subprocess
+import tarfile
+import zipfile
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Tuple
 
 from vegvisir.configuration import Configuration
 from vegvisir.exceptions import VegvisirFreezeException
 from vegvisir.hostinterface import HostInterface
 from vegvisir.implementation import Endpoint
 
+# Multi-threaded compressors in order of preference, (program, archive extension, compress command, decompress command)
+# Without any of them, archives are gzip compressed in-process
+_COMPRESSORS = [
+    ("zstd", ".tar.zst", "zstd -T0 -q -c", "zstd -d -q -c"),
+    ("pigz", ".tar.gz", "pigz -c", "pigz -d -c"),
+]
+_IMAGES_DIRECTORY = "images"
+_BLOB_PREFIX = "blobs/sha256/"
+
+
+def _select_compressor() -> Tuple[str | None, str]:
+    for program, extension, _, _ in _COMPRESSORS:
+        if shutil.which(program) is not None:
+            return program, extension
+    return None, ".tar.gz"
+
+
+class _CompressedTarWriter:
+    """
+    Tar stream piped into an external compressor writing to archive_fp, or gzip compressed in-process without compressor
+    """
+    def __init__(self, host_interface: HostInterface, compressor: str | None, archive_fp) -> None:
+        self.host_interface = host_interface
+        self.compressor = compressor
+        self.archive_fp = archive_fp
+        self.process: subprocess.Popen | None = None
+        self.tar: tarfile.TarFile | None = None
+
+    def __enter__(self) -> tarfile.TarFile:
+        if self.compressor is None:
+            self.tar = tarfile.open(fileobj=self.archive_fp, mode="w|gz")
+            return self.tar
+        command = next(compress for program, _, compress, _ in _COMPRESSORS if program == self.compressor)
+        self.process = self.host_interface.spawn_parallel_subprocess(command, stdout=self.archive_fp, stderr=subprocess.PIPE)
+        self.tar = tarfile.open(fileobj=self.process.stdin, mode="w|", format=tarfile.PAX_FORMAT)
+        return self.tar
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        try:
+            self.tar.close()
+        except (OSError, ValueError):
+            if exception_type is None and self.process is None:
+                raise
+            # Otherwise reported through the return code of the compressor, or superseded by the exception
+        if self.process is None:
+            return
+        if exception_type is not None:
+            self.process.kill()
+        _, err = self.process.communicate()
+        if exception_type is None and self.process.returncode != 0:
+            raise VegvisirFreezeException(f"Compressing the archive with [{self.compressor}] failed | {err.decode(errors='replace').strip()}")
+
+
+class _HashingReader(io.RawIOBase):
+    def __init__(self, fileobj) -> None:
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.digest.update(data)
+        return data
+
+
+def _renamed_member(member: tarfile.TarInfo, name: str) -> tarfile.TarInfo:
+    renamed = copy.copy(member)
+    renamed.name = name
+    # A pax path header of the original member would take precedence over the new name
+    renamed.pax_headers = {key: value for key, value in member.pax_headers.items() if key != "path"}
+    return renamed
+
+
+def _add_bytes(archive: tarfile.TarFile, name: str, data: bytes) -> None:
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    member.mtime = int(datetime.now().timestamp())
+    member.mode = 0o644
+    archive.addfile(member, io.BytesIO(data))
+
+
+def _stream_docker_save(host_interface: HostInterface, image_ids: List[str], archive: tarfile.TarFile, prefix: str) -> Dict:
+    """
+    Copy the tar stream of docker save into archive below prefix, without storing it on disk first
+    Content-addressed blobs (blobs/sha256/<digest>, the layout of docker 25 onwards) are verified while copying and only stored once
+    Older engines already share layers between the images of a single save, those layouts are copied as is
+    """
+    statistics = {"members": 0, "bytes": 0, "blobs": 0, "duplicate_blobs": 0}
+    stored_blobs = set()
+    process = host_interface.spawn_parallel_subprocess(f"docker save {' '.join(shlex.quote(image_id) for image_id in image_ids)}", stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=process.stdout, mode="r|") as saved:
+            for member in saved:
+                is_blob = member.isfile() and member.name.startswith(_BLOB_PREFIX)
+                if is_blob and member.name in stored_blobs:
+                    statistics["duplicate_blobs"] += 1
+                    continue
+                archived_member = _renamed_member(member, prefix + member.name)
+                if member.isfile():
+                    reader = _HashingReader(saved.extractfile(member))
+                    archive.addfile(archived_member, reader)
+                    if is_blob:
+                        if reader.digest.hexdigest() != member.name[len(_BLOB_PREFIX):]:
+                            raise VegvisirFreezeException(f"docker save produced blob [{member.name}] whose content does not match its digest")
+                        stored_blobs.add(member.name)
+                        statistics["blobs"] += 1
+                    statistics["bytes"] += member.size
+                else:
+                    archive.addfile(archived_member)
+                statistics["members"] += 1
+    except BaseException as e:
+        process.kill()
+        _, err = process.communicate()
+        if isinstance(e, tarfile.TarError):
+            raise VegvisirFreezeException(f"Could not read the output of docker save | {e} | {err.decode(errors='replace').strip()}")
+        raise
+    _, err = process.communicate()
+    if process.returncode != 0:
+        raise VegvisirFreezeException(f"docker save failed | {err.decode(errors='replace').strip()}")
+    return statistics
+
 
 def freeze_implementations_configuration(configuration: Configuration):
     # docker images --format "{{.Repository}}:{{.Tag}}"
@@ -66,14 +196,6 @@ def freeze_implementations_configuration(configuration: Configuration):
     freeze_date = "{:%Y%m%d}".format(datetime.now())
     freeze_name = f"vegvisir-images-{freeze_date}"
 
-    freeze_path = os.path.join(os.getcwd(), freeze_name)
-    if not os.path.exists(freeze_path):
-        os.mkdir(freeze_path)
-    freeze_path_docker = os.path.join(freeze_path, f"{freeze_name}.tar")
-    freeze_path_implementations = os.path.join(freeze_path, f"{freeze_name}-implementations.json")
-    freeze_path_metadata = os.path.join(freeze_path, f"{freeze_name}-metadata.json")
-    host_interface.spawn_blocking_subprocess(f"docker save -o {freeze_path_docker} {' '.join(ids_to_save)}")
-
     implementations = {}
     metadata = []
     duplicate_avoid = []
@@ -107,13 +229,39 @@ def freeze_implementations_configuration(configuration: Configuration):
             })
             duplicate_avoid.append(docker_config[2])
 
-    with open(freeze_path_implementations, "w") as f:
-        json.dump(implementations, f, indent=4)
+    # The configuration files lead the archive, loading checks them before any image data is read
+    compressor, extension = _select_compressor()
+    archive_path = os.path.join(os.getcwd(), f"{freeze_name}{extension}")
+    partial_path = archive_path + ".partial"
+    try:
+        with open(partial_path, "wb") as archive_fp:
+            with _CompressedTarWriter(host_interface, compressor, archive_fp) as archive:
+                _add_bytes(archive, f"{freeze_name}/{freeze_name}-implementations.json", json.dumps(implementations, indent=4).encode())
+                _add_bytes(archive, f"{freeze_name}/{freeze_name}-metadata.json", json.dumps(metadata, indent=4).encode())
+                statistics = _stream_docker_save(host_interface, sorted(ids_to_save), archive, f"{freeze_name}/{_IMAGES_DIRECTORY}/")
+        os.replace(partial_path, archive_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return {"archive": archive_path, "compressor": compressor or "gzip", **statistics}
+
+
+def _installed_images(host_interface: HostInterface) -> Dict[str, str]:
+    _, out, _ = host_interface.spawn_blocking_subprocess("docker images --format \"{{.Repository}}:{{.Tag}} {{.ID}}\"")
+    installed_images = {}
+    for img in out.splitlines():
+        if "<none>" in img:
+            continue
+        img, id = img.split(" ")
+        installed_images[id] = img
+    return installed_images
 
-    with open(freeze_path_metadata, "w") as f:
-        json.dump(metadata, f, indent=4)
 
-    shutil.make_archive(freeze_path, "zip", os.getcwd(), freeze_name)
+def _check_metadata(metadata: List[Dict], installed_images: Dict[str, str], archive_path: str) -> None:
+    for entry in metadata:
+        if entry["id"] in installed_images:
+            raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed. Archive contains image ID [{entry['id']}] which already exists on the current system as [{installed_images[entry['id']]}]")
 
 
 def load_frozen_implementations(archive_path: str):
@@ -121,6 +269,17 @@ def load_frozen_implementations(archive_path: str):
     if not os.path.isfile(archive_path):
         raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed. No such file exists.")
 
+    host_interface = HostInterface("")
+    # Archives frozen before images were streamed are zip files holding the docker save tar
+    if zipfile.is_zipfile(archive_path):
+        metadata = _load_zip_archive(host_interface, archive_path)
+    else:
+        metadata = _load_streamed_archive(host_interface, archive_path)
+    for entry in metadata:
+        host_interface.spawn_blocking_subprocess(f"docker tag {entry['id']} {entry['name']}")
+
+
+def _load_zip_archive(host_interface: HostInterface, archive_path: str) -> List[Dict]:
     archive_filename = os.path.basename(archive_path)
     archive_filename_no_extension = os.path.splitext(archive_filename)[0]
 
@@ -138,22 +297,94 @@ def load_frozen_implementations(archive_path: str):
         if not os.path.isfile(os.path.join(extract_path, expected_file)):
             raise VegvisirFreezeException(f"Provided archive does not contain [{expected_file}]")
 
-    host_interface = HostInterface("")
-    _, out, _ = host_interface.spawn_blocking_subprocess("docker images --format \"{{.Repository}}:{{.Tag}} {{.ID}}\"")
-    installed_images = {}
-    for img in out.splitlines():
-        if "<none>" in img:
-            continue
-        img, id = img.split(" ")
-        installed_images[id] = img
-
     metadata ={}
     with open(os.path.join(extract_path, expected_files[2]), "r") as fp:
         metadata = json.load(fp)
-    for entry in metadata:
-        if entry["id"] in installed_images:
-            raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed. Archive contains image ID [{entry['id']}] which already exists on the current system as [{installed_images[entry['id']]}]")
+    _check_metadata(metadata, _installed_images(host_interface), archive_path)
 
     host_interface.spawn_blocking_subprocess(f"docker load -i {os.path.join(extract_path, expected_files[0])}")
-    for entry in metadata:
-        host_interface.spawn_blocking_subprocess(f"docker tag {entry['id']} {entry['name']}")
+    return metadata
+
+
+def _load_streamed_archive(host_interface: HostInterface, archive_path: str) -> List[Dict]:
+    """
+    Decompress the archive and pipe its images into docker load on the fly, only the implementations configuration is written to disk
+    """
+    archive_filename = os.path.basename(archive_path)
+    decompress = None
+    for program, extension, _, decompress_command in _COMPRESSORS:
+        if archive_filename.endswith(extension):
+            archive_filename_no_extension = archive_filename[:-len(extension)]
+            if shutil.which(program) is not None:
+                decompress = decompress_command
+            elif extension != ".tar.gz":
+                raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed, it is compressed with [{program}] which is not installed.")
+            break
+    else:
+        raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed, it is neither a zip nor a {' nor a '.join(extension for _, extension, _, _ in _COMPRESSORS)} archive.")
+
+    extract_path = os.path.join(os.getcwd(), archive_filename_no_extension)
+    if os.path.exists(extract_path):
+        raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed, folder [{archive_filename_no_extension}] already exists in working directory.")
+    implementations_name = f"{archive_filename_no_extension}/{archive_filename_no_extension}-implementations.json"
+    metadata_name = f"{archive_filename_no_extension}/{archive_filename_no_extension}-metadata.json"
+    images_prefix = f"{archive_filename_no_extension}/{_IMAGES_DIRECTORY}/"
+
+    decompressor = None
+    docker_load = None
+    images = None
+    implementations = None
+    metadata = None
+    archive_fp = open(archive_path, "rb")
+    try:
+        if decompress is not None:
+            decompressor = host_interface.spawn_parallel_subprocess(f"{decompress} {shlex.quote(archive_path)}", stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            archive = tarfile.open(fileobj=decompressor.stdout, mode="r|")
+        else:
+            archive = tarfile.open(fileobj=archive_fp, mode="r|gz")
+        for member in archive:
+            if member.name == implementations_name:
+                implementations = archive.extractfile(member).read()
+            elif member.name == metadata_name:
+                metadata = json.load(archive.extractfile(member))
+                _check_metadata(metadata, _installed_images(host_interface), archive_path)
+            elif member.name.startswith(images_prefix):
+                if implementations is None or metadata is None:
+                    raise VegvisirFreezeException(f"Provided archive does not start with [{implementations_name}] and [{metadata_name}]")
+                if docker_load is None:
+                    docker_load = host_interface.spawn_parallel_subprocess("docker load", stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                    images = tarfile.open(fileobj=docker_load.stdin, mode="w|", format=tarfile.PAX_FORMAT)
+                image_member = _renamed_member(member, member.name[len(images_prefix):])
+                if not member.isfile():
+                    images.addfile(image_member)
+                    continue
+                reader = _HashingReader(archive.extractfile(member))
+                images.addfile(image_member, reader)
+                # Blobs are verified while they are piped, docker load is killed before it can load a corrupted image
+                if image_member.name.startswith(_BLOB_PREFIX) and reader.digest.hexdigest() != image_member.name[len(_BLOB_PREFIX):]:
+                    raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed, blob [{image_member.name}] does not match its digest")
+        archive.close()
+        if implementations is None or metadata is None:
+            raise VegvisirFreezeException(f"Provided archive does not contain [{implementations_name}] and [{metadata_name}]")
+        if docker_load is None:
+            raise VegvisirFreezeException(f"Provided archive does not contain any images below [{images_prefix}]")
+        images.close()
+        _, err = docker_load.communicate()
+        if docker_load.returncode != 0:
+            raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed, docker load exited with [{docker_load.returncode}] | {err.decode(errors='replace').strip()}")
+    except tarfile.TarError as e:
+        raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed, it is not a valid archive | {e}")
+    except BrokenPipeError:
+        _, err = docker_load.communicate()
+        raise VegvisirFreezeException(f"Loading of archive [{archive_path}] failed, docker load stopped reading | {err.decode(errors='replace').strip()}")
+    finally:
+        archive_fp.close()
+        for process in [decompressor, docker_load]:
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+
+    os.mkdir(extract_path)
+    with open(os.path.join(extract_path, f"{archive_filename_no_extension}-implementations.json"), "wb") as fp:
+        fp.write(implementations)
+    return metadata
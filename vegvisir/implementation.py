@@ -1,8 +1,9 @@
+import functools
 import re
-import sys
+from collections import deque
 from dataclasses import fields
 from enum import Enum
-from typing import Dict, List, TextIO, Tuple
+from typing import Dict, Iterable, List, TextIO, Tuple
 
 from vegvisir.data import VegvisirArguments
 from vegvisir.exceptions import (VegvisirArgumentException,
@@ -16,52 +17,143 @@ class HostCommand:
 
 	def serialize_command(self, hydrated_parameters: Dict[str, str]):  # TODO reevaluate
 		# Assume the hydrated_parameters have already been substituted, this implies that escaped parts have already been replaced
-		# Doing the substitution with infinite depth again will detect false cycles, we must limit it the substitution process to one cycle 
-		return ArgumentTemplate.substitute(self.command, hydrated_parameters, max_depth=1)
+		# Their values are therefore inserted as is, rather than being substituted again
+		template = ArgumentTemplate.compile(self.command)
+		template.check_references(hydrated_parameters)
+		return template.render(hydrated_parameters)
 
 class ArgumentTemplate:
+	"""
+	Argument (or command) referencing parameters, compiled once into its literal text and the parameters in between
+	Compiled templates are cached by their text, configurations and runs hydrating the same templates share them
+	"""
 	pattern = re.compile(r"\!(?:(?:\{(?P<parameter>(?:[A-Z0-9_-]+))\})|(?P<escaped>\!)|(?:(?P<invalid>)))")
 
-	def _sub(template: str, hydrated_parameters: Dict[str, str], visited_nodes=[], max_depth=0):
-		def sub_rule(match_object: re.Match):
-			nonlocal visited_nodes
+	def __init__(self, template: str) -> None:
+		self.template = template
+		self.literals: List[str] = []  # One more than parameters, parameters[i] sits between literals[i] and literals[i + 1]
+		self.parameters: List[str] = []
+		literal = []
+		position = 0
+		for match_object in ArgumentTemplate.pattern.finditer(template):
+			literal.append(template[position:match_object.start()])
+			position = match_object.end()
 			if match_object.group("escaped") is not None:
-				return match_object.group("escaped")
-			if match_object.group("parameter") is not None:
-				param = match_object.group("parameter")
-				if max_depth > 0 and len(visited_nodes) >= max_depth:
-					return f"!{{{param}}}"
-				if param not in hydrated_parameters:
-					raise VegvisirArgumentException(f"Argument [{template}] references unknown parameter [{param}].")
-				if param in visited_nodes:
-					raise VegvisirArgumentException(f"Cycle detected [{'->'.join([f'!{{{node}}}' for node in visited_nodes])}->!{{{param}}}]")
-				current_cycle_visited_nodes = list(visited_nodes)  # Each branch requires a copy of the list
-				current_cycle_visited_nodes.append(param)
-				collapsed_arg = ArgumentTemplate._sub(hydrated_parameters[param], hydrated_parameters, current_cycle_visited_nodes, max_depth)
-				hydrated_parameters[param] = collapsed_arg  # Some memoization can't hurt
-				return collapsed_arg
-			if match_object.group("invalid") is not None:
-				debug_template = template
-				if len(template) > 60:
-					debug_template = template[match_object.start()-30:match_object.start()+30]  # Python does not care about slicing out of bounds
-				error = "Invalid parameter syntax:\n"
-				debug_template = debug_template.replace("\n", "\\n").replace("\t", "\\t").replace("\r", "\\r")
-				error += f"\t\"{debug_template}\"\n"
-				replace_offset = debug_template.count("\\n", 0, match_object.start()) + debug_template.count("\\t", 0, match_object.start()) + debug_template.count("\\r", 0, match_object.start())
-				error += "\t" + (" " * (match_object.start() + 1 + replace_offset)) + f"^ Starting point of invalid syntax"
-				raise VegvisirArgumentException(error)
-		return ArgumentTemplate.pattern.sub(sub_rule, template)
-
-	def substitute(template: str, hydrated_parameters: Dict[str, str], override_provided_parameters=False, max_depth=0):
+				literal.append(match_object.group("escaped"))
+			elif match_object.group("parameter") is not None:
+				self.literals.append("".join(literal))
+				literal = []
+				self.parameters.append(match_object.group("parameter"))
+			else:
+				raise VegvisirArgumentException(ArgumentTemplate._syntax_error(template, match_object.start()))
+		literal.append(template[position:])
+		self.literals.append("".join(literal))
+		self.references: Tuple[str, ...] = tuple(dict.fromkeys(self.parameters))
+
+	@staticmethod
+	def _syntax_error(template: str, start: int) -> str:
+		debug_template = template
+		if len(template) > 60:
+			debug_template = template[start-30:start+30]  # Python does not care about slicing out of bounds
+		error = "Invalid parameter syntax:\n"
+		debug_template = debug_template.replace("\n", "\\n").replace("\t", "\\t").replace("\r", "\\r")
+		error += f"\t\"{debug_template}\"\n"
+		replace_offset = debug_template.count("\\n", 0, start) + debug_template.count("\\t", 0, start) + debug_template.count("\\r", 0, start)
+		error += "\t" + (" " * (start + 1 + replace_offset)) + f"^ Starting point of invalid syntax"
+		return error
+
+	@staticmethod
+	def compile(template: str) -> "ArgumentTemplate":
+		return _compile_template(template)
+
+	def check_references(self, parameters: Dict[str, str]) -> None:
+		for parameter in self.references:
+			if parameter not in parameters:
+				raise VegvisirArgumentException(f"Argument [{self.template}] references unknown parameter [{parameter}].")
+
+	def render(self, values: Dict[str, str]) -> str:
+		"""
+		Single pass over the compiled template, values need to hold every referenced parameter in its final form
+		"""
+		if len(self.parameters) == 0:
+			return self.literals[0]
+		parts = [self.literals[0]]
+		for parameter, literal in zip(self.parameters, self.literals[1:]):
+			parts.append(values[parameter])
+			parts.append(literal)
+		return "".join(parts)
+
+	@staticmethod
+	def resolve(parameters: Dict[str, str], roots: Iterable[str] | None = None) -> Dict[str, str]:
 		"""
-		Substitute arguments matched by the pattern regex with their respective contents from the uncollapsed hydrated_parameters
-		hydrated_parameters can contain values which themselves reference arguments, postulating the need for recursive substitution and cycle checking
-		This method will collapse and cycle check the provided hydrated_parameters such that the initial provided template can correctly be substituted 
+		Collapse parameters whose values reference other parameters, every value is rendered once in dependency order
+		Only the parameters reachable from roots are resolved, all of them without roots
+		Raises on unknown references and cycles
 		"""
-		try:
-			return ArgumentTemplate._sub(template, hydrated_parameters if override_provided_parameters else dict(hydrated_parameters), [], max_depth)
-		except RecursionError:
-			raise VegvisirArgumentException(f"Argument [{template}] too deeply nested. Max recursion depth of {sys.getrecursionlimit()} has been reached.")
+		templates: Dict[str, ArgumentTemplate] = {}
+		pending = deque(parameters.keys() if roots is None else roots)
+		while len(pending) > 0:
+			parameter = pending.popleft()
+			if parameter in templates:
+				continue
+			template = ArgumentTemplate.compile(parameters[parameter])
+			template.check_references(parameters)
+			templates[parameter] = template
+			pending.extend(template.references)
+
+		resolved: Dict[str, str] = {}
+		for parameter in _resolution_order(tuple((parameter, template.references) for parameter, template in templates.items())):
+			resolved[parameter] = templates[parameter].render(resolved)
+		return resolved
+
+	@staticmethod
+	def substitute(template: str, hydrated_parameters: Dict[str, str]) -> str:
+		"""
+		Substitute the parameters referenced by template with their contents from the uncollapsed hydrated_parameters
+		hydrated_parameters can contain values which themselves reference parameters, those are collapsed (and cycle checked) first
+		"""
+		compiled = ArgumentTemplate.compile(template)
+		compiled.check_references(hydrated_parameters)
+		return compiled.render(ArgumentTemplate.resolve(hydrated_parameters, compiled.references))
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_template(template: str) -> ArgumentTemplate:
+	return ArgumentTemplate(template)
+
+
+@functools.lru_cache(maxsize=1024)
+def _resolution_order(dependencies: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> Tuple[str, ...]:
+	"""
+	Topological order of parameters (referenced parameters first) given the parameters each one references, raises on cycles
+	Parameter sets sharing the same dependency structure (e.g., every run of a client configuration) are only sorted once
+	"""
+	references = dict(dependencies)
+	order = []
+	visiting = set()
+	done = set()
+	for root in references:
+		if root in done:
+			continue
+		path = [root]
+		stack = [iter(references[root])]
+		visiting.add(root)
+		while len(stack) > 0:
+			reference = next(stack[-1], None)
+			if reference is None:
+				stack.pop()
+				parameter = path.pop()
+				visiting.discard(parameter)
+				done.add(parameter)
+				order.append(parameter)
+			elif reference in visiting:
+				cycle = path[path.index(reference):] + [reference]
+				raise VegvisirArgumentException(f"Cycle detected [{'->'.join([f'!{{{node}}}' for node in cycle])}]")
+			elif reference not in done:
+				path.append(reference)
+				stack.append(iter(references[reference]))
+				visiting.add(reference)
+	return tuple(order)
 
 
 class Parameters:
@@ -107,11 +199,8 @@ class Parameters:
 			hydrated_params[arg] = vegvisir_params[arg]
 
 		# Collapse params to one level
-		substituted_hydrated_params = {}
-		for (param, arg) in hydrated_params.items():
-			substituted_hydrated_params[param] = ArgumentTemplate.substitute(hydrated_params[param], hydrated_params, True)
-
-		return substituted_hydrated_params
+		resolved_params = ArgumentTemplate.resolve(hydrated_params)
+		return {param: resolved_params[param] for param in hydrated_params}
 
 	def hydrate_with_empty_arguments(self) -> Dict[str, str]:
 		empty_user_args: Dict[str, str] = {arg:"" for arg in self.params}
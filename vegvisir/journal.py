@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List
+
+from vegvisir.data import ExperimentPermutation
+
+
+class PermutationJournal:
+	"""
+	Append-only JSONL record of permutation outcomes, stored in the root of the campaign logs
+	Every line identifies a permutation by its configurations, log name and run number; the last line of a permutation holds its outcome
+	"""
+	FILENAME = "journal.jsonl"
+
+	OUTCOME_COMPLETED = "completed"
+	OUTCOME_ABORTED = "aborted"
+	OUTCOME_FAILED = "failed"
+	OUTCOMES = [OUTCOME_COMPLETED, OUTCOME_ABORTED, OUTCOME_FAILED]
+
+	def __init__(self, campaign_path: str) -> None:
+		self.path = os.path.join(campaign_path, PermutationJournal.FILENAME)
+		self._entries: Dict[str, Dict] = {}
+		self._lock = threading.Lock()
+		self.logger = logging.getLogger("root.PermutationJournal")
+
+	@staticmethod
+	def identity(permutation: ExperimentPermutation) -> Dict:
+		return {
+			"client": permutation.client_configuration,
+			"shaper": permutation.shaper_configuration,
+			"server": permutation.server_configuration,
+			"log_name": permutation.log_name,
+			"run_number": permutation.run_number,
+		}
+
+	@staticmethod
+	def key(permutation: ExperimentPermutation) -> str:
+		return hashlib.sha256(json.dumps(PermutationJournal.identity(permutation), sort_keys=True).encode()).hexdigest()
+
+	def load(self) -> List[Dict]:
+		"""
+		Read the existing journal, a partially written last line (e.g., power loss) is ignored
+		"""
+		entries = []
+		if not os.path.exists(self.path):
+			return entries
+		with open(self.path) as fp:
+			for line_number, line in enumerate(fp):
+				try:
+					entry = json.loads(line)
+				except json.JSONDecodeError:
+					self.logger.warning(f"Ignoring malformed journal line #{line_number} in [{self.path}]")
+					continue
+				entries.append(entry)
+				self._entries[entry["key"]] = entry
+		return entries
+
+	def is_completed(self, permutation: ExperimentPermutation) -> bool:
+		entry = self._entries.get(PermutationJournal.key(permutation))
+		return entry is not None and entry["outcome"] == PermutationJournal.OUTCOME_COMPLETED
+
+	@property
+	def completed_count(self) -> int:
+		return sum(1 for entry in self._entries.values() if entry["outcome"] == PermutationJournal.OUTCOME_COMPLETED)
+
+	def record(self, permutation: ExperimentPermutation, outcome: str, started: datetime, finished: datetime, log_path_permutation: str | None = None, **details) -> Dict:
+		entry = {
+			"key": PermutationJournal.key(permutation),
+			"identity": PermutationJournal.identity(permutation),
+			"outcome": outcome,
+			"started": started.astimezone().isoformat(),
+			"finished": finished.astimezone().isoformat(),
+			"duration": (finished - started).total_seconds(),
+			"log_path": os.path.relpath(log_path_permutation, os.path.dirname(self.path)) if log_path_permutation is not None else None,
+			**details
+		}
+		with self._lock:
+			with open(self.path, "a+b") as fp:
+				# A partially written last line (cf. load) is terminated first, it would otherwise swallow this entry
+				if fp.seek(0, os.SEEK_END) > 0:
+					fp.seek(-1, os.SEEK_END)
+					if fp.read(1) != b"\n":
+						fp.write(b"\n")
+				fp.write((json.dumps(entry) + "\n").encode())
+				fp.flush()
+				os.fsync(fp.fileno())
+			self._entries[entry["key"]] = entry
+		return entry
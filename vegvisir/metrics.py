@@ -0,0 +1,260 @@
+import bisect
+import logging
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+
+def _escape(value: str) -> str:
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+	if math.isinf(value):
+		return "+Inf" if value > 0 else "-Inf"
+	return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: Dict[str, str] = {}) -> str:
+	labels = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+	labels += [f'{name}="{_escape(value)}"' for name, value in extra.items()]
+	return "{" + ",".join(labels) + "}" if len(labels) > 0 else ""
+
+
+class Metric:
+	"""
+	Base of all metric types, values are kept per combination of label values
+	"""
+	TYPE = "untyped"
+
+	def __init__(self, name: str, documentation: str, label_names: List[str] = []) -> None:
+		self.name = name
+		self.documentation = documentation
+		self.label_names = tuple(label_names)
+		self._lock = threading.Lock()
+		self._values: Dict[Tuple[str, ...], float] = {}
+
+	def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+		if set(labels.keys()) != set(self.label_names):
+			raise ValueError(f"Metric [{self.name}] expects labels {list(self.label_names)}, got {list(labels.keys())}")
+		return tuple(str(labels[name]) for name in self.label_names)
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			values = dict(self._values)
+		return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+	def render(self) -> str:
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"] + self.samples()
+		return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+	TYPE = "counter"
+
+	def inc(self, amount: float = 1, **labels) -> None:
+		if amount < 0:
+			raise ValueError(f"Counter [{self.name}] can only increase")
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+	TYPE = "gauge"
+
+	def __init__(self, name: str, documentation: str, label_names: List[str] = []) -> None:
+		super().__init__(name, documentation, label_names)
+		self._function: Callable[[], float] | None = None
+
+	def set(self, value: float, **labels) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = value
+
+	def inc(self, amount: float = 1, **labels) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def set_function(self, function: Callable[[], float] | None) -> None:
+		"""
+		Evaluate function on every scrape instead of keeping a value, only supported for gauges without labels
+		"""
+		self._function = function
+
+	def samples(self) -> List[str]:
+		if self._function is not None:
+			return [f"{self.name} {_format_value(self._function())}"]
+		return super().samples()
+
+
+class Histogram(Metric):
+	TYPE = "histogram"
+	DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+	def __init__(self, name: str, documentation: str, label_names: List[str] = [], buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+		super().__init__(name, documentation, label_names)
+		self.buckets = tuple(sorted(buckets)) + (math.inf,)
+		self._observations: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+	def observe(self, value: float, **labels) -> None:
+		key = self._key(labels)
+		with self._lock:
+			counts, total = self._observations.get(key, ([0] * len(self.buckets), 0.0))
+			counts[bisect.bisect_left(self.buckets, value)] += 1
+			self._observations[key] = (counts, total + value)
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			observations = {key: (list(counts), total) for key, (counts, total) in self._observations.items()}
+		lines = []
+		for key, (counts, total) in sorted(observations.items()):
+			cumulative = 0
+			for bound, count in zip(self.buckets, counts):
+				cumulative += count
+				lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, {'le': _format_value(bound)})} {cumulative}")
+			lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+			lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+		return lines
+
+
+class MetricsRegistry:
+	"""
+	Collection of metrics rendered in the Prometheus text exposition format
+	"""
+	SNAPSHOT_FILENAME = "metrics.prom"
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._snapshot_lock = threading.Lock()  # Slots write snapshots concurrently, they share the temporary file
+		self._metrics: Dict[str, Metric] = {}
+
+	def _register(self, metric: Metric) -> Metric:
+		with self._lock:
+			if metric.name in self._metrics:
+				raise ValueError(f"Metric [{metric.name}] is already registered")
+			self._metrics[metric.name] = metric
+		return metric
+
+	def counter(self, name: str, documentation: str, label_names: List[str] = []) -> Counter:
+		return self._register(Counter(name, documentation, label_names))
+
+	def gauge(self, name: str, documentation: str, label_names: List[str] = []) -> Gauge:
+		return self._register(Gauge(name, documentation, label_names))
+
+	def histogram(self, name: str, documentation: str, label_names: List[str] = [], buckets: Tuple[float, ...] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+		return self._register(Histogram(name, documentation, label_names, buckets))
+
+	def render(self) -> str:
+		with self._lock:
+			metrics = list(self._metrics.values())
+		return "".join(metric.render() for metric in metrics)
+
+	def write_snapshot(self, output_path: str) -> None:
+		# Written next to the snapshot and renamed, readers (e.g., node_exporter its textfile collector) never see a partial file
+		temporary_path = output_path + ".tmp"
+		with self._snapshot_lock:
+			with open(temporary_path, "w") as fp:
+				fp.write(self.render())
+			os.replace(temporary_path, output_path)
+
+
+class MetricsServer:
+	"""
+	Serves the metrics of a registry on http://<address>:<port>/metrics from a background thread
+	"""
+	def __init__(self, registry: MetricsRegistry, address: str = "127.0.0.1", port: int = 9464) -> None:
+		self.registry = registry
+		self.address = address
+		self.port = port
+		self._server: ThreadingHTTPServer | None = None
+		self._thread: threading.Thread | None = None
+		self.logger = logging.getLogger("root.MetricsServer")
+
+	def start(self) -> int:
+		"""
+		Start serving, returns the bound port (relevant when port 0 requests an ephemeral one)
+		"""
+		registry = self.registry
+
+		class MetricsHandler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split("?")[0] not in ["/", "/metrics"]:
+					self.send_error(404)
+					return
+				body = registry.render().encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass  # Scrapes would flood the campaign output
+
+		self._server = ThreadingHTTPServer((self.address, self.port), MetricsHandler)
+		self._server.daemon_threads = True
+		self.port = self._server.server_address[1]
+		self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True)
+		self._thread.start()
+		return self.port
+
+	def stop(self) -> None:
+		if self._server is None:
+			return
+		self._server.shutdown()
+		self._server.server_close()
+		self._thread.join()
+		self._server = None
+		self._thread = None
+
+
+# Metrics of the running campaign, comparable to the logging module its root logger
+registry = MetricsRegistry()
+
+permutations_total = registry.counter("vegvisir_permutations_total", "Permutations that finished, by outcome (completed, aborted or failed).", ["outcome"])
+permutations_planned = registry.gauge("vegvisir_permutations_planned", "Permutations scheduled to run in this campaign.")
+phase_duration_seconds = registry.histogram("vegvisir_phase_duration_seconds", "Duration of the phases of a permutation, sensors and hooks.", ["phase"])
+host_command_duration_seconds = registry.histogram("vegvisir_host_command_duration_seconds", "Duration of host commands, including the time spent waiting for a free command slot.")
+post_hook_queue_depth = registry.gauge("vegvisir_post_hook_queue_depth", "Post-hooks waiting or running.")
+sensor_triggers_total = registry.counter("vegvisir_sensor_triggers_total", "Sensors that ended a run, by sensor and reason.", ["sensor", "reason"])
+output_bytes_total = registry.counter("vegvisir_output_bytes_total", "Bytes of output written into permutation directories, by kind (pcap, qlog or log).", ["kind"])
+
+
+def observe_span(name: str, category: str, duration: float) -> None:
+	"""
+	Tracer observer, feeds finished spans into the latency histograms
+	"""
+	if category == "host":
+		host_command_duration_seconds.observe(duration)
+	else:
+		phase_duration_seconds.observe(duration, phase=name)
+
+
+def output_kind(filename: str) -> str:
+	if filename.endswith((".pcap", ".pcapng")):
+		return "pcap"
+	if filename.endswith((".qlog", ".sqlog")):
+		return "qlog"
+	return "log"
+
+
+def count_output_bytes(path: str) -> Dict[str, int]:
+	"""
+	Add the size of every file below path to output_bytes_total, returns the sizes per kind
+	"""
+	sizes: Dict[str, int] = {}
+	for directory, _, filenames in os.walk(path):
+		for filename in filenames:
+			try:
+				size = os.lstat(os.path.join(directory, filename)).st_size
+			except OSError:
+				continue
+			kind = output_kind(filename)
+			sizes[kind] = sizes.get(kind, 0) + size
+	for kind, size in sizes.items():
+		output_bytes_total.inc(size, kind=kind)
+	return sizes
@@ -0,0 +1,151 @@
+"""
+Long-lived privileged helper, executes root commands on behalf of Vegvisir
+
+Started once per campaign through sudo (`sudo python -m vegvisir.privileged`), it reads JSON requests from stdin and writes JSON responses to stdout, one per line
+A request {"id", "command", "shell", "cwd", "timeout"} is answered with {"id", "returncode", "stdout", "stderr", "duration", "timed_out"}
+Requests are executed concurrently, responses are therefore not guaranteed to follow request order
+The helper only listens on the pipes of its parent and exits as soon as its stdin is closed
+"""
+import json
+import logging
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, TextIO
+
+from vegvisir.data import CommandResult
+from vegvisir.exceptions import VegvisirException
+
+
+class PrivilegedHelper:
+	"""
+	Parent side of the privileged helper
+	"""
+	STARTUP_TIMEOUT = 10  # seconds
+
+	def __init__(self) -> None:
+		self._process: subprocess.Popen | None = None
+		self._reader: threading.Thread | None = None
+		self._write_lock = threading.Lock()
+		self._pending_lock = threading.Lock()
+		self._pending: Dict[int, Dict] = {}
+		self._request_id = 0
+		self._ready = threading.Event()
+		self.logger = logging.getLogger("root.PrivilegedHelper")
+
+	@property
+	def running(self) -> bool:
+		return self._process is not None and self._process.poll() is None and self._ready.is_set()
+
+	def start(self, sudo_password: str) -> None:
+		# -Skp: see HostInterface, the password is the first line the helper its stdin receives, requests follow once the helper reports ready
+		self._process = subprocess.Popen(["sudo", "-Skp", "", sys.executable, "-m", "vegvisir.privileged"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+		try:
+			self._process.stdin.write(sudo_password + "\n")
+			self._process.stdin.flush()
+		except BrokenPipeError:
+			raise VegvisirException("Privileged helper exited before sudo credentials could be provided")
+		self._reader = threading.Thread(target=self._read_responses, args=(self._process,), daemon=True)
+		self._reader.start()
+		if not self._ready.wait(PrivilegedHelper.STARTUP_TIMEOUT) or self._process.poll() is not None:
+			self.stop()
+			raise VegvisirException("Privileged helper did not report ready")
+
+	def stop(self) -> None:
+		if self._process is None:
+			return
+		try:
+			self._process.stdin.close()
+		except BrokenPipeError:
+			pass
+		try:
+			self._process.wait(timeout=5)
+		except subprocess.TimeoutExpired:
+			# Root owned, signalling it ourselves is not allowed
+			self.logger.warning("Privileged helper did not exit after closing its stdin")
+		self._process = None
+		self._ready.clear()
+
+	def _read_responses(self, process: subprocess.Popen) -> None:
+		for line in process.stdout:
+			try:
+				response = json.loads(line)
+			except json.JSONDecodeError:
+				continue
+			if response.get("ready"):
+				self._ready.set()
+				continue
+			with self._pending_lock:
+				pending = self._pending.get(response.get("id"))
+			if pending is not None:
+				pending["response"] = response
+				pending["event"].set()
+
+		# Helper is gone, release everyone still waiting
+		process.wait()
+		self._ready.set()
+		with self._pending_lock:
+			for pending in self._pending.values():
+				pending["event"].set()
+
+	def run(self, command: str, shell: bool = False, cwd: str | None = None, timeout: float | None = None) -> CommandResult:
+		with self._pending_lock:
+			self._request_id += 1
+			request_id = self._request_id
+			pending = {"event": threading.Event(), "response": None}
+			self._pending[request_id] = pending
+		try:
+			with self._write_lock:
+				try:
+					self._process.stdin.write(json.dumps({"id": request_id, "command": command, "shell": shell, "cwd": cwd, "timeout": timeout}) + "\n")
+					self._process.stdin.flush()
+				except (BrokenPipeError, ValueError, AttributeError):
+					raise VegvisirException(f"Privileged helper is not running, could not execute [{command}]")
+			pending["event"].wait()
+		finally:
+			with self._pending_lock:
+				del self._pending[request_id]
+		response = pending["response"]
+		if response is None:
+			raise VegvisirException(f"Privileged helper exited while executing [{command}]")
+		return CommandResult(command, response["returncode"], response["stdout"], response["stderr"], response["duration"], response["timed_out"])
+
+
+def _execute(request: Dict, output: TextIO, output_lock: threading.Lock) -> None:
+	start = time.time()
+	timed_out = False
+	try:
+		command = request["command"] if request.get("shell") else shlex.split(request["command"])
+		completed = subprocess.run(command, shell=bool(request.get("shell")), cwd=request.get("cwd"), stdin=subprocess.DEVNULL, capture_output=True, timeout=request.get("timeout"))
+		returncode, stdout, stderr = completed.returncode, completed.stdout.decode("utf-8", "replace"), completed.stderr.decode("utf-8", "replace")
+	except subprocess.TimeoutExpired as e:
+		timed_out = True
+		returncode, stdout, stderr = None, (e.stdout or b"").decode("utf-8", "replace"), f"Command timed out after {request.get('timeout')}s"
+	except Exception as e:
+		returncode, stdout, stderr = None, "", f"Privileged helper could not execute command | {e}"
+	response = {"id": request.get("id"), "returncode": returncode, "stdout": stdout, "stderr": stderr, "duration": time.time() - start, "timed_out": timed_out}
+	with output_lock:
+		output.write(json.dumps(response) + "\n")
+		output.flush()
+
+
+def main() -> None:
+	output_lock = threading.Lock()
+	sys.stdout.write(json.dumps({"ready": True}) + "\n")
+	sys.stdout.flush()
+	for line in sys.stdin:
+		try:
+			request = json.loads(line)
+		except json.JSONDecodeError:
+			continue
+		threading.Thread(target=_execute, args=(request, sys.stdout, output_lock), daemon=True).start()
+	# Finish requests that are still executing before exiting
+	for thread in threading.enumerate():
+		if thread is not threading.current_thread():
+			thread.join()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,185 @@
+import concurrent.futures
+import json
+import logging
+import subprocess
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from vegvisir.hostinterface import HostInterface
+
+
+class ReadinessMonitor:
+	"""
+	Follows `docker events` of a compose project to learn when its containers are ready, instead of relying on blocking compose calls and fixed waits
+	A container is ready once started or, when its image or service defines a healthcheck, once reported healthy
+	Every observed event and every phase marked by the runner is timestamped, per-run startup dead time can therefore be measured
+	"""
+	DEFAULT_TIMEOUT = 60  # seconds
+
+	# Container states
+	STARTING = "starting"  # Started, whether it defines a healthcheck is still being resolved
+	AWAITING_HEALTH = "awaiting_health"
+	READY = "ready"
+	UNHEALTHY = "unhealthy"
+
+	def __init__(self, host_interface: HostInterface, compose_project: str) -> None:
+		self.host_interface = host_interface
+		self.compose_project = compose_project
+
+		self._process: subprocess.Popen | None = None
+		self._thread: threading.Thread | None = None
+		self._inspector: concurrent.futures.ThreadPoolExecutor | None = None
+		self._condition = threading.Condition()
+		self._states: Dict[str, str] = {}
+		self._container_ids: Dict[str, str] = {}  # service => id of its running container
+		self.phases: Dict[str, datetime] = {}
+
+		self.logger = logging.getLogger(f"root.ReadinessMonitor.{compose_project}")
+
+	def start(self) -> None:
+		# --since makes sure events emitted while the CLI subscribes are not lost
+		command = (
+			f"docker events --since {time.time():.3f} --filter type=container"
+			f" --filter label=com.docker.compose.project={self.compose_project} --format '{{{{json .}}}}'"
+		)
+		self._process = self.host_interface.spawn_parallel_subprocess(command, False, False, stderr=subprocess.DEVNULL)
+		# Healthchecks are inspected off the event reader, events keep flowing while docker inspect runs
+		self._inspector = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"ReadinessInspector.{self.compose_project}")
+		self._thread = threading.Thread(target=self._read_events, daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		if self._process is not None:
+			self._process.terminate()
+			self._process.wait()
+			self._process = None
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		if self._inspector is not None:
+			self._inspector.shutdown(wait=False, cancel_futures=True)
+			self._inspector = None
+
+	def reset(self) -> None:
+		"""
+		Forget all container states and phases, called before (re)starting containers of the project
+		"""
+		with self._condition:
+			self._states = {}
+			self.phases = {}
+
+	def mark(self, phase: str) -> datetime:
+		timestamp = datetime.now()
+		with self._condition:
+			self.phases[phase] = timestamp
+		return timestamp
+
+	def container_ids(self) -> Dict[str, str]:
+		"""
+		Ids of the running containers of the project by service, as learned from their start events
+		"""
+		with self._condition:
+			return dict(self._container_ids)
+
+	def _has_healthcheck(self, container_id: str) -> bool:
+		_, out, _ = self.host_interface.spawn_blocking_subprocess(f"docker inspect --format '{{{{json .Config.Healthcheck}}}}' {container_id}", False, False)
+		try:
+			healthcheck = json.loads(out)
+		except json.JSONDecodeError:
+			return False
+		return healthcheck is not None and healthcheck.get("Test") not in [None, [], ["NONE"]]
+
+	def _resolve_healthcheck(self, service: str, container_id: str) -> None:
+		has_healthcheck = self._has_healthcheck(container_id)
+		with self._condition:
+			# Health events that arrived in the meantime, a reset or a newer container of the service take precedence
+			if self._states.get(service) != ReadinessMonitor.STARTING or self._container_ids.get(service) != container_id:
+				return
+			self._states[service] = ReadinessMonitor.AWAITING_HEALTH if has_healthcheck else ReadinessMonitor.READY
+			self._condition.notify_all()
+
+	def _read_events(self) -> None:
+		for line in self._process.stdout:
+			try:
+				event = json.loads(line)
+			except json.JSONDecodeError:
+				continue
+			service = event.get("Actor", {}).get("Attributes", {}).get("com.docker.compose.service")
+			action = event.get("Action", event.get("status", ""))
+			if service is None:
+				continue
+			timestamp = datetime.fromtimestamp(event["timeNano"] / 1e9) if "timeNano" in event else datetime.now()
+
+			state = None
+			if action == "start":
+				state = ReadinessMonitor.STARTING
+			elif action == "health_status: healthy":
+				state = ReadinessMonitor.READY
+			elif action == "health_status: unhealthy":
+				state = ReadinessMonitor.UNHEALTHY
+			elif action not in ["create", "die"]:
+				continue
+
+			with self._condition:
+				self.phases[f"{service}.{action.replace('health_status: ', '')}"] = timestamp
+				if state is not None:
+					self._states[service] = state
+				elif action == "die":
+					self._states.pop(service, None)
+				if action == "start":
+					self._container_ids[service] = event.get("id", "")
+					self._inspector.submit(self._resolve_healthcheck, service, event.get("id", ""))
+				elif action == "die" and self._container_ids.get(service) == event.get("id"):
+					del self._container_ids[service]
+				self._condition.notify_all()
+
+		with self._condition:
+			self._condition.notify_all()
+
+	def wait(self, services: List[str], command: concurrent.futures.Future | None = None, timeout: float = DEFAULT_TIMEOUT) -> bool:
+		"""
+		Block until all services are ready, returns False on timeout, when docker events can not be followed or when command (i.e., the submitted compose call creating the containers) failed
+		"""
+		deadline = time.time() + timeout
+		with self._condition:
+			while True:
+				if all(self._states.get(service) == ReadinessMonitor.READY for service in services):
+					return True
+				unhealthy = [service for service in services if self._states.get(service) == ReadinessMonitor.UNHEALTHY]
+				if len(unhealthy) > 0:
+					self.logger.warning(f"Container(s) {unhealthy} reported unhealthy")
+					return False
+				if self._process is None or self._process.poll() is not None:
+					self.logger.warning("Docker events are not being followed, readiness can not be determined")
+					return False
+				if command is not None and command.done() and (command.cancelled() or command.exception() is not None or command.result().returncode != 0):
+					return False
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					self.logger.warning(f"Timed out after {timeout}s waiting for {[service for service in services if self._states.get(service) != ReadinessMonitor.READY]} to become ready")
+					return False
+				# The command is not able to notify us, poll it regularly
+				self._condition.wait(min(remaining, 0.25) if command is not None else remaining)
+
+	def write(self, output_path: str, origin_phase: str, **details) -> Dict:
+		"""
+		Write all phase timestamps, including their offset in seconds from origin_phase, to output_path
+		"""
+		with self._condition:
+			phases = dict(sorted(self.phases.items(), key=lambda phase: phase[1]))
+		origin = phases.get(origin_phase)
+		document = {
+			**details,
+			"phases": {
+				phase: {
+					"timestamp": timestamp.astimezone().isoformat(),
+					"offset": (timestamp - origin).total_seconds() if origin is not None else None
+				}
+				for phase, timestamp in phases.items()
+			}
+		}
+		with open(output_path, "w") as fp:
+			json.dump(document, fp, indent=4)
+		return document
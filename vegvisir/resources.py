@@ -0,0 +1,220 @@
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger("root.ResourceSampler")
+
+
+class ContainerCgroup:
+	"""
+	Open cgroup v2 files of a single container, re-read in place for every sample
+	"""
+	def __init__(self, service: str, container_id: str, directory: str) -> None:
+		self.service = service
+		self.container_id = container_id
+		self.directory = directory
+		self._fds: Dict[str, int] = {}
+		for filename in ["cpu.stat", "memory.current", "io.stat"]:
+			try:
+				self._fds[filename] = os.open(os.path.join(directory, filename), os.O_RDONLY)
+			except OSError:
+				# Controllers that are not enabled for the cgroup are reported as 0
+				pass
+
+	def _read(self, filename: str) -> bytes:
+		fd = self._fds.get(filename)
+		return os.pread(fd, 65536, 0) if fd is not None else b""
+
+	def sample(self) -> Tuple[int, ...]:
+		"""
+		Raises OSError once the container (and therefore its cgroup) is gone
+		"""
+		cpu = {}
+		for line in self._read("cpu.stat").split(b"\n"):
+			key, _, value = line.partition(b" ")
+			cpu[key] = value
+		memory = self._read("memory.current").strip()
+		read_bytes = 0
+		written_bytes = 0
+		for line in self._read("io.stat").split(b"\n"):
+			# <major>:<minor> rbytes=.. wbytes=.. rios=.. wios=.. dbytes=.. dios=..
+			for field in line.split(b" ")[1:]:
+				if field.startswith(b"rbytes="):
+					read_bytes += int(field[7:])
+				elif field.startswith(b"wbytes="):
+					written_bytes += int(field[7:])
+		return (
+			int(cpu.get(b"usage_usec") or 0),
+			int(cpu.get(b"user_usec") or 0),
+			int(cpu.get(b"system_usec") or 0),
+			int(cpu.get(b"throttled_usec") or 0),
+			int(memory or 0),
+			read_bytes,
+			written_bytes,
+		)
+
+	def close(self) -> None:
+		for fd in self._fds.values():
+			os.close(fd)
+		self._fds = {}
+
+
+class ResourceSampler:
+	"""
+	Samples the cgroup v2 CPU, memory and IO counters of the containers of a compose project for the duration of a run
+	Files are read directly (kept open and re-read with pread), no processes are spawned while sampling
+	Samples are appended to a compact binary file, cf. read_samples:
+	 - header: MAGIC, followed by the sampling interval in seconds (float64)
+	 - container record: type 1, container index (uint8), service name length (uint16), service name
+	 - sample record: type 2, container index (uint8), unix timestamp (float64), the FIELDS (uint64 each)
+	All numbers are little endian
+	"""
+	FILENAME = "resources.bin"
+	MAGIC = b"VGVRES\x00\x01"
+	CGROUP_ROOT = "/sys/fs/cgroup"
+	FIELDS = ["cpu_usage_usec", "cpu_user_usec", "cpu_system_usec", "cpu_throttled_usec", "memory_current", "io_read_bytes", "io_write_bytes"]
+	MIN_INTERVAL = 0.01  # seconds
+
+	RECORD_CONTAINER = 1
+	RECORD_SAMPLE = 2
+	_HEADER = struct.Struct("<d")
+	_CONTAINER = struct.Struct("<BBH")
+	_SAMPLE = struct.Struct("<BBd" + "Q" * len(FIELDS))
+
+	def __init__(self, containers: Callable[[], Dict[str, str]], output_path: str, interval: float) -> None:
+		"""
+		containers returns the ids of the running containers by service, it is called for every sample and should therefore be cheap
+		"""
+		self.containers = containers
+		self.output_path = output_path
+		self.interval = max(ResourceSampler.MIN_INTERVAL, interval)
+		self.samples = 0
+		self._cgroups: Dict[str, ContainerCgroup] = {}  # container id => cgroup
+		self._indices: Dict[str, int] = {}  # service => container index in the output
+		self._unresolved: Dict[str, str] = {}  # container id => service, cgroups that could not be found
+		self._stop = threading.Event()
+		self._thread: threading.Thread | None = None
+		self._fp = None
+
+	@staticmethod
+	def supported() -> bool:
+		return os.path.isfile(os.path.join(ResourceSampler.CGROUP_ROOT, "cgroup.controllers"))
+
+	@staticmethod
+	def find_cgroup(container_id: str) -> str | None:
+		"""
+		Cgroup directory of a container, for both the systemd and cgroupfs cgroup drivers of docker (rootful and rootless)
+		"""
+		candidates = [
+			os.path.join(ResourceSampler.CGROUP_ROOT, "system.slice", f"docker-{container_id}.scope"),
+			os.path.join(ResourceSampler.CGROUP_ROOT, "docker", container_id),
+		]
+		for candidate in candidates:
+			if os.path.isdir(candidate):
+				return candidate
+		for directory, subdirectories, _ in os.walk(ResourceSampler.CGROUP_ROOT):
+			for name in subdirectories:
+				if name in [f"docker-{container_id}.scope", container_id]:
+					return os.path.join(directory, name)
+		return None
+
+	def start(self) -> None:
+		self._fp = open(self.output_path, "wb")
+		self._fp.write(ResourceSampler.MAGIC + ResourceSampler._HEADER.pack(self.interval))
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name="ResourceSampler", daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		if self._thread is None:
+			return
+		self._stop.set()
+		self._thread.join()
+		self._thread = None
+		for cgroup in self._cgroups.values():
+			cgroup.close()
+		self._cgroups = {}
+		self._fp.close()
+		self._fp = None
+		logger.debug(f"Wrote {self.samples} resource sample(s) of {len(self._indices)} container(s) to [{self.output_path}]")
+
+	def _update_containers(self) -> None:
+		for service, container_id in self.containers().items():
+			if container_id in self._cgroups or self._unresolved.get(container_id) == service:
+				continue
+			directory = ResourceSampler.find_cgroup(container_id)
+			if directory is None:
+				logger.debug(f"No cgroup found for container [{container_id}] of service [{service}], it is not sampled")
+				self._unresolved[container_id] = service
+				continue
+			self._cgroups[container_id] = ContainerCgroup(service, container_id, directory)
+			if service not in self._indices and len(self._indices) < 256:
+				self._indices[service] = len(self._indices)
+				name = service.encode()
+				self._fp.write(ResourceSampler._CONTAINER.pack(ResourceSampler.RECORD_CONTAINER, self._indices[service], len(name)) + name)
+
+	def _sample(self) -> None:
+		self._update_containers()
+		timestamp = time.time()
+		for container_id, cgroup in list(self._cgroups.items()):
+			try:
+				values = cgroup.sample()
+			except (OSError, ValueError):
+				# Container stopped, a restarted one gets a new id and cgroup
+				cgroup.close()
+				del self._cgroups[container_id]
+				continue
+			index = self._indices.get(cgroup.service)
+			if index is not None:
+				self._fp.write(ResourceSampler._SAMPLE.pack(ResourceSampler.RECORD_SAMPLE, index, timestamp, *values))
+				self.samples += 1
+
+	def _run(self) -> None:
+		deadline = time.monotonic()
+		while not self._stop.is_set():
+			try:
+				self._sample()
+			except Exception as e:
+				logger.exception(f"Resource sampling failed, no longer sampling [{self.output_path}] | {e}")
+				return
+			deadline += self.interval
+			now = time.monotonic()
+			if deadline < now:
+				# Missed samples are skipped rather than taken in a burst
+				deadline = now
+			self._stop.wait(deadline - now)
+
+
+def read_samples(path: str) -> Dict[str, List[Dict]]:
+	"""
+	Decode a file written by ResourceSampler, returns the samples by service, each sample holding a timestamp and the ResourceSampler.FIELDS
+	"""
+	with open(path, "rb") as fp:
+		data = fp.read()
+	if not data.startswith(ResourceSampler.MAGIC):
+		raise ValueError(f"[{path}] is not a resource sample file")
+	offset = len(ResourceSampler.MAGIC) + ResourceSampler._HEADER.size
+	services: Dict[int, str] = {}
+	samples: Dict[str, List[Dict]] = {}
+	while offset < len(data):
+		record_type = data[offset]
+		if record_type == ResourceSampler.RECORD_CONTAINER:
+			if len(data) - offset < ResourceSampler._CONTAINER.size:
+				break
+			_, index, length = ResourceSampler._CONTAINER.unpack_from(data, offset)
+			offset += ResourceSampler._CONTAINER.size
+			services[index] = data[offset:offset + length].decode()
+			samples.setdefault(services[index], [])
+			offset += length
+		elif record_type == ResourceSampler.RECORD_SAMPLE:
+			if len(data) - offset < ResourceSampler._SAMPLE.size:
+				break  # Truncated by an interrupted run
+			_, index, timestamp, *values = ResourceSampler._SAMPLE.unpack_from(data, offset)
+			offset += ResourceSampler._SAMPLE.size
+			samples[services[index]].append({"timestamp": timestamp, **dict(zip(ResourceSampler.FIELDS, values))})
+		else:
+			raise ValueError(f"[{path}] contains an unknown record type [{record_type}] at offset {offset}")
+	return samples
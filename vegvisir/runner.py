@@ -1,23 +1,43 @@
+import concurrent.futures
 import dataclasses
+import filecmp
 import getpass
 import grp
+import json
 import logging
 import os
 import pathlib
 import queue
 import re
+import shlex
 import shutil
+import subprocess
 import tempfile
 import threading
-import time
+from collections import deque
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List
+from typing import Callable, Deque, Dict, Iterator, List, Set, Tuple
 
+from vegvisir import metrics
+from vegvisir.certificates import CertificateChain, CertificatePool
 from vegvisir.configuration import Configuration
-from vegvisir.data import VegvisirArguments
+from vegvisir.containerlogs import ContainerLogFollower
+from vegvisir.data import (ExperimentPaths, ExperimentPermutation,
+                           VegvisirArguments)
 from vegvisir.environments.base_environment import BaseEnvironment
-from vegvisir.exceptions import VegvisirException, VegvisirRunFailedException
+from vegvisir.estimation import CampaignHistory
+from vegvisir.exceptions import (VegvisirException, VegvisirRunFailedException,
+                                 VegvisirShardException)
+from vegvisir.hooks import PostHookExecutor
 from vegvisir.hostinterface import HostInterface
+from vegvisir.hostsnapshot import HostSnapshot
+from vegvisir.journal import PermutationJournal
+from vegvisir.metrics import MetricsRegistry, MetricsServer
+from vegvisir.readiness import ReadinessMonitor
+from vegvisir.resources import ResourceSampler
+from vegvisir.sharding import Shard
+from vegvisir.tracing import tracer
 
 from .implementation import Endpoint, Parameters
 
@@ -28,15 +48,123 @@ class LogFileFormatter(logging.Formatter):
 		# remove color control characters
 		return re.compile(r"\x1B[@-_][0-?]*[ -/]*[@-~]").sub("", msg)
 
+@dataclass
+class ServerShaperStack:
+	"""
+	Server, shaper and tcpdump containers running in a slot, together with the certificates the server was started with
+	"""
+	key: Tuple[Dict, Dict]  # (shaper configuration, server configuration)
+	certificate_chain: CertificateChain
+	log_path_server: str
+	log_path_shaper: str
+	compose_variables: str = ""
+	run_compose_variables: str = ""  # Stack variables completed with those of the most recent run, compose requires all variables to be set
+	staging_path: str | None = None  # Only set for reused stacks
+
+class PermutationQueue:
+	"""
+	Thread-safe permutation source shared by parallel slots
+	Slots with a warm stack ask for a permutation matching their stack, which is searched for within a window of upcoming permutations
+	"""
+	DEFAULT_LOOKAHEAD = 256
+
+	def __init__(self, permutations: Iterator[ExperimentPermutation], lookahead: int = 0) -> None:
+		self._permutations = permutations
+		self._lookahead = max(1, lookahead)
+		self._buffer: Deque[ExperimentPermutation] = deque()
+		self._lock = threading.Lock()
+
+	def take(self, preferred_stack: Tuple[Dict, Dict] | None = None) -> ExperimentPermutation | None:
+		with self._lock:
+			while len(self._buffer) < self._lookahead:
+				permutation = next(self._permutations, None)
+				if permutation is None:
+					break
+				self._buffer.append(permutation)
+			if len(self._buffer) == 0:
+				return None
+			if preferred_stack is not None:
+				for permutation in self._buffer:
+					if (permutation.shaper_configuration, permutation.server_configuration) == preferred_stack:
+						self._buffer.remove(permutation)
+						return permutation
+			return self._buffer.popleft()
+
+class ExperimentSlot:
+	"""
+	Isolated lane in which permutations are executed
+	Each slot owns a compose project, a leftnet/rightnet subnet pair, env files and an environment (with sensors)
+	Slot 0 maps onto the default values of docker-compose.yml
+	"""
+	def __init__(self, index: int, environment: BaseEnvironment, env_file_directory: str) -> None:
+		self.index = index
+		self.environment = environment
+		self.env_file_directory = env_file_directory
+
+		self.compose_project = "vegvisir" if index == 0 else f"vegvisir_slot{index}"
+		self.container_prefix = "" if index == 0 else f"slot{index}_"
+		self.leftnet_ipv4_prefix = f"193.167.{index}"
+		self.rightnet_ipv4_prefix = f"193.167.{100 + index}"
+		self.leftnet_ipv6_prefix = f"fd00:cafe:cafe:{index}"
+		self.rightnet_ipv6_prefix = f"fd00:cafe:cafe:{100 + index}"
+
+		self.server_env_file = os.path.join(env_file_directory, "server.env")
+		self.shaper_env_file = os.path.join(env_file_directory, "shaper.env")
+		self.client_env_file = os.path.join(env_file_directory, "client.env")
+
+		# Host client that is currently set up (hosts file entry) in this slot, including its last hydrated parameters for the destructors
+		self.active_host_client: Dict | None = None
+		self.active_host_client_parameters: Dict[str, str] = {}
+
+		self.stack: ServerShaperStack | None = None
+		self.readiness: ReadinessMonitor | None = None
+		self.pending_compose: List[concurrent.futures.Future] = []  # Compose calls still finishing after their containers got ready
+
+		self.abort_requested = False
+		self.logger = logging.getLogger(f"root.Experiment.slot{index}")
+
+	def compose_variables(self) -> str:
+		return (
+			"COMPOSE_PROJECT_NAME=" + self.compose_project + " "
+			"CONTAINER_PREFIX=" + self.container_prefix + " "
+			"LEFTNET_IPV4_PREFIX=" + self.leftnet_ipv4_prefix + " "
+			"RIGHTNET_IPV4_PREFIX=" + self.rightnet_ipv4_prefix + " "
+			"LEFTNET_IPV6_PREFIX=" + self.leftnet_ipv6_prefix + " "
+			"RIGHTNET_IPV6_PREFIX=" + self.rightnet_ipv6_prefix + " "
+			"SERVER_ENV=\"" + self.server_env_file + "\" "
+			"SHAPER_ENV=\"" + self.shaper_env_file + "\" "
+			"CLIENT_ENV=\"" + self.client_env_file + "\" "
+		)
+
+	def abort(self) -> None:
+		"""
+		Halt the run currently executing in this slot, mimics a CTRL-C on the sensor wait of a single slot setup
+		"""
+		self.abort_requested = True
+		self.environment.forcestop_sensors()
+		if self.environment.sync_semaphore is not None:
+			self.environment.sync_semaphore.release()
+
 class Experiment:
-	def __init__(self, sudo_password: str, configuration_object: Configuration):
+	COMMAND_TIMEOUT = 120  # seconds, upper bound for host and compose commands that are expected to finish promptly
+
+	def __init__(self, sudo_password: str, configuration_object: Configuration, host_interface: HostInterface | None = None):
+		"""
+		host_interface replaces the one issuing commands on this host with sudo_password (e.g., a stub in tests)
+		"""
 		self.configuration = configuration_object
 
-		self.post_hook_processors: List[threading.Thread] = []
-		self.post_hook_processor_request_stop: bool = False
-		self.post_hook_processor_queue: queue.Queue = queue.Queue()  # contains tuples (method pointer, path dataclass)
+		self.post_hook_executor: PostHookExecutor | None = None
+		self.metrics_server: MetricsServer | None = None
+
+		self.slots: List[ExperimentSlot] = []
+		self.certificate_pool: CertificatePool | None = None
+		self.journal: PermutationJournal | None = None
+		self.resuming = False
+		self._result_observers: List[Callable[[ExperimentPermutation, Dict], None]] = []
 
-		self.host_interface = HostInterface(sudo_password)
+		self.host_interface = host_interface if host_interface is not None else HostInterface(sudo_password)
+		self.host_snapshot = HostSnapshot(self.host_interface)
 
 		self.logger = logging.getLogger("root.Experiment")
 
@@ -44,17 +172,19 @@ class Experiment:
 		if not self.host_interface._is_sudo_password_valid():
 			raise VegvisirException("Authentication with sudo failed. Provided password is wrong?")
 
-	def _post_hook_processor(self):
-		while not self.post_hook_processor_request_stop:
-			try:
-				task, experiment_paths = self.post_hook_processor_queue.get(timeout=5)
-				try:
-					task(experiment_paths)
-				except Exception as e:
-					self.logger.error(f"Post-hook encountered an exception | {e}")
-			except queue.Empty:
-				pass  # We can ignore this one
+	def add_result_observer(self, observer: Callable[[ExperimentPermutation, Dict], None]) -> None:
+		"""
+		Call observer with every finished permutation and its journal entry, from the slot that ran it
+		"""
+		if observer not in self._result_observers:
+			self._result_observers.append(observer)
 
+	def _notify_result(self, permutation: ExperimentPermutation, entry: Dict) -> None:
+		for observer in self._result_observers:
+			try:
+				observer(permutation, entry)
+			except Exception as e:
+				self.logger.warning(f"Result observer failed for [{permutation.log_name}] (run {permutation.run_number}) | {e}")
 
 	def _enable_ipv6(self):
 		"""
@@ -64,310 +194,745 @@ class Experiment:
 		if out != "" or err != "":
 			self.logger.debug(f"Enabling ipv6 resulted in non empty output | STDOUT [{out}] | STDERR [{err}]")
 
-	def print_debug_information(self, command: str) -> None:
-		_, out, err = self.host_interface.spawn_blocking_subprocess(command, True, False)
-		self.logger.debug(f"Command [{command}]:\n{out}")
+	def _create_slots(self) -> List[ExperimentSlot]:
+		slots = []
+		for index in range(self.configuration.parallel_slots):
+			if index == 0:
+				# The first slot keeps the original environment object and writes its env files to the working directory
+				slots.append(ExperimentSlot(index, self.configuration.environment, os.getcwd()))
+			else:
+				slots.append(ExperimentSlot(index, self.configuration.create_environment(), tempfile.mkdtemp(dir="/tmp", prefix=f"vegvisir_slot{index}_")))
+			slots[-1].readiness = ReadinessMonitor(self.host_interface, slots[-1].compose_project)
+			slots[-1].readiness.start()
+		return slots
+
+	def _destroy_slots(self) -> None:
+		for slot in self.slots:
+			# Slots of a failed or aborted campaign still run their stack and host client, the env files they use are removed below
+			try:
+				self._finish_slot(slot)
+			except Exception as e:
+				slot.logger.error(f"Could not tear down slot {slot.index}, its compose project [{slot.compose_project}] may need to be removed by hand | {e}")
+			slot.readiness.stop()
+			if slot.index > 0:
+				shutil.rmtree(slot.env_file_directory, ignore_errors=True)
+		self.slots = []
+
+	def _permutation_log_paths(self, permutation: ExperimentPermutation) -> Tuple[str, str]:
+		log_path_iteration = os.path.join(self.configuration.path_collection.log_path_date, f"run_{permutation.run_number}/") if self.configuration.iterations > 1 else self.configuration.path_collection.log_path_date
+		return log_path_iteration, os.path.join(log_path_iteration, permutation.log_name)
+
+	def _create_permutation_paths(self, permutation: ExperimentPermutation) -> ExperimentPaths:
+		# Paths, we create the folders so we can later bind them as docker volumes for direct logging output
+		# Avoids docker "no space left on device" errors
+		log_path_iteration, log_path_permutation = self._permutation_log_paths(permutation)
+		paths = dataclasses.replace(
+			self.configuration.path_collection,
+			log_path_iteration=log_path_iteration,
+			log_path_permutation=log_path_permutation,
+			log_path_client=os.path.join(log_path_permutation, 'client'),
+			log_path_server=os.path.join(log_path_permutation, 'server'),
+			log_path_shaper=os.path.join(log_path_permutation, 'shaper'),
+			download_path_client=os.path.join(log_path_permutation, 'downloads')
+		)
+		for log_dir in [paths.log_path_client, paths.log_path_server, paths.log_path_shaper, paths.download_path_client]:
+			pathlib.Path(log_dir).mkdir(parents=True, exist_ok=True)
+		pathlib.Path(os.path.join(paths.log_path_iteration, "client__shaper__server")).touch()
+		return paths
+
+	def _setup_host_client(self, slot: ExperimentSlot, permutation: ExperimentPermutation) -> None:
+		"""
+		Host clients require a hosts file entry for as long as consecutive permutations use the same client configuration
+		Switching client configurations tears down the previous host client setup
+		"""
+		if slot.active_host_client is not None and slot.active_host_client == permutation.client_configuration:
+			return
+		self._teardown_host_client(slot)
+
+		client = self.configuration.client_endpoints[permutation.client_configuration["name"]]
+		if client.type != Endpoint.Type.HOST:
+			return
+		_, out, err = self.host_interface.spawn_blocking_subprocess(f"hostman add {slot.rightnet_ipv4_prefix}.100 server4", True, False, Experiment.COMMAND_TIMEOUT)
+		slot.logger.debug("Vegvisir: append entry to hosts: %s", out.strip())
+		if err is not None and len(err) > 0:
+			slot.logger.debug("Vegvisir: appending entry to hosts file resulted in error: %s", err)
+		slot.active_host_client = permutation.client_configuration
+		slot.active_host_client_parameters = {}
+
+	def _teardown_host_client(self, slot: ExperimentSlot) -> None:
+		if slot.active_host_client is None:
+			return
+		client = self.configuration.client_endpoints[slot.active_host_client["name"]]
+		for destructor in client.destruct:
+			destructor_command = destructor.serialize_command(slot.active_host_client_parameters)
+			slot.logger.debug(f"Issuing client destruct command [{destructor_command}]")
+			_, out, err = self.host_interface.spawn_blocking_subprocess(destructor_command, destructor.requires_root, True)
+			if out is not None and len(out) > 0:
+				slot.logger.debug(f"Destruct command STDOUT:\n{out}")
+			if err is not None and len(err) > 0:
+				slot.logger.debug(f"Destruct command STDERR:\n{err}")
+
+		_, out, err = self.host_interface.spawn_blocking_subprocess("hostman remove --names=server4", True, False, Experiment.COMMAND_TIMEOUT)
+		slot.logger.debug("Vegvisir: remove entry from hosts: %s", out.strip())
 		if err is not None and len(err) > 0:
-			self.logger.warning(f"Command [{command}] returned stderr output:\n{err}")
+			slot.logger.debug("Vegvisir: removing entry from hosts file resulted in error: %s", err)
+		slot.active_host_client = None
+		slot.active_host_client_parameters = {}
+
+	def _start_stack(self, slot: ExperimentSlot, permutation: ExperimentPermutation, paths: ExperimentPaths, vegvisirBaseArguments: VegvisirArguments) -> ServerShaperStack:
+		"""
+		Acquire certificates, write the server and shaper env files and bring up the server, shaper and tcpdump containers
+		Reused stacks log to slot specific staging directories which are rotated into the permutation directories after every run
+		"""
+		shaper_config = permutation.shaper_configuration
+		server_config = permutation.server_configuration
+		shaper = self.configuration.shapers[shaper_config["name"]]
+		server = self.configuration.server_endpoints[server_config["name"]]
+		client = self.configuration.client_endpoints[permutation.client_configuration["name"]]
+		environment = slot.environment
+		logger = slot.logger
+
+		with tracer.span("certificate acquire", slot=slot.index):
+			certificate_chain = self.certificate_pool.acquire()
+		stack = ServerShaperStack(
+			key=(shaper_config, server_config),
+			certificate_chain=certificate_chain,
+			log_path_server=paths.log_path_server,
+			log_path_shaper=paths.log_path_shaper
+		)
+		if self.configuration.reuse_stack:
+			stack.staging_path = os.path.join(self.configuration.path_collection.log_path_date, f".stack_slot{slot.index}")
+			stack.log_path_server = os.path.join(stack.staging_path, "server")
+			stack.log_path_shaper = os.path.join(stack.staging_path, "shaper")
+			if os.path.exists(stack.staging_path):
+				# Left behind by an interrupted campaign that is being resumed
+				self.host_interface.spawn_blocking_subprocess(f"rm -rf {shlex.quote(stack.staging_path)}", True, False)
+			for log_dir in [stack.log_path_server, stack.log_path_shaper]:
+				pathlib.Path(log_dir).mkdir(parents=True, exist_ok=True)
+
+		vegvisirStackArguments = dataclasses.replace(vegvisirBaseArguments, CERT_FINGERPRINT=stack.certificate_chain.fingerprint, LOG_PATH_SERVER=stack.log_path_server, LOG_PATH_SHAPER=stack.log_path_shaper)
+		vegvisirServerArguments = dataclasses.replace(vegvisirStackArguments, ROLE="server", TESTCASE=environment.get_QIR_compatibility_testcase(BaseEnvironment.Perspective.SERVER))
+		vegvisirShaperArguments = dataclasses.replace(vegvisirStackArguments, ROLE="shaper", SCENARIO = shaper.scenarios[shaper_config["scenario"]].command, WAITFORSERVER="server:443")  # Important edgecase! Shaper uses server instead of server4
+
+		stack.compose_variables = (
+			slot.compose_variables() +
+
+			"SERVER=" + server.image.full + " "
+			"SHAPER=" + shaper.image.full + " "
+
+			"CERTS=" + stack.certificate_chain.path + " "
+			"WWW=" + self.configuration.www_path + " "
+
+			"LOG_PATH_SERVER=\"" + stack.log_path_server + "\" "
+			"LOG_PATH_SHAPER=\"" + stack.log_path_shaper + "\" "
+		)
+
+		server_params = server.parameters.hydrate_with_arguments(server_config.get("arguments", {}), vegvisirServerArguments.dict())
+		shaper_params = shaper.scenarios[shaper_config["scenario"]].parameters.hydrate_with_arguments(shaper_config.get("arguments", {}), vegvisirShaperArguments.dict())
+
+		with open(slot.server_env_file, "w") as fp:
+			Parameters.serialize_to_env_file(server_params, fp)
+		with open(slot.shaper_env_file, "w") as fp:
+			Parameters.serialize_to_env_file(shaper_params, fp)
+
+		containers = "sim server tcpdump_leftnet tcpdump_rightnet"
+
+		stack.run_compose_variables = self._run_compose_variables(stack, client, paths)
+		cmd = (
+			stack.run_compose_variables
+			+ " docker compose up -d "
+			+ containers
+		)
+		self._start_containers(slot, cmd, containers.split())
+		slot.stack = stack
+
+		# Host applications require some packet rerouting to be able to reach docker containers
+		if client.type == Endpoint.Type.HOST:
+			with tracer.span("host routing", slot=slot.index):
+				rightnet_subnet = f"{slot.rightnet_ipv4_prefix}.0/24"
+				shaper_leftnet_address = f"{slot.leftnet_ipv4_prefix}.2"
+				logger.debug(f"Detected local client, rerouting localhost traffic to {rightnet_subnet} via {shaper_leftnet_address}")
+				_, out, err = self.host_interface.spawn_blocking_subprocess(f"ip route del {rightnet_subnet}", True, False, Experiment.COMMAND_TIMEOUT)
+				if err is not None and len(err) > 0:
+					raise VegvisirRunFailedException(f"Failed to remove route to {rightnet_subnet} | STDOUT [{out}] | STDERR [{err}]")
+				logger.debug(f"Removed docker compose route to {rightnet_subnet}")
+
+				_, out, err = self.host_interface.spawn_blocking_subprocess(f"ip route add {rightnet_subnet} via {shaper_leftnet_address}", True, False, Experiment.COMMAND_TIMEOUT)
+				if err is not None and len(err) > 0:
+					raise VegvisirRunFailedException(f"Failed to reroute {rightnet_subnet} via {shaper_leftnet_address} | STDOUT [{out}] | STDERR [{err}]")
+				logger.debug(f"Rerouted {rightnet_subnet} via {shaper_leftnet_address}")
+
+				_, out, err = self.host_interface.spawn_blocking_subprocess(f"./veth-checksum.sh {slot.leftnet_ipv4_prefix}.255", True, False, Experiment.COMMAND_TIMEOUT)
+				if err is not None and len(err) > 0:
+					raise VegvisirRunFailedException(f"Virtual ethernet device checksum failed | STDOUT [{out}] | STDERR [{err}]")
+		return stack
+
+	def _start_containers(self, slot: ExperimentSlot, command: str, services: List[str]) -> None:
+		"""
+		Issue the compose command starting services and return as soon as docker reports all of them ready
+		The compose call itself is left to finish in the background and reaped before the slot issues its teardown commands (cf. _reap_compose)
+		Readiness phases are timestamped relative to the "stack_start" phase
+		"""
+		with tracer.span("containers start", slot=slot.index, services=services):
+			slot.readiness.reset()
+			slot.readiness.mark("stack_start")
+			compose = self.host_interface.aio.submit(self.host_interface.aio.run(command, False, True, Experiment.COMMAND_TIMEOUT))
+			if slot.readiness.wait(services, compose):
+				slot.readiness.mark("ready")
+				slot.pending_compose.append(compose)
+				compose.add_done_callback(lambda future: self._compose_finished(slot, services, future))
+				return
+			slot.logger.debug(f"Readiness of {services} could not be determined through docker events, relying on compose to finish")
+			result = self.host_interface.aio.wait(compose)
+			self._compose_finished(slot, services, compose)
+			if result.timed_out:
+				raise VegvisirRunFailedException(f"Starting {services} did not finish within {Experiment.COMMAND_TIMEOUT}s")
+
+	def _compose_finished(self, slot: ExperimentSlot, services: List[str], compose: concurrent.futures.Future) -> None:
+		if compose.cancelled() or compose.exception() is not None:
+			slot.logger.warning(f"Starting {services} did not finish | {'cancelled' if compose.cancelled() else compose.exception()}")
+			return
+		result = compose.result()
+		slot.readiness.mark("compose_finished")
+		slot.logger.debug(f"Started {services} | STDOUT [{result.stdout.strip()}] | STDERR [{result.stderr.strip()}]")
+		if result.timed_out:
+			slot.logger.warning(f"Starting {services} did not finish within {Experiment.COMMAND_TIMEOUT}s")
+		elif result.returncode != 0:
+			slot.logger.warning(f"Starting {services} exited with code {result.returncode} after the containers were ready")
+
+	def _reap_compose(self, slot: ExperimentSlot) -> None:
+		"""
+		Wait for compose calls that were still finishing after their containers were ready, compose commands of a project should not overlap
+		"""
+		pending, slot.pending_compose = slot.pending_compose, []
+		for compose in pending:
+			try:
+				self.host_interface.aio.wait(compose)
+			except concurrent.futures.CancelledError:
+				pass
+
+	def _run_compose_variables(self, stack: ServerShaperStack, client: Endpoint, paths: ExperimentPaths) -> str:
+		client_image = client.image.full if client.type == Endpoint.Type.DOCKER else "none"  # Docker compose v2 requires an image name, can't default to blank string
+		return (
+			stack.compose_variables +
+
+			"CLIENT=" + client_image + " "
+			"DOWNLOAD_PATH_CLIENT=\"" + paths.download_path_client + "\" "
+			"LOG_PATH_CLIENT=\"" + paths.log_path_client + "\" "
+			"PCAP_PATH_SHAPER=\"" + paths.log_path_shaper + "\" "
+		)
+
+	def _stop_stack(self, slot: ExperimentSlot) -> None:
+		self._reap_compose(slot)
+		if slot.stack is None:
+			return
+		with tracer.span("stack stop", slot=slot.index):
+			result, out, err = self.host_interface.spawn_blocking_subprocess(slot.stack.run_compose_variables + " docker compose down", False, True, Experiment.COMMAND_TIMEOUT)
+			slot.logger.debug(out)
+			slot.logger.debug(err)
+			if result.timed_out:
+				slot.logger.warning(f"Stopping the server and shaper did not finish within {Experiment.COMMAND_TIMEOUT}s")
+			if slot.stack.staging_path is not None:
+				# Staging directories contain files written by the (root) containers
+				_, out, err = self.host_interface.spawn_blocking_subprocess(f"rm -rf {shlex.quote(slot.stack.staging_path)}", True, False)
+				if len(err) > 0:
+					slot.logger.warning(f"Could not remove stack staging directory [{slot.stack.staging_path}] | {err}")
+			self.certificate_pool.release(slot.stack.certificate_chain)
+			slot.stack = None
+
+	def _rotate_stack_logs(self, slot: ExperimentSlot, paths: ExperimentPaths) -> None:
+		"""
+		Move the output of a reused server and shaper into the permutation directories
+		Files are copied and truncated (cf. logrotate copytruncate) as the containers might still hold them open
+		"""
+		with tracer.span("log rotation", slot=slot.index):
+			rotations = [(slot.stack.log_path_server, paths.log_path_server), (slot.stack.log_path_shaper, paths.log_path_shaper)]
+			commands = []
+			for staging_path, destination_path in rotations:
+				rotate_command = f"cd {shlex.quote(staging_path)} && find . -type f ! -empty -exec cp --parents -p {{}} {shlex.quote(destination_path)} \\; -exec truncate -s 0 {{}} \\;"
+				commands.append(self.host_interface.aio.run("sh -c " + shlex.quote(rotate_command), True, False))
+			# Server and shaper directories are independent, rotate them side by side
+			for (staging_path, destination_path), result in zip(rotations, self.host_interface.aio.run_concurrently(*commands)):
+				if len(result.stderr) > 0:
+					slot.logger.warning(f"Rotating stack output [{staging_path}] to [{destination_path}] failed | {result.stderr.strip()}")
+
+	def _execute_permutation(self, slot: ExperimentSlot, permutation: ExperimentPermutation) -> None:
+		"""
+		Run a permutation and append its outcome to the campaign journal
+		"""
+		_, log_path_permutation = self._permutation_log_paths(permutation)
+		if self.resuming and os.path.exists(log_path_permutation):
+			# Output of an attempt that did not complete before the campaign was interrupted
+			_, _, err = self.host_interface.spawn_blocking_subprocess(f"rm -rf {shlex.quote(log_path_permutation)}", True, False)
+			if len(err) > 0:
+				slot.logger.warning(f"Could not remove output of earlier attempt @ {log_path_permutation} | {err}")
+
+		started = datetime.now()
+		with tracer.span("permutation", "permutation", log_name=permutation.log_name, run_number=permutation.run_number, slot=slot.index) as span:
+			try:
+				outcome, details = self._run_permutation(slot, permutation)
+			except Exception as e:
+				entry = self.journal.record(permutation, PermutationJournal.OUTCOME_FAILED, started, datetime.now(), log_path_permutation, error=str(e))
+				self._record_permutation_metrics(PermutationJournal.OUTCOME_FAILED, log_path_permutation)
+				self._notify_result(permutation, entry)
+				raise
+			span["outcome"] = outcome
+			span.update(details)
+		entry = self.journal.record(permutation, outcome, started, datetime.now(), log_path_permutation, **details)
+		self._record_permutation_metrics(outcome, log_path_permutation)
+		self._notify_result(permutation, entry)
+
+	def _record_permutation_metrics(self, outcome: str, log_path_permutation: str) -> None:
+		metrics.permutations_total.inc(outcome=outcome)
+		if self.configuration.metrics_settings.enabled:
+			# Walks the whole permutation directory, only worth it when the metrics are exported
+			metrics.count_output_bytes(log_path_permutation)
+			metrics.registry.write_snapshot(os.path.join(self.configuration.path_collection.log_path_date, MetricsRegistry.SNAPSHOT_FILENAME))
+
+	def _start_metrics_server(self) -> None:
+		metrics_settings = self.configuration.metrics_settings
+		if not metrics_settings.enabled:
+			return
+		self.metrics_server = MetricsServer(metrics.registry, metrics_settings.address, metrics_settings.port)
+		try:
+			port = self.metrics_server.start()
+		except OSError as e:
+			self.logger.warning(f"Could not serve campaign metrics on {metrics_settings.address}:{metrics_settings.port}, only {MetricsRegistry.SNAPSHOT_FILENAME} snapshots are written | {e}")
+			self.metrics_server = None
+			return
+		self.logger.info(f"Serving campaign metrics on http://{metrics_settings.address}:{port}/metrics")
+
+	def _run_permutation(self, slot: ExperimentSlot, permutation: ExperimentPermutation) -> Tuple[str, Dict]:
+		client_config = permutation.client_configuration
+		shaper_config = permutation.shaper_configuration
+		server_config = permutation.server_configuration
+		environment = slot.environment
+		logger = slot.logger
+
+		logger.info(f'Running {client_config["name"]} over {shaper_config["name"]} against {server_config["name"]}')
+		client = self.configuration.client_endpoints[client_config["name"]]
+
+		# SETUP
+		slot.abort_requested = False
+		with tracer.span("host client setup", slot=slot.index):
+			self._setup_host_client(slot, permutation)
+
+		iteration_start_time = datetime.now()
+		paths = self._create_permutation_paths(permutation)
+
+		# We want all output to be saved to file for later evaluation/debugging
+		log_file = os.path.join(paths.log_path_permutation, "output.txt")
+		log_handler = logging.FileHandler(log_file)
+		log_handler.setLevel(logging.DEBUG)
+		logger.addHandler(log_handler)
+
+		path_collection_copy = dataclasses.replace(paths)
+
+		with tracer.span("pre-hook", "hook", slot=slot.index):
+			logger.debug("Calling environment pre_hook")
+			pre_hook_start = datetime.now()
+			try:
+				environment.pre_run_hook(path_collection_copy)
+				pre_hook_total = datetime.now() - pre_hook_start
+				if pre_hook_total.total_seconds() > 5:
+					logger.debug(f"Pre-hook took {datetime.now() - pre_hook_start} to complete.")
+			except Exception as e:
+				logger.error(f"Pre-hook encountered an exception | {e}")
+
+		vegvisirBaseArguments = VegvisirArguments()
+		vegvisirBaseArguments.LOG_PATH_CLIENT = paths.log_path_client
+		vegvisirBaseArguments.LOG_PATH_SERVER = paths.log_path_server
+		vegvisirBaseArguments.LOG_PATH_SHAPER = paths.log_path_shaper
+		vegvisirBaseArguments.DOWNLOAD_PATH_CLIENT = paths.download_path_client
+
+		# TODO pick a better/cleaner spot to do this
+		vegvisirBaseArguments.ORIGIN = "server4"
+		vegvisirBaseArguments.ORIGIN_IPV4 = "server4"
+		vegvisirBaseArguments.ORIGIN_IPV6 = "server6" # TODO hostman this
+		vegvisirBaseArguments.ORIGIN_PORT = "443"
+		vegvisirBaseArguments.WAITFORSERVER = "server4:443"
+		vegvisirBaseArguments.SSLKEYLOGFILE = "/logs/keys.log"
+		vegvisirBaseArguments.QLOGDIR = "/logs/qlog/"
+		vegvisirBaseArguments.ENVIRONMENT = environment.environment_name if environment.environment_name != "" else None
+
+		# Server and shaper are only (re)started when no reusable stack with the same configurations is running in this slot
+		stack_key = (shaper_config, server_config)
+		stack_is_warm = self.configuration.reuse_stack and slot.stack is not None and slot.stack.key == stack_key
+		if stack_is_warm:
+			logger.debug("Reusing running server and shaper")
+		else:
+			with tracer.span("stack start", slot=slot.index):
+				self._stop_stack(slot)
+				self._start_stack(slot, permutation, paths, vegvisirBaseArguments)
+		stack = slot.stack
+		vegvisirBaseArguments.CERT_FINGERPRINT = stack.certificate_chain.fingerprint
+
+		docker_compose_vars = self._run_compose_variables(stack, client, paths)
+		stack.run_compose_variables = docker_compose_vars
+
+		if stack_is_warm:
+			# Rotate the packet captures by recreating the tcpdump containers with the current permutation directory mounted
+			self._start_containers(slot, docker_compose_vars + " docker compose up -d --no-deps --force-recreate tcpdump_leftnet tcpdump_rightnet", ["tcpdump_leftnet", "tcpdump_rightnet"])
+
+		# Container output is streamed into per-role files for the duration of the run, reused containers only stream output of the current run
+		log_followers = []
+		for service, role in [("server", "server"), ("sim", "shaper"), ("tcpdump_leftnet", "tcpdump_leftnet"), ("tcpdump_rightnet", "tcpdump_rightnet")]:
+			follower = ContainerLogFollower(self.host_interface, docker_compose_vars, service, os.path.join(paths.log_path_permutation, f"output_{role}.txt"), iteration_start_time if stack_is_warm else None)
+			follower.start()
+			log_followers.append(follower)
+
+		# Kernel/net parameters and docker versions are captured once per campaign, runs only record how interfaces and routes differ
+		with tracer.span("host diff", slot=slot.index):
+			host_diff = self.host_snapshot.write_run_diff(os.path.join(paths.log_path_permutation, "host_diff.json"))
+			logger.debug(f"Host state differs from campaign snapshot | {len(host_diff['interfaces_added'])} interface(s) added, {len(host_diff['interfaces_removed'])} removed, {len(host_diff['interfaces_changed'])} changed | {len(host_diff['routes_added'])} route(s) added, {len(host_diff['routes_removed'])} removed")
+
+		# Setup client
+		with tracer.span("client start", slot=slot.index, client_type=client.type.name):
+			vegvisirClientArguments = dataclasses.replace(vegvisirBaseArguments, ROLE = "client", TESTCASE = environment.get_QIR_compatibility_testcase(BaseEnvironment.Perspective.CLIENT))
+			client_params = client.parameters.hydrate_with_arguments(client_config.get("arguments", {}), vegvisirClientArguments.dict())
+
+			client_cmd = ""
+			client_proc = None
+			client_output = open(os.path.join(paths.log_path_permutation, "output_client.txt"), "ab")
+			if client.type == Endpoint.Type.DOCKER:
+				with open(slot.client_env_file, "w") as fp:
+					Parameters.serialize_to_env_file(client_params, fp)
+
+				# Docker compose 2.17 introduced a breaking change: --timeout was renamed --waitTimeout
+				# Both, however, support the -t shorthand which we will use to be backwards compatible with previous docker compose versions
+				# A reused stack should outlive the client, --no-deps and the lack of --abort-on-container-exit leave server and shaper untouched
+				client_cmd = (
+					docker_compose_vars
+					+ (" docker compose up --no-deps -t 1 " if self.configuration.reuse_stack else " docker compose up --abort-on-container-exit -t 1 ")
+					+ "--timestamps --no-log-prefix client"
+				)
+				client_proc = self.host_interface.spawn_parallel_subprocess(client_cmd, False, True, stdout=client_output, stderr=subprocess.STDOUT)
+
+			elif client.type == Endpoint.Type.HOST:
+				slot.active_host_client_parameters = client_params
+				for constructor in client.construct:
+					constructor_command = constructor.serialize_command(client_params)
+					logger.debug(f"Issuing client construct command [{constructor_command}]")
+					_, out, err = self.host_interface.spawn_blocking_subprocess(constructor_command, constructor.requires_root, True)
+					if out is not None and len(out) > 0:
+						logger.debug(f"Construct command STDOUT:\n{out}")
+					if err is not None and len(err) > 0:
+						logger.debug(f"Construct command STDERR:\n{err}")
+				client_cmd = client.command.serialize_command(client_params)
+				client_proc = self.host_interface.spawn_parallel_subprocess(client_cmd, stdout=client_output, stderr=subprocess.STDOUT)
+			client_output.close()  # The client process holds its own copy of the file descriptor
+			client_start = slot.readiness.mark("client_start")
+			logger.debug("Vegvisir: running client: %s", client_cmd)
+			stack_start = slot.readiness.phases.get("stack_start", client_start)
+			slot.readiness.write(os.path.join(paths.log_path_permutation, "readiness.json"), "stack_start", stack_reused=stack_is_warm, startup_dead_time=(client_start - stack_start).total_seconds())
+
+		resource_sampler = None
+		if self.configuration.resource_sampling_settings.enabled and ResourceSampler.supported():
+			resource_sampler = ResourceSampler(slot.readiness.container_ids, os.path.join(paths.log_path_permutation, ResourceSampler.FILENAME), self.configuration.resource_sampling_settings.interval)
+			resource_sampler.start()
+
+		with tracer.span("client runtime", "sensor", slot=slot.index, sensors=len(environment.sensors)):
+			try:
+				environment.start_sensors(client_proc, paths)
+				environment.waitfor_sensors()
+				environment.clean_and_reset_sensors()
+			except KeyboardInterrupt:
+				slot.abort_requested = True
+				environment.forcestop_sensors()
+				environment.clean_and_reset_sensors()
+			finally:
+				if resource_sampler is not None:
+					resource_sampler.stop()
+		details = {}
+		trigger = environment.trigger_details()
+		if trigger is not None:
+			# Leaf sensor that ended the run, sensors within expressions are named after their position (e.g., "any[1].timeout")
+			details["trigger"] = trigger
+			logger.info(f"Run ended by sensor [{trigger['sensor']}] | {trigger['reason']}")
+		outcome = PermutationJournal.OUTCOME_COMPLETED
+		if slot.abort_requested:
+			slot.abort_requested = False
+			outcome = PermutationJournal.OUTCOME_ABORTED
+			with open(os.path.join(paths.log_path_permutation, "crashreport.txt"), "w") as fp:
+				fp.write("Test aborted by user interaction.")
+			logger.info("CTRL-C test interrupted")
+
+		with tracer.span("teardown", slot=slot.index, stack_reused=self.configuration.reuse_stack):
+			client_proc.terminate() # TODO redundant?
+			client_proc.wait()
+			self._reap_compose(slot)
+
+			if self.configuration.reuse_stack:
+				# Only per-run state is reset: client container, packet captures and the server/shaper log volumes
+				# Client removal and stopping the packet captures are independent and therefore overlapped
+				for result in self.host_interface.aio.run_concurrently(
+					self.host_interface.aio.run(docker_compose_vars + " docker compose rm -s -f client", False, True, Experiment.COMMAND_TIMEOUT),
+					self.host_interface.aio.run(docker_compose_vars + " docker compose stop -t 1 tcpdump_leftnet tcpdump_rightnet", False, True, Experiment.COMMAND_TIMEOUT)
+				):
+					logger.debug(result.stdout.strip())
+					logger.debug(result.stderr.strip())
+					if result.timed_out:
+						logger.warning(f"Command did not finish within {Experiment.COMMAND_TIMEOUT}s [{result.command}]")
+				self._rotate_stack_logs(slot, paths)
+				ContainerLogFollower.stop_all(log_followers, 0.5)
+			else:
+				self._stop_stack(slot)
+				ContainerLogFollower.stop_all(log_followers, 5)
+
+		# Change ownership of docker output to running user
+		with tracer.span("chown", slot=slot.index):
+			try:
+				real_username = getpass.getuser()
+				real_primary_groupname = grp.getgrgid(os.getgid()).gr_name
+				chown_to = f"{real_username}:{real_primary_groupname}"
+				_, out, err = self.host_interface.spawn_blocking_subprocess(f"chown -R {shlex.quote(chown_to)} {shlex.quote(paths.log_path_permutation)}", True, False)
+				if len(err) > 0:
+					raise VegvisirException(err)
+				logger.debug(f"Changed ownership of output logs to {chown_to} | {paths.log_path_permutation}")
+			except (KeyError, TypeError):
+				logger.warning(f"Could not change log output ownership @ {paths.log_path_permutation}, groupname might not be found?")
+			except VegvisirException as e:
+				logger.warning(f"Could not change log output ownership [{e}] @ {paths.log_path_permutation}")
+
+		with tracer.span("post-hook submit", "hook", slot=slot.index):
+			self.post_hook_executor.submit(environment, path_collection_copy, f"{permutation.log_name} (run {permutation.run_number})")  # Only blocks when the hook backlog is full
+
+		if self.configuration.iterations > 1:
+			logger.info(f'Test run {permutation.run_number}/{self.configuration.iterations} duration: {datetime.now() - iteration_start_time}')
+		else:
+			logger.info(f'Test run duration: {datetime.now() - iteration_start_time}')
+
+		logger.removeHandler(log_handler)
+		log_handler.close()
+		return outcome, details
+
+	def _finish_slot(self, slot: ExperimentSlot) -> None:
+		self._stop_stack(slot)
+		self._teardown_host_client(slot)
+
+	def _slot_worker(self, slot: ExperimentSlot, permutations: "PermutationQueue", progress_queue: queue.Queue, stop_event: threading.Event) -> None:
+		"""
+		Thread target of a parallel slot, keeps pulling permutations from the shared queue until it runs dry
+		Progress (the permutation about to run), failures and a final None are reported to the main thread through progress_queue
+		"""
+		try:
+			while not stop_event.is_set():
+				preferred_stack = slot.stack.key if self.configuration.reuse_stack and slot.stack is not None else None
+				permutation = permutations.take(preferred_stack)
+				if permutation is None:
+					break
+				progress_queue.put(permutation)
+				self._execute_permutation(slot, permutation)
+			self._finish_slot(slot)
+		except Exception as e:
+			progress_queue.put(e)
+		progress_queue.put(None)
+
+	def _run_parallel(self, permutations: Iterator[ExperimentPermutation], total: int | None):
+		# Permutations of an unknown total (e.g., leased from a coordinator) are not taken ahead, other workers could run them meanwhile
+		permutation_queue = PermutationQueue(permutations, lookahead=PermutationQueue.DEFAULT_LOOKAHEAD if self.configuration.reuse_stack and total is not None else 0)
+		progress_queue = queue.Queue()
+		stop_event = threading.Event()
+		workers = []
+		for slot in self.slots:
+			worker = threading.Thread(target=self._slot_worker, args=(slot, permutation_queue, progress_queue, stop_event))
+			worker.start()
+			workers.append(worker)
+
+		counter = 0
+		finished_workers = 0
+		failure = None
+		try:
+			while finished_workers < len(workers):
+				try:
+					event = progress_queue.get()
+				except KeyboardInterrupt:
+					self.logger.info("CTRL-C received, aborting the permutations that are currently running")
+					for slot in self.slots:
+						slot.abort()
+					continue
+				if event is None:
+					finished_workers += 1
+				elif isinstance(event, Exception):
+					# Mimic the single slot behavior, a failing run halts the experiment
+					failure = event if failure is None else failure
+					stop_event.set()
+					for slot in self.slots:
+						slot.abort()
+				else:
+					yield event.client_configuration["name"], event.shaper_configuration["name"], event.server_configuration["name"], counter, total
+					counter += 1
+		finally:
+			if finished_workers < len(workers):
+				# E.g., the generator got closed, slots are only torn down (cf. _destroy_slots) once their worker stopped
+				stop_event.set()
+				for slot in self.slots:
+					slot.abort()
+			for worker in workers:
+				worker.join()
+		if failure is not None:
+			raise failure
+
+	def _copy_configuration(self, source: str, destination: str, description: str) -> None:
+		if self.resuming and os.path.exists(destination):
+			# Keep the configuration the campaign was started with, permutations are matched on their configuration
+			if not filecmp.cmp(source, destination, shallow=False):
+				self.logger.warning(f"The {description} configuration differs from the one the resumed campaign was started with [{destination}]. Changed permutations will be run, completed ones are skipped.")
+			return
+		try:
+			shutil.copy2(source, destination)
+		except IOError as e:
+			self.logger.warning(f"Could not copy over {description} configuration to root of experiment logs: {destination} | {e}")
+
+	def _campaign_file_path(self, name: str, timestamp: datetime) -> str:
+		"""
+		Path of a JSON file in the root of the campaign logs, files written by an earlier attempt of a resumed campaign are kept
+		"""
+		path = os.path.join(self.configuration.path_collection.log_path_date, f"{name}.json")
+		if os.path.exists(path):
+			path = os.path.join(self.configuration.path_collection.log_path_date, f"{name}_{timestamp:%Y-%m-%dT_%H-%M-%S}.json")
+		return path
 
-	def run(self):
+	def _cached_images(self) -> Set[str] | None:
+		"""
+		Images available on the host, the scheduler defers permutations that still need to pull theirs
+		"""
+		proc, out, err = self.host_interface.spawn_blocking_subprocess("docker images --format \"{{.Repository}}:{{.Tag}}\"", False, False, Experiment.COMMAND_TIMEOUT)
+		if proc.returncode != 0:
+			self.logger.warning(f"Could not list the cached docker images, image pulls are not accounted for in the plan | {err}")
+			return None
+		return {image for image in out.splitlines() if "<none>" not in image}
+
+	def _check_resumed_shard(self, shard_details: Dict | None) -> None:
+		"""
+		A resumed shard needs to be partitioned the same way as when it was started, otherwise permutations may be run by two shards or by none
+		"""
+		plan_path = os.path.join(self.configuration.path_collection.log_path_date, "plan.json")
+		if not self.resuming or not os.path.isfile(plan_path):
+			return
+		with open(plan_path) as fp:
+			started_shard = json.load(fp).get("shard")
+		if shard_details is None:
+			if started_shard is not None:
+				raise VegvisirShardException(f"Can not resume campaign [{self.configuration.path_collection.log_path_date}] as a whole campaign, it was started as shard [{started_shard['index']}/{started_shard['count']}].")
+			return
+		if started_shard is None:
+			raise VegvisirShardException(f"Can not resume campaign [{self.configuration.path_collection.log_path_date}] as shard [{shard_details['index']}/{shard_details['count']}], it was not started as a shard.")
+		if (started_shard["index"], started_shard["count"]) != (shard_details["index"], shard_details["count"]):
+			raise VegvisirShardException(f"Can not resume campaign [{self.configuration.path_collection.log_path_date}] as shard [{shard_details['index']}/{shard_details['count']}], it was started as shard [{started_shard['index']}/{started_shard['count']}].")
+		if started_shard["fingerprint"] != shard_details["fingerprint"]:
+			self.logger.warning(f"The partition of shard [{shard_details['index']}/{shard_details['count']}] differs from the one it was started with, the configuration or campaign history changed. Merging this shard with the others will fail.")
+
+	def run(self, resume_path: str | None = None, shard: Shard | None = None, history: CampaignHistory | None = None, permutations: Iterator[ExperimentPermutation] | None = None, log_suffix: str | None = None):
+		"""
+		Run all permutations of the experiment, yields (client, shaper, server, counter, total) before every permutation
+		Providing resume_path continues an earlier campaign in its log directory, skipping the permutations its journal lists as completed
+		Providing shard only runs its slice of the permutations, partitioned by the expected cost of the permutations according to history
+		Providing permutations runs those instead of scheduling the experiment (e.g., leased from a coordinator), the total is then unknown (None)
+		log_suffix is appended to the name of the log directory of a new campaign
+		"""
 		vegvisir_start_time = datetime.now()
 
 		# Root path for logs needs to be known and exist for metadata copies
-		self.configuration.path_collection.log_path_date = os.path.join(self.configuration.path_collection.log_path_root, "{:%Y-%m-%dT_%H-%M-%S}".format(vegvisir_start_time))
+		self.resuming = resume_path is not None
+		if self.resuming:
+			if not os.path.isdir(resume_path):
+				raise VegvisirException(f"Can not resume campaign, log directory [{resume_path}] does not exist.")
+			self.configuration.path_collection.log_path_date = os.path.abspath(resume_path)
+		else:
+			if shard is not None:
+				log_suffix = shard.name
+			self.configuration.path_collection.log_path_date = os.path.join(self.configuration.path_collection.log_path_root, "{:%Y-%m-%dT_%H-%M-%S}".format(vegvisir_start_time) + (f"_{log_suffix}" if log_suffix is not None else ""))
 		pathlib.Path(self.configuration.path_collection.log_path_date).mkdir(parents=True, exist_ok=True)
-		
+
 		# Copy the implementations and experiment configurations for reproducibility purposes
 		# For now, assume json files
-		implementations_destination = os.path.join(self.configuration.path_collection.log_path_date, "implementations.json")
-		experiment_destination = os.path.join(self.configuration.path_collection.log_path_date, "experiment.json")
+		self._copy_configuration(self.configuration.path_collection.implementations_configuration_file_path, os.path.join(self.configuration.path_collection.log_path_date, "implementations.json"), "implementations")
+		self._copy_configuration(self.configuration.path_collection.experiment_configuration_file_path, os.path.join(self.configuration.path_collection.log_path_date, "experiment.json"), "experiment")
+
+		self.journal = PermutationJournal(self.configuration.path_collection.log_path_date)
+		self.journal.load()
+
+		# Planned before anything is started, a shard that can not be resumed fails early
+		# The plan is generated lazily and anew for every pass over it (writing, counting and running), it is never held in memory as a whole
+		if permutations is None:
+			scheduler = self.configuration.create_scheduler(self._cached_images())
+			planned = scheduler.plan
+			experiment_permutation_total = self.configuration.permutation_count
+			shard_details = None
+			if shard is not None:
+				assignment, fingerprint = Shard.partition(self.configuration.permutations(), self.configuration.iterations, shard.count, history)
+				shard_details = {"index": shard.index, "count": shard.count, "fingerprint": fingerprint, "history": [os.path.basename(campaign) for campaign in history.campaigns] if history is not None else []}
+				planned = lambda: shard.select(scheduler.plan(), self.configuration.iterations, assignment)
+				experiment_permutation_total = shard.permutation_count(self.configuration.iterations, assignment)
+				self.logger.info(f"Running shard [{shard}], {experiment_permutation_total} of {self.configuration.permutation_count} permutation(s)")
+			self._check_resumed_shard(shard_details)
+			plan_summary = scheduler.write_plan(planned(), self._campaign_file_path("plan", vegvisir_start_time), shard_details)["summary"]
+			self.logger.debug(f"Scheduled {plan_summary['permutations']} permutations using the [{scheduler.name}] strategy: {plan_summary['stack_starts']} stack start(s), {plan_summary['shaper_image_switches']} shaper image switch(es), {plan_summary['host_client_setups']} host client setup(s)")
+			plan = planned()
+			if self.resuming:
+				completed = sum(1 for permutation in planned() if self.journal.is_completed(permutation))
+				self.logger.info(f"Resuming campaign [{self.configuration.path_collection.log_path_date}], {completed} permutation(s) already completed")
+				experiment_permutation_total -= completed
+				plan = (permutation for permutation in plan if not self.journal.is_completed(permutation))
+
+		# Spans of every phase are recorded in trace.jsonl and converted into trace.json (chrome://tracing, Perfetto) once the campaign ends
+		tracer.start(self.configuration.path_collection.log_path_date)
+		tracer.add_observer(metrics.observe_span)
+
+		# Everything started from here on is stopped in the finally clause, post-hooks, trace and metrics of a failed campaign are kept as well
 		try:
-			shutil.copy2(self.configuration.path_collection.implementations_configuration_file_path, implementations_destination) 
-		except IOError as e:
-			self.logger.warning(f"Could not copy over implementations configuration to root of experiment logs: {implementations_destination} | {e}")
-		try:
-			shutil.copy2(self.configuration.path_collection.experiment_configuration_file_path, experiment_destination) 
-		except IOError as e:
-			self.logger.warning(f"Could not copy over experiment configuration to root of experiment logs: {experiment_destination} | {e}")
-
-		for _ in range(max(1, self.configuration.hook_processor_count)):
-			processor = threading.Thread(target=self._post_hook_processor)
-			processor.start()
-			self.post_hook_processors.append(processor)
-
-		self._enable_ipv6()
-
-		experiment_permutation_total = len(self.configuration.shaper_configurations) * len(self.configuration.server_configurations) * len(self.configuration.client_configurations) * self.configuration.iterations
-		experiment_permutation_counter = 0
-		for shaper_config in self.configuration.shaper_configurations:
-			for server_config in self.configuration.server_configurations:
-				for client_config in self.configuration.client_configurations:
-					yield client_config["name"], shaper_config["name"], server_config["name"], experiment_permutation_counter, experiment_permutation_total
-					self.logger.info(f'Running {client_config["name"]} over {shaper_config["name"]} against {server_config["name"]}')
-					shaper = self.configuration.shapers[shaper_config["name"]]
-					server = self.configuration.server_endpoints[server_config["name"]]
-					client = self.configuration.client_endpoints[client_config["name"]]
-
-					# SETUP
-					if client.type == Endpoint.Type.HOST:
-						_, out, err = self.host_interface.spawn_blocking_subprocess("hostman add 193.167.100.100 server4", True, False)
-						self.logger.debug("Vegvisir: append entry to hosts: %s", out.strip())
-						if err is not None and len(err) > 0:
-							self.logger.debug("Vegvisir: appending entry to hosts file resulted in error: %s", err)
-
-					for run_number in range(0,self.configuration.iterations):
-						iteration_start_time = datetime.now()
-						
-						# Paths, we create the folders so we can later bind them as docker volumes for direct logging output
-						# Avoids docker "no space left on device" errors
-						self.configuration.path_collection.log_path_iteration = os.path.join(self.configuration.path_collection.log_path_date, f"run_{run_number}/") if self.configuration.iterations > 1 else self.configuration.path_collection.log_path_date
-						self.configuration.path_collection.log_path_permutation = os.path.join(self.configuration.path_collection.log_path_iteration, f"{client_config.get('log_name', client_config['name'])}__{shaper_config.get('log_name', shaper_config['name'])}__{server_config.get('log_name', server_config['name'])}")
-						self.configuration.path_collection.log_path_client = os.path.join(self.configuration.path_collection.log_path_permutation, 'client')
-						self.configuration.path_collection.log_path_server = os.path.join(self.configuration.path_collection.log_path_permutation, 'server')
-						self.configuration.path_collection.log_path_shaper = os.path.join(self.configuration.path_collection.log_path_permutation, 'shaper')
-						self.configuration.path_collection.download_path_client = os.path.join(self.configuration.path_collection.log_path_permutation, 'downloads')
-						for log_dir in [self.configuration.path_collection.log_path_client, self.configuration.path_collection.log_path_server, self.configuration.path_collection.log_path_shaper, self.configuration.path_collection.download_path_client]:
-							pathlib.Path(log_dir).mkdir(parents=True, exist_ok=True)
-						pathlib.Path(os.path.join(self.configuration.path_collection.log_path_iteration, "client__shaper__server")).touch()						
-
-						# We want all output to be saved to file for later evaluation/debugging
-						log_file = os.path.join(self.configuration.path_collection.log_path_permutation, "output.txt")
-						log_handler = logging.FileHandler(log_file)
-						log_handler.setLevel(logging.DEBUG)
-						self.logger.addHandler(log_handler)
-
-						path_collection_copy = dataclasses.replace(self.configuration.path_collection)
-
-						self.logger.debug("Calling environment pre_hook")
-						pre_hook_start = datetime.now()
-						try:
-							self.configuration.environment.pre_run_hook(path_collection_copy)
-							pre_hook_total = datetime.now() - pre_hook_start
-							if pre_hook_total.total_seconds() > 5:
-								self.logger.debug(f"Pre-hook took {datetime.now() - pre_hook_start} to complete.")
-						except Exception as e:
-							self.logger.error(f"Pre-hook encountered an exception | {e}")
-
-						vegvisirBaseArguments = VegvisirArguments()
-						vegvisirBaseArguments.LOG_PATH_CLIENT = self.configuration.path_collection.log_path_client
-						vegvisirBaseArguments.LOG_PATH_SERVER = self.configuration.path_collection.log_path_server
-						vegvisirBaseArguments.LOG_PATH_SHAPER = self.configuration.path_collection.log_path_shaper
-						vegvisirBaseArguments.DOWNLOAD_PATH_CLIENT = self.configuration.path_collection.download_path_client
-
-						client_image = client.image.full if client.type == Endpoint.Type.DOCKER else "none"  # Docker compose v2 requires an image name, can't default to blank string
-
-						cert_path = tempfile.TemporaryDirectory(dir="/tmp", prefix="vegvisir_certs_")
-						vegvisirBaseArguments.CERT_FINGERPRINT = self.configuration.environment.generate_cert_chain(cert_path.name)
-
-						# TODO pick a better/cleaner spot to do this
-						vegvisirBaseArguments.ORIGIN = "server4"
-						vegvisirBaseArguments.ORIGIN_IPV4 = "server4"
-						vegvisirBaseArguments.ORIGIN_IPV6 = "server6" # TODO hostman this
-						vegvisirBaseArguments.ORIGIN_PORT = "443"
-						vegvisirBaseArguments.WAITFORSERVER = "server4:443"
-						vegvisirBaseArguments.SSLKEYLOGFILE = "/logs/keys.log"
-						vegvisirBaseArguments.QLOGDIR = "/logs/qlog/"
-						vegvisirBaseArguments.ENVIRONMENT = self.configuration.environment.environment_name if self.configuration.environment.environment_name != "" else None
-
-						vegvisirServerArguments = dataclasses.replace(vegvisirBaseArguments, ROLE="server", TESTCASE=self.configuration.environment.get_QIR_compatibility_testcase(BaseEnvironment.Perspective.SERVER))
-						vegvisirShaperArguments = dataclasses.replace(vegvisirBaseArguments, ROLE="shaper", SCENARIO = shaper.scenarios[shaper_config["scenario"]].command, WAITFORSERVER="server:443")  # Important edgecase! Shaper uses server instead of server4
-
-						docker_compose_vars = (
-							"CLIENT=" + client_image + " "
-							"SERVER=" + server.image.full + " "
-							"SHAPER=" + shaper.image.full + " "
-
-							"CERTS=" + cert_path.name + " "
-							"WWW=" + self.configuration.www_path + " "
-							"DOWNLOAD_PATH_CLIENT=\"" + self.configuration.path_collection.download_path_client + "\" "
-
-							"LOG_PATH_CLIENT=\"" + self.configuration.path_collection.log_path_client + "\" "
-							"LOG_PATH_SERVER=\"" + self.configuration.path_collection.log_path_server + "\" "
-							"LOG_PATH_SHAPER=\"" + self.configuration.path_collection.log_path_shaper + "\" "
-						)
-
-						
-						# server_params = server.parameters.hydrate_with_arguments(server_config.get("arguments", {}), {"ROLE": "server", "SSLKEYLOGFILE": "/logs/keys.log", "QLOGDIR": "/logs/qlog/", "TESTCASE": self.configuration.environment.get_QIR_compatibility_testcase(BaseEnvironment.Perspective.SERVER)})
-						server_params = server.parameters.hydrate_with_arguments(server_config.get("arguments", {}), vegvisirServerArguments.dict())
-						# shaper_params = shaper.scenarios[shaper_config["scenario"]].parameters.hydrate_with_arguments(shaper_config.get("arguments", {}), {"WAITFORSERVER": "server:443", "SCENARIO": shaper.scenarios[shaper_config["scenario"]].command})
-						shaper_params = shaper.scenarios[shaper_config["scenario"]].parameters.hydrate_with_arguments(shaper_config.get("arguments", {}), vegvisirShaperArguments.dict())
-						
-						with open("server.env", "w") as fp:
-							Parameters.serialize_to_env_file(server_params, fp)
-						with open("shaper.env", "w") as fp:
-							Parameters.serialize_to_env_file(shaper_params, fp)
-
-						# params += " ".join(testcase.additional_envs())
-						# params += " ".join(shaper.additional_envs())
-						# params += " ".join(server.additional_envs())
-						# containers = "sim server " + " ".join(testcase.additional_containers())
-						containers = "sim server tcpdump_leftnet tcpdump_rightnet"
-
-						cmd = (
-							docker_compose_vars
-							+ " docker compose up -d "
-							+ containers
-						)
-						# self.host_interface.spawn_parallel_subprocess(cmd, False, True)
-						_, out, err = self.host_interface.spawn_blocking_subprocess(cmd, False, True) # TODO Test out if this truly fixes the RNETLINK error? This call might be too slow
-
-						self.logger.debug(f"Started sim and server | STDOUT [{out}] | STDERR [{chr(10) if err.find(chr(10)) >= 0 else ''}{err}{chr(10) if err.find(chr(10)) >= 0 else ''}]") # chr(10) => '\n'
-						
-						# Host applications require some packet rerouting to be able to reach docker containers
-						if self.configuration.client_endpoints[client_config["name"]].type == Endpoint.Type.HOST:
-							self.logger.debug("Detected local client, rerouting localhost traffic to 193.167.100.0/24 via 193.167.0.2")
-							_, out, err = self.host_interface.spawn_blocking_subprocess("ip route del 193.167.100.0/24", True, False)
-							if err is not None and len(err) > 0:
-								raise VegvisirRunFailedException(f"Failed to remove route to 193.167.100.0/24 | STDOUT [{out}] | STDERR [{err}]")
-							self.logger.debug("Removed docker compose route to 193.167.100.0/24")
-
-							_, out, err = self.host_interface.spawn_blocking_subprocess("ip route add 193.167.100.0/24 via 193.167.0.2", True, False)
-							if err is not None and len(err) > 0:
-								raise VegvisirRunFailedException(f"Failed to reroute 193.167.100.0/24 via 193.167.0.2 | STDOUT [{out}] | STDERR [{err}]")
-							self.logger.debug("Rerouted 193.167.100.0/24 via 193.167.0.2")
-
-							_, out, err = self.host_interface.spawn_blocking_subprocess("./veth-checksum.sh", True, False)
-							if err is not None and len(err) > 0:
-								raise VegvisirRunFailedException(f"Virtual ethernet device checksum failed | STDOUT [{out}] | STDERR [{err}]")								
-
-						# Log kernel/net parameters
-						self.print_debug_information("ip address")
-						self.print_debug_information("ip route list")
-						self.print_debug_information("sysctl -a")
-						self.print_debug_information("docker version")
-						self.print_debug_information("docker compose version")
-
-						# Setup client
-						vegvisirClientArguments = dataclasses.replace(vegvisirBaseArguments, ROLE = "client", TESTCASE = self.configuration.environment.get_QIR_compatibility_testcase(BaseEnvironment.Perspective.CLIENT))
-						client_params = client.parameters.hydrate_with_arguments(client_config.get("arguments", {}), vegvisirClientArguments.dict())
-						
-						client_cmd = ""
-						client_proc = None
-						if client.type == Endpoint.Type.DOCKER:
-							with open("client.env", "w") as fp:
-								Parameters.serialize_to_env_file(client_params, fp)
-							
-							# params += " ".join(client.additional_envs())
-							# Docker compose 2.17 introduced a breaking change: --timeout was renamed --waitTimeout
-							# Both, however, support the -t shorthand which we will use to be backwards compatible with previous docker compose versions
-							client_cmd = (
-								docker_compose_vars
-								+ " docker compose up --abort-on-container-exit -t 1 "
-								+ "client"
-							)
-							client_proc = self.host_interface.spawn_parallel_subprocess(client_cmd, False, True)
-
-						elif client.type == Endpoint.Type.HOST:
-							for constructor in client.construct:
-								constructor_command = constructor.serialize_command(client_params)
-								self.logger.debug(f"Issuing client construct command [{constructor_command}]")
-								_, out, err = self.host_interface.spawn_blocking_subprocess(constructor_command, constructor.requires_root, True)
-								if out is not None and len(out) > 0:
-									self.logger.debug(f"Construct command STDOUT:\n{out}")
-								if err is not None and len(err) > 0:
-									self.logger.debug(f"Construct command STDERR:\n{err}")
-							client_cmd = client.command.serialize_command(client_params)
-							client_proc = self.host_interface.spawn_parallel_subprocess(client_cmd)
-						self.logger.debug("Vegvisir: running client: %s", client_cmd)
-
-						try:
-							self.configuration.environment.start_sensors(client_proc, self.configuration.path_collection)
-							self.configuration.environment.waitfor_sensors()
-							self.configuration.environment.clean_and_reset_sensors()
-						except KeyboardInterrupt:
-							self.configuration.environment.forcestop_sensors()
-							self.configuration.environment.clean_and_reset_sensors()
-							with open(os.path.join(self.configuration.path_collection.log_path_permutation, "crashreport.txt"), "w") as fp:
-								fp.write("Test aborted by user interaction.")
-							self.logger.info("CTRL-C test interrupted")
-
-						client_proc.terminate() # TODO redundant?
-						if client.type == Endpoint.Type.HOST:
-							# Doing this for docker will nullify the sensor system
-							# Docker client logs are retrieved with "docker compose logs"
-							out, err = client_proc.communicate()
-							self.logger.debug(out.decode("utf-8"))
-							self.logger.debug(err.decode("utf-8"))
-
-						_, out, err = self.host_interface.spawn_blocking_subprocess(docker_compose_vars + " docker compose logs --timestamps server", False, True)
-						self.logger.debug(out)
-						self.logger.debug(err)
-						_, out, err = self.host_interface.spawn_blocking_subprocess(docker_compose_vars + " docker compose logs --timestamps sim", False, True)
-						self.logger.debug(out)
-						self.logger.debug(err)
-						_, out, err = self.host_interface.spawn_blocking_subprocess(docker_compose_vars + " docker compose logs --timestamps client", False, True)
-						self.logger.debug(out)
-						self.logger.debug(err)
-						_, out, err = self.host_interface.spawn_blocking_subprocess(docker_compose_vars + " docker compose logs --timestamps tcpdump_leftnet", False, True)
-						self.logger.debug(out)
-						self.logger.debug(err)
-						_, out, err = self.host_interface.spawn_blocking_subprocess(docker_compose_vars + " docker compose logs --timestamps tcpdump_rightnet", False, True)
-						self.logger.debug(out)
-						self.logger.debug(err)
-
-						_, out ,err = self.host_interface.spawn_blocking_subprocess(docker_compose_vars + " docker compose down", False, True) # TODO TEMP
-						self.logger.debug(out)
-						self.logger.debug(err)
-
-					# BREAKDOWN
-					if client.type == Endpoint.Type.HOST:
-						for destructor in client.destruct:
-								destructor_command = destructor.serialize_command(client_params)
-								self.logger.debug(f"Issuing client destruct command [{destructor_command}]")
-								_, out, err = self.host_interface.spawn_blocking_subprocess(destructor_command, destructor.requires_root, True)
-								if out is not None and len(out) > 0:
-									self.logger.debug(f"Destruct command STDOUT:\n{out}")
-								if err is not None and len(err) > 0:
-									self.logger.debug(f"Destruct command STDERR:\n{err}")
-
-						_, out, err = self.host_interface.spawn_blocking_subprocess("hostman remove --names=server4", True, False)
-						self.logger.debug("Vegvisir: remove entry from hosts: %s", out.strip())
-						if err is not None and len(err) > 0:
-							self.logger.debug("Vegvisir: removing entry from hosts file resulted in error: %s", err)
-
-					# Change ownership of docker output to running user
-					try:
-						real_username = getpass.getuser()
-						real_primary_groupname = grp.getgrgid(os.getgid()).gr_name
-						chown_to = f"{real_username}:{real_primary_groupname}"
-						_, out, err = self.host_interface.spawn_blocking_subprocess(f"chown -R {chown_to} {self.configuration.path_collection.log_path_permutation}", True, False)
-						if len(err) > 0:
-							raise VegvisirException(err)
-						self.logger.debug(f"Changed ownership of output logs to {chown_to} | {self.configuration.path_collection.log_path_permutation}")
-					except (KeyError, TypeError):
-						self.logger.warning(f"Could not change log output ownership @ {self.configuration.path_collection.log_path_permutation}, groupname might not be found?")
-					except VegvisirException as e:
-						self.logger.warning(f"Could not change log output ownership [{e}] @ {self.configuration.path_collection.log_path_permutation}")
-
-					self.post_hook_processor_queue.put((self.configuration.environment.post_run_hook, path_collection_copy))  # Queue is infinite, should not block
-
-					experiment_permutation_counter += 1
-
-					if self.configuration.iterations > 1:
-						self.logger.info(f'Test run {run_number}/{self.configuration.iterations} duration: {datetime.now() - iteration_start_time}')
-					else:
-						self.logger.info(f'Test run duration: {datetime.now() - iteration_start_time}')
-					
-					self.logger.removeHandler(log_handler)
-					log_handler.close()
-		
-		yield None, None, None, None, None
-
-		# Halt the hook processors
-		wait_for_hook_processors_counter = 0
-		while True:
-			if self.post_hook_processor_queue.qsize() == 0:
-				self.post_hook_processor_request_stop = True
-			states = [t.is_alive() for t in self.post_hook_processors]
-			time.sleep(5)
-			if not any(states):
-				for t in self.post_hook_processors:
-					t.join()
-				break
-			if wait_for_hook_processors_counter % 2 == 0:
-				hooks_todo = self.post_hook_processor_queue.qsize()
-				if hooks_todo > 0:
-					self.logger.info(f"Vegvisir is waiting for all post-hooks to process, approximately {self.post_hook_processor_queue.qsize()} request(s) still in queue.")
-				else:
-					self.logger.info(f"Vegvisir is waiting for {sum(states)} post-hook processor(s) to stop. If this message persists, perform CTRL + C")
-			wait_for_hook_processors_counter += 1
+			self.post_hook_executor = PostHookExecutor(max(1, self.configuration.hook_processor_count), self.configuration.hook_mode, self.configuration.hook_backlog, self.configuration.environment_name)
+			metrics.post_hook_queue_depth.set_function(lambda: self.post_hook_executor.pending)
+			self._start_metrics_server()
+			if self.configuration.resource_sampling_settings.enabled and not ResourceSampler.supported():
+				self.logger.warning(f"Container resources are not sampled, the host does not use cgroup v2 (no {ResourceSampler.CGROUP_ROOT}/cgroup.controllers)")
+
+			# Root commands of the campaign are executed by one privileged process, instead of a sudo authentication per command
+			self.host_interface.start_privileged_helper()
+			self._enable_ipv6()
+			# Runs of a resumed campaign are diffed against the snapshot taken on resume
+			self.host_snapshot.capture_baseline(self._campaign_file_path("host_snapshot", vegvisir_start_time))
+
+			self.slots = self._create_slots()
+			self.certificate_pool = CertificatePool(self.configuration.environment.generate_cert_chain, self.configuration.certificate_settings)
+			self.certificate_pool.start()
+
+			if permutations is None:
+				metrics.permutations_planned.set(experiment_permutation_total)
+				permutations = plan
+			else:
+				experiment_permutation_total = None
+			if len(self.slots) == 1:
+				slot = self.slots[0]
+				for experiment_permutation_counter, permutation in enumerate(permutations):
+					yield permutation.client_configuration["name"], permutation.shaper_configuration["name"], permutation.server_configuration["name"], experiment_permutation_counter, experiment_permutation_total
+					self._execute_permutation(slot, permutation)
+				self._finish_slot(slot)
+			else:
+				self.logger.info(f"Running {experiment_permutation_total if experiment_permutation_total is not None else 'leased'} permutations over {len(self.slots)} parallel slots")
+				yield from self._run_parallel(permutations, experiment_permutation_total)
+
+			yield None, None, None, None, None
+		finally:
+			self._destroy_slots()
+			if self.certificate_pool is not None:
+				self.certificate_pool.stop()
+				self.certificate_pool = None
+			self.host_interface.stop_privileged_helper()
+
+			if self.post_hook_executor is not None:
+				# Returns as soon as the last post-hook finished
+				self.post_hook_executor.shutdown()
+				hook_summary = self.post_hook_executor.write_summary(self._campaign_file_path("post_hooks", vegvisir_start_time))
+				if hook_summary["submitted"] > 0:
+					self.logger.info(f"{hook_summary['completed']} post-hook(s) completed, {hook_summary['failed']} failed | total {hook_summary['total_duration']:.2f}s, mean {hook_summary['mean_duration'] or 0:.2f}s, slowest {hook_summary['max_duration'] or 0:.2f}s [{hook_summary['slowest']}]")
+
+			trace_path = tracer.stop()
+			self.logger.debug(f"Campaign trace written to {trace_path}")
+
+			if self.configuration.metrics_settings.enabled:
+				metrics.registry.write_snapshot(os.path.join(self.configuration.path_collection.log_path_date, MetricsRegistry.SNAPSHOT_FILENAME))
+			if self.metrics_server is not None:
+				self.metrics_server.stop()
+				self.metrics_server = None
@@ -0,0 +1,256 @@
+import json
+import logging
+import random
+from collections import deque
+from datetime import datetime
+from typing import IO, TYPE_CHECKING, Deque, Dict, Iterable, Iterator, List, Set, Tuple
+
+from vegvisir.data import ExperimentPermutation
+from vegvisir.implementation import Endpoint, get_tag_from_image
+
+if TYPE_CHECKING:
+	from vegvisir.configuration import Configuration
+
+
+class Scheduler:
+	"""
+	Turns the permutation matrix of a configuration into an execution plan
+	Strategies order the matrix such that expensive transitions between consecutive permutations are kept to a minimum
+	Plans are generated lazily, only the order of the server and shaper combinations is kept in memory; every call of plan() yields the same order
+	cached_images holds the images the host already has (cf. docker images), None when unknown (e.g., while only planning) in which case pulls are not accounted for
+	"""
+	# Relative cost of the transitions between two consecutive permutations
+	IMAGE_PULL_COST = 50  # Image the host has not cached, pulled by docker the first time a permutation uses it
+	SHAPER_IMAGE_COST = 10  # Shaper container of a different image
+	STACK_COST = 4  # Server and shaper (re)start, including certificate handout
+	HOST_CLIENT_COST = 2  # Hosts file entry, every construct and destruct command of a host client adds to this
+
+	def __init__(self, configuration: "Configuration", seed: int | None = None, cached_images: Set[str] | None = None) -> None:
+		self.configuration = configuration
+		self.seed = seed
+		self.cached_images = {Scheduler._image_reference(image) for image in cached_images} if cached_images is not None else None
+		self.logger = logging.getLogger("root.Scheduler")
+
+	@property
+	def name(self) -> str:
+		return next(name for name, scheduler in available_schedulers.items() if scheduler is type(self))
+
+	def _matrix_permutation(self, shaper_index: int, server_index: int, client_index: int, run_number: int) -> ExperimentPermutation:
+		# Indices match the ones handed out by Configuration.permutations()
+		index = ((shaper_index * len(self.configuration.server_configurations) + server_index) * len(self.configuration.client_configurations) + client_index) * self.configuration.iterations + run_number
+		return ExperimentPermutation(
+			index, run_number,
+			self.configuration.client_configurations[client_index],
+			self.configuration.shaper_configurations[shaper_index],
+			self.configuration.server_configurations[server_index]
+		)
+
+	def _shaper_order(self) -> List[int]:
+		"""
+		Shaper configurations that use the same image are placed next to each other, keeping the configured order otherwise
+		"""
+		images: Dict[str, List[int]] = {}
+		for shaper_index, shaper_config in enumerate(self.configuration.shaper_configurations):
+			images.setdefault(self._shaper_image(shaper_config), []).append(shaper_index)
+		return [shaper_index for shaper_indices in images.values() for shaper_index in shaper_indices]
+
+	def _stack_blocks(self) -> List[Tuple[int, int]]:
+		return [(shaper_index, server_index) for shaper_index in self._shaper_order() for server_index in range(len(self.configuration.server_configurations))]
+
+	def _shaper_image(self, shaper_config: Dict) -> str:
+		return self.configuration.shapers[shaper_config["name"]].image.full
+
+	def _host_client_cost(self, client_config: Dict) -> int:
+		endpoint = self.configuration.client_endpoints[client_config["name"]]
+		if endpoint.type != Endpoint.Type.HOST:
+			return 0
+		return Scheduler.HOST_CLIENT_COST + len(endpoint.construct) + len(endpoint.destruct)
+
+	@staticmethod
+	def _image_reference(image: str) -> str:
+		# docker images lists untagged references as latest
+		return image if get_tag_from_image(image) != "" else f"{image}:latest"
+
+	def _images(self, permutation: ExperimentPermutation) -> List[str]:
+		images = [self._shaper_image(permutation.shaper_configuration), self.configuration.server_endpoints[permutation.server_configuration["name"]].image.full]
+		client = self.configuration.client_endpoints[permutation.client_configuration["name"]]
+		if client.type == Endpoint.Type.DOCKER:
+			images.append(client.image.full)
+		return [Scheduler._image_reference(image) for image in images]
+
+	def _uncached_images(self, permutation: ExperimentPermutation, pulled: Set[str]) -> List[str]:
+		"""
+		Images of permutation that still need to be pulled, given the images pulled by the permutations before it
+		"""
+		if self.cached_images is None:
+			return []
+		return [image for image in self._images(permutation) if image not in self.cached_images and image not in pulled]
+
+	def transition_cost(self, previous: ExperimentPermutation | None, permutation: ExperimentPermutation, pulled: Set[str] | None = None) -> int:
+		"""
+		Cost of running permutation right after previous, pulled holds the images pulled earlier on in the plan
+		"""
+		cost = Scheduler.IMAGE_PULL_COST * len(self._uncached_images(permutation, pulled if pulled is not None else set()))
+		if previous is None or self._shaper_image(previous.shaper_configuration) != self._shaper_image(permutation.shaper_configuration):
+			cost += Scheduler.SHAPER_IMAGE_COST
+		if previous is None or (previous.shaper_configuration, previous.server_configuration) != (permutation.shaper_configuration, permutation.server_configuration):
+			cost += Scheduler.STACK_COST
+		if previous is None or previous.client_configuration != permutation.client_configuration:
+			cost += self._host_client_cost(permutation.client_configuration)
+			if previous is not None:
+				cost += self._host_client_cost(previous.client_configuration)
+		return cost
+
+	def summarize(self, plan: Iterable[ExperimentPermutation]) -> Dict:
+		summary = {
+			"permutations": 0,
+			"shaper_image_switches": 0,
+			"stack_starts": 0,
+			"host_client_setups": 0,
+			"image_pulls": 0 if self.cached_images is not None else None,
+			"cost": 0,
+		}
+		previous = None
+		pulled: Set[str] = set()
+		for permutation in plan:
+			summary["permutations"] += 1
+			if previous is None or self._shaper_image(previous.shaper_configuration) != self._shaper_image(permutation.shaper_configuration):
+				summary["shaper_image_switches"] += 1
+			if previous is None or (previous.shaper_configuration, previous.server_configuration) != (permutation.shaper_configuration, permutation.server_configuration):
+				summary["stack_starts"] += 1
+			if (previous is None or previous.client_configuration != permutation.client_configuration) and self._host_client_cost(permutation.client_configuration) > 0:
+				summary["host_client_setups"] += 1
+			summary["cost"] += self.transition_cost(previous, permutation, pulled)
+			uncached = self._uncached_images(permutation, pulled)
+			if len(uncached) > 0:
+				summary["image_pulls"] += len(uncached)
+				pulled.update(uncached)
+			previous = permutation
+		return summary
+
+	def plan(self) -> Iterator[ExperimentPermutation]:
+		raise NotImplementedError()
+
+	@staticmethod
+	def _write_entries(fp: IO[str], plan: Iterable[ExperimentPermutation]) -> Iterator[ExperimentPermutation]:
+		for position, permutation in enumerate(plan):
+			entry = {
+				"position": position,
+				"index": permutation.index,
+				"run_number": permutation.run_number,
+				"log_name": permutation.log_name,
+				"client": permutation.client_configuration,
+				"shaper": permutation.shaper_configuration,
+				"server": permutation.server_configuration,
+			}
+			fp.write(("," if position > 0 else "") + "\n        " + json.dumps(entry))
+			yield permutation
+
+	def write_plan(self, plan: Iterable[ExperimentPermutation], output_path: str, shard: Dict | None = None) -> Dict:
+		"""
+		Write the plan to output_path while it is generated, returns the document without its entries
+		Entries are written one per line, the summary (cf. summarize) follows them
+		"""
+		document = {
+			"timestamp": datetime.now().astimezone().isoformat(),
+			"strategy": self.name,
+			"seed": self.seed,
+			"shard": shard,
+		}
+		with open(output_path, "w") as fp:
+			fp.write(json.dumps(document, indent=4)[:-2] + ",\n    \"plan\": [")
+			document["summary"] = self.summarize(Scheduler._write_entries(fp, plan))
+			fp.write("\n    ],\n    \"summary\": " + json.dumps(document["summary"]) + "\n}\n")
+		return document
+
+
+class GroupedScheduler(Scheduler):
+	"""
+	All iterations of a server and shaper combination run back to back, every combination therefore starts its stack only once
+	Combinations are ordered greedily, each one is followed by the remaining combination that is cheapest to transition to (cf. transition_cost)
+	Combinations sharing their shaper image therefore stay together and combinations whose images still need to be pulled are deferred
+	Client order alternates between combinations so the last client of one combination is the first of the next, sparing a host client rebuild
+	"""
+	def _block_order(self) -> List[Tuple[int, int]]:
+		client_count = len(self.configuration.client_configurations)
+		# Costs only differ between combinations of different images, the first remaining combination per image pair is the candidate
+		candidates: Dict[Tuple[str, str], Deque[Tuple[int, int]]] = {}
+		for shaper_index, server_index in self._stack_blocks():
+			permutation = self._matrix_permutation(shaper_index, server_index, 0, 0)
+			candidates.setdefault(tuple(self._images(permutation)[:2]), deque()).append((shaper_index, server_index))
+		order = []
+		previous = None
+		pulled: Set[str] = set()
+		while len(candidates) > 0:
+			first_client = 0 if len(order) % 2 == 0 else client_count - 1
+			# min() keeps the first of equally expensive candidates, i.e., the configured order
+			images = min(candidates, key=lambda images: self.transition_cost(previous, self._matrix_permutation(*candidates[images][0], first_client, 0), pulled))
+			shaper_index, server_index = candidates[images].popleft()
+			if len(candidates[images]) == 0:
+				del candidates[images]
+			for client_index in range(client_count):
+				pulled.update(self._uncached_images(self._matrix_permutation(shaper_index, server_index, client_index, 0), pulled))
+			order.append((shaper_index, server_index))
+			previous = self._matrix_permutation(shaper_index, server_index, client_count - 1 - first_client, self.configuration.iterations - 1)
+		return order
+
+	def plan(self) -> Iterator[ExperimentPermutation]:
+		client_indices = list(range(len(self.configuration.client_configurations)))
+		for block_number, (shaper_index, server_index) in enumerate(self._block_order()):
+			for client_index in (client_indices if block_number % 2 == 0 else reversed(client_indices)):
+				for run_number in range(self.configuration.iterations):
+					yield self._matrix_permutation(shaper_index, server_index, client_index, run_number)
+
+
+class RoundRobinScheduler(Scheduler):
+	"""
+	Iterations are run outermost, every permutation completes its nth iteration before any permutation starts its nth + 1
+	Spreads each permutation over the duration of the campaign at the expense of up to one stack start per combination per iteration
+	"""
+	def plan(self) -> Iterator[ExperimentPermutation]:
+		client_indices = list(range(len(self.configuration.client_configurations)))
+		blocks = self._stack_blocks()
+		block_number = 0
+		for run_number in range(self.configuration.iterations):
+			# Alternating the combination order keeps the last combination of an iteration running into the next
+			for shaper_index, server_index in (blocks if run_number % 2 == 0 else reversed(blocks)):
+				for client_index in (client_indices if block_number % 2 == 0 else reversed(client_indices)):
+					yield self._matrix_permutation(shaper_index, server_index, client_index, run_number)
+				block_number += 1
+
+
+class RandomizedScheduler(Scheduler):
+	"""
+	Shuffles the order of the server and shaper combinations, and the order of the permutations within them
+	Combinations are kept together, as are shapers using the same image, such that stack starts and image switches match the grouped strategy
+	The seed is recorded in the plan, reusing it reproduces the order
+	"""
+	def __init__(self, configuration: "Configuration", seed: int | None = None, cached_images: Set[str] | None = None) -> None:
+		super().__init__(configuration, seed if seed is not None else random.SystemRandom().randrange(2**32), cached_images)
+
+	def plan(self) -> Iterator[ExperimentPermutation]:
+		rng = random.Random(self.seed)
+		image_groups: Dict[str, List[Tuple[int, int]]] = {}
+		for shaper_index, server_index in self._stack_blocks():
+			image_groups.setdefault(self._shaper_image(self.configuration.shaper_configurations[shaper_index]), []).append((shaper_index, server_index))
+		image_groups = list(image_groups.values())
+		rng.shuffle(image_groups)
+		blocks = []
+		for image_group in image_groups:
+			rng.shuffle(image_group)
+			blocks.extend(image_group)
+		# Only the permutations of one combination are shuffled at a time, by their position within the combination
+		client_count = len(self.configuration.client_configurations)
+		for shaper_index, server_index in blocks:
+			positions = list(range(client_count * self.configuration.iterations))
+			rng.shuffle(positions)
+			for position in positions:
+				yield self._matrix_permutation(shaper_index, server_index, *divmod(position, self.configuration.iterations))
+
+
+default_scheduler = "grouped"
+available_schedulers = {
+	"grouped": GroupedScheduler,
+	"round-robin": RoundRobinScheduler,
+	"randomized": RandomizedScheduler,
+}
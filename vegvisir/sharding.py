@@ -0,0 +1,233 @@
+import filecmp
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Tuple
+
+from vegvisir.data import ExperimentPermutation
+from vegvisir.exceptions import VegvisirShardException
+from vegvisir.journal import PermutationJournal
+
+if TYPE_CHECKING:
+	from vegvisir.estimation import CampaignHistory
+
+logger = logging.getLogger("root.Sharding")
+
+_SHARD_PATTERN = re.compile(r"^\s*(?P<index>[0-9]+)\s*/\s*(?P<count>[0-9]+)\s*$")
+
+
+class Shard:
+	"""
+	Slice i (1-based) out of N of the permutation matrix of an experiment
+	Permutations of one client, shaper and server combination are never split over shards, all iterations of a combination run on the same host
+	Combinations are assigned by their expected cost (longest first, to the least loaded shard), which only depends on the configuration and the campaign history
+	Hosts therefore agree on the partition as long as they are handed the same configuration and history
+	"""
+	def __init__(self, index: int, count: int) -> None:
+		if count < 1 or index < 1 or index > count:
+			raise VegvisirShardException(f"Shard [{index}/{count}] does not exist, expected i/N with 1 <= i <= N.")
+		self.index = index
+		self.count = count
+
+	@staticmethod
+	def parse(shard: str) -> "Shard":
+		match_object = _SHARD_PATTERN.match(shard)
+		if match_object is None:
+			raise VegvisirShardException(f"Shard [{shard}] is not of the form i/N (e.g., 2/4).")
+		return Shard(int(match_object.group("index")), int(match_object.group("count")))
+
+	@property
+	def name(self) -> str:
+		return f"shard{self.index}of{self.count}"
+
+	def __str__(self) -> str:
+		return f"{self.index}/{self.count}"
+
+	@staticmethod
+	def _unit(permutation: ExperimentPermutation, iterations: int) -> int:
+		# Matrix indices of all iterations of a combination are consecutive, cf. Configuration.permutations()
+		return permutation.index // iterations
+
+	@staticmethod
+	def partition(permutations: Iterable[ExperimentPermutation], iterations: int, count: int, history: "CampaignHistory | None" = None) -> Tuple[Dict[int, int], str]:
+		"""
+		Assign every combination of the permutation matrix to a shard (0-based), returns the shard per combination and a fingerprint of the assignment
+		Permutations without a cost estimate are assumed to take as long as the median estimated one (or 1 without any estimate)
+		"""
+		costs: Dict[int, float | None] = {}
+		estimated: List[float] = []
+		for permutation in permutations:
+			unit = Shard._unit(permutation, iterations)
+			duration = history.estimate(permutation)[0] if history is not None else None
+			if duration is None:
+				costs.setdefault(unit, None)
+				continue
+			estimated.append(duration)
+			costs[unit] = (costs.get(unit) or 0) + duration
+		fallback = sorted(estimated)[len(estimated) // 2] if len(estimated) > 0 else 1
+		# Iterations without an estimate of a combination are filled in with the fallback as well
+		unit_costs = {unit: cost if cost is not None else fallback * iterations for unit, cost in costs.items()}
+
+		# Longest processing time first, ties are broken by matrix order and shard number to remain deterministic
+		loads = [(0.0, shard) for shard in range(count)]
+		assignment: Dict[int, int] = {}
+		for unit in sorted(unit_costs, key=lambda unit: (-unit_costs[unit], unit)):
+			load, shard = heapq.heappop(loads)
+			assignment[unit] = shard
+			heapq.heappush(loads, (load + unit_costs[unit], shard))
+		fingerprint = hashlib.sha256(json.dumps(sorted(assignment.items())).encode()).hexdigest()
+		return assignment, fingerprint
+
+	def select(self, plan: Iterable[ExperimentPermutation], iterations: int, assignment: Dict[int, int]) -> Iterator[ExperimentPermutation]:
+		"""
+		Permutations of the plan that belong to this shard, in the order of the plan
+		"""
+		return (permutation for permutation in plan if assignment[Shard._unit(permutation, iterations)] == self.index - 1)
+
+	def permutation_count(self, iterations: int, assignment: Dict[int, int]) -> int:
+		return iterations * sum(1 for shard in assignment.values() if shard == self.index - 1)
+
+
+class ShardMerger:
+	"""
+	Combines the log directories of the shards of a campaign into a single campaign directory
+	Permutation directories are copied (or moved) into the same tree, journals are concatenated and the configurations are checked to be identical
+	Campaign files of each shard (plan, trace, post-hook summary, host snapshot, metrics) are kept below shards/<shard>/ of the merged campaign
+	"""
+	CONFIGURATION_FILENAMES = ["implementations.json", "experiment.json"]
+	SHARDS_DIRECTORY = "shards"
+	SUMMARY_FILENAME = "merge.json"
+
+	def __init__(self, shard_paths: List[str], output_path: str, move: bool = False) -> None:
+		self.shard_paths = [os.path.abspath(path) for path in shard_paths]
+		self.output_path = os.path.abspath(output_path)
+		self.move = move
+
+	@staticmethod
+	def _read_shard(shard_path: str) -> Dict:
+		# plan.json of the first attempt, later attempts of a resumed shard write timestamped copies
+		try:
+			with open(os.path.join(shard_path, "plan.json")) as fp:
+				document = json.load(fp)
+		except (OSError, json.JSONDecodeError) as e:
+			raise VegvisirShardException(f"[{shard_path}] holds no readable plan.json, is it the log directory of a campaign? | {e}")
+		if document.get("shard") is None:
+			raise VegvisirShardException(f"[{shard_path}] is not the log directory of a shard, its plan.json holds no shard information.")
+		return document
+
+	def _validate(self) -> List[Dict]:
+		if len(self.shard_paths) == 0:
+			raise VegvisirShardException("No shard log directories provided.")
+		if os.path.exists(self.output_path) and len(os.listdir(self.output_path)) > 0:
+			raise VegvisirShardException(f"Merge destination [{self.output_path}] already exists and is not empty.")
+		documents = [ShardMerger._read_shard(path) for path in self.shard_paths]
+
+		counts = {document["shard"]["count"] for document in documents}
+		if len(counts) > 1:
+			raise VegvisirShardException(f"Shards were split into a different number of shards {sorted(counts)}, they do not belong to the same campaign.")
+		indices = [document["shard"]["index"] for document in documents]
+		duplicates = {index for index in indices if indices.count(index) > 1}
+		if len(duplicates) > 0:
+			raise VegvisirShardException(f"Shard(s) {sorted(duplicates)} are provided more than once.")
+		if len({document["shard"]["fingerprint"] for document in documents}) > 1:
+			raise VegvisirShardException("Shards were partitioned differently (different configurations or campaign histories), their permutations may overlap.")
+
+		for filename in ShardMerger.CONFIGURATION_FILENAMES:
+			paths = [os.path.join(path, filename) for path in self.shard_paths if os.path.isfile(os.path.join(path, filename))]
+			if any(not filecmp.cmp(paths[0], path, shallow=False) for path in paths[1:]):
+				raise VegvisirShardException(f"Shards were run with a different {filename}, they do not belong to the same campaign.")
+
+		missing = sorted(set(range(1, counts.pop() + 1)) - set(indices))
+		if len(missing) > 0:
+			logger.warning(f"Shard(s) {missing} are not provided, the merged campaign is incomplete")
+		return documents
+
+	def _transfer_file(self, source: str, destination: str) -> None:
+		if os.path.exists(destination):
+			if filecmp.cmp(source, destination, shallow=False):
+				return  # e.g., the empty client__shaper__server marker of an iteration directory
+			raise VegvisirShardException(f"[{source}] conflicts with [{destination}] which was merged from another shard.")
+		os.makedirs(os.path.dirname(destination), exist_ok=True)
+		if self.move:
+			shutil.move(source, destination)
+		else:
+			shutil.copy2(source, destination, follow_symlinks=False)
+
+	def _transfer_tree(self, source: str, destination: str) -> int:
+		if not os.path.exists(destination) and self.move:
+			# Nothing to combine with, a single rename suffices when both are on the same file system
+			transferred = sum(len(filenames) for _, _, filenames in os.walk(source))
+			shutil.move(source, destination)
+			return transferred
+		transferred = 0
+		for directory, _, filenames in os.walk(source):
+			relative = os.path.relpath(directory, source)
+			os.makedirs(os.path.normpath(os.path.join(destination, relative)), exist_ok=True)
+			for filename in filenames:
+				self._transfer_file(os.path.join(directory, filename), os.path.normpath(os.path.join(destination, relative, filename)))
+				transferred += 1
+		return transferred
+
+	def merge(self) -> Dict:
+		"""
+		Returns a summary of the merge, which is written to merge.json in the merged campaign as well
+		"""
+		documents = self._validate()
+		os.makedirs(self.output_path, exist_ok=True)
+		summary = {
+			"shard_count": documents[0]["shard"]["count"],
+			"fingerprint": documents[0]["shard"]["fingerprint"],
+			"shards": [],
+			"planned": 0,
+			"completed": 0,
+			"incomplete": [],
+		}
+
+		for filename in ShardMerger.CONFIGURATION_FILENAMES:
+			for shard_path in self.shard_paths:
+				if os.path.isfile(os.path.join(shard_path, filename)):
+					shutil.copy2(os.path.join(shard_path, filename), os.path.join(self.output_path, filename))
+					break
+
+		merged_journal = PermutationJournal(self.output_path)
+		completed_keys = set()
+		with open(merged_journal.path, "a") as journal_fp:
+			for shard_path, document in sorted(zip(self.shard_paths, documents), key=lambda item: item[1]["shard"]["index"]):
+				shard = Shard(document["shard"]["index"], document["shard"]["count"])
+				journal = PermutationJournal(shard_path)
+				for entry in journal.load():
+					# Log paths are relative to the campaign root, the tree below it is kept as is
+					journal_fp.write(json.dumps({**entry, "shard": str(shard)}) + "\n")
+					if entry["outcome"] == PermutationJournal.OUTCOME_COMPLETED:
+						completed_keys.add(entry["key"])
+
+				shard_metadata_path = os.path.join(self.output_path, ShardMerger.SHARDS_DIRECTORY, shard.name)
+				os.makedirs(shard_metadata_path, exist_ok=True)
+				transferred = 0
+				for name in sorted(os.listdir(shard_path)):
+					source = os.path.join(shard_path, name)
+					if name in ShardMerger.CONFIGURATION_FILENAMES + [PermutationJournal.FILENAME] or name.startswith("."):
+						continue  # Hidden entries are leftovers of stack staging directories
+					if os.path.isdir(source) and not os.path.islink(source):
+						transferred += self._transfer_tree(source, os.path.join(self.output_path, name))
+					elif name == "client__shaper__server":
+						self._transfer_file(source, os.path.join(self.output_path, name))
+					else:
+						# Campaign files of the shard (plan, trace, post-hooks, host snapshot, metrics)
+						self._transfer_file(source, os.path.join(shard_metadata_path, name))
+
+				planned = [PermutationJournal.key(ExperimentPermutation(entry["index"], entry["run_number"], entry["client"], entry["shaper"], entry["server"])) for entry in document["plan"]]
+				incomplete = [entry["log_name"] + f" (run {entry['run_number']})" for entry, key in zip(document["plan"], planned) if key not in completed_keys]
+				summary["shards"].append({"shard": str(shard), "path": shard_path, "planned": len(planned), "completed": len(planned) - len(incomplete), "transferred": transferred})
+				summary["planned"] += len(planned)
+				summary["completed"] += len(planned) - len(incomplete)
+				summary["incomplete"].extend(incomplete)
+				logger.debug(f"Merged shard [{shard}] from [{shard_path}], {len(planned) - len(incomplete)} of {len(planned)} permutation(s) completed")
+
+		with open(os.path.join(self.output_path, ShardMerger.SUMMARY_FILENAME), "w") as fp:
+			json.dump(summary, fp, indent=4)
+		return summary
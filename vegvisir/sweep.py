@@ -0,0 +1,170 @@
+import bisect
+import json
+import math
+import re
+from collections.abc import Sequence
+from typing import Dict, Iterator, List, Tuple
+
+from vegvisir.exceptions import VegvisirInvalidExperimentConfigurationException
+
+SWEEP_KEY = "sweep"
+AXIS_KEY = "axis"
+
+_LOG_NAME_UNSAFE = re.compile(r"[^A-Za-z0-9.+-]")
+
+
+def _argument_value(value) -> str:
+	return value if type(value) is str else json.dumps(value)
+
+
+def _range_values(sweep: Dict, argument: str) -> Sequence:
+	"""
+	Values of a {"start", "stop", "step"} range, stop is included when the range reaches it
+	"""
+	start = sweep.get("start")
+	stop = sweep.get("stop")
+	step = sweep.get("step", 1)
+	if any(type(value) not in [int, float] for value in [start, stop, step]) or step == 0:
+		raise VegvisirInvalidExperimentConfigurationException(f"Sweep of argument [{argument}] requires numeric 'start' and 'stop' values and a non-zero 'step'.")
+	count = math.floor((stop - start) / step + 1e-9) + 1
+	if count <= 0:
+		raise VegvisirInvalidExperimentConfigurationException(f"Sweep of argument [{argument}] is empty, 'step' does not lead from 'start' to 'stop'.")
+	integral = all(type(value) is int for value in [start, stop, step])
+	# Values are only generated once they are needed
+	return _RangeValues(start, step, count, integral)
+
+
+class _RangeValues(Sequence):
+	def __init__(self, start: int | float, step: int | float, count: int, integral: bool) -> None:
+		self.start = start
+		self.step = step
+		self.count = count
+		self.integral = integral
+
+	def __len__(self) -> int:
+		return self.count
+
+	def __getitem__(self, index: int) -> str:
+		if index < 0 or index >= self.count:
+			raise IndexError(index)
+		value = self.start + index * self.step
+		return str(value) if self.integral else repr(round(value, 12))
+
+
+class SweepEntry:
+	"""
+	Client, server or shaper entry of the experiment configuration whose arguments sweep over values
+	Arguments are swept with {"sweep": [values]} or {"sweep": {"start": .., "stop": .., "step": ..}}, sweeps sharing an "axis" name are zipped
+	All axes are combined into their cartesian product, the last axis varying fastest
+	Points are only created when indexed, each receiving a log name derived from the entry its log name (or name) and the swept values
+	"""
+	def __init__(self, entry: Dict, debug_str: str) -> None:
+		self.entry = entry
+		self.axes: List[Tuple[List[str], List[Sequence]]] = []  # (arguments, values per argument)
+		self.swept: List[str] = []  # Swept arguments in configured order
+
+		arguments = entry.get("arguments")
+		if type(arguments) is not dict:
+			return
+		axes: Dict[str, Tuple[List[str], List[Sequence]]] = {}
+		for argument, value in arguments.items():
+			if type(value) is not dict or SWEEP_KEY not in value:
+				continue
+			sweep = value[SWEEP_KEY]
+			if type(sweep) is list:
+				if len(sweep) == 0:
+					raise VegvisirInvalidExperimentConfigurationException(f"{debug_str.capitalize()} [{entry.get('name')}] sweeps argument [{argument}] over an empty list.")
+				values = [_argument_value(element) for element in sweep]
+			elif type(sweep) is dict:
+				values = _range_values(sweep, argument)
+			else:
+				raise VegvisirInvalidExperimentConfigurationException(f"{debug_str.capitalize()} [{entry.get('name')}] sweeps argument [{argument}] over neither a list nor a range.")
+			axis = value.get(AXIS_KEY, argument)
+			names, value_lists = axes.setdefault(axis, ([], []))
+			if len(value_lists) > 0 and len(value_lists[0]) != len(values):
+				raise VegvisirInvalidExperimentConfigurationException(f"{debug_str.capitalize()} [{entry.get('name')}] zips sweeps of different lengths on axis [{axis}].")
+			names.append(argument)
+			value_lists.append(values)
+			self.swept.append(argument)
+		self.axes = list(axes.values())
+
+		# Generated log names need to be unique, which only depends on the values of each axis
+		for names, value_lists in self.axes:
+			seen = set()
+			for point in range(len(value_lists[0])):
+				log_values = tuple(_LOG_NAME_UNSAFE.sub("-", values[point]) for values in value_lists)
+				if log_values in seen:
+					raise VegvisirInvalidExperimentConfigurationException(f"{debug_str.capitalize()} [{entry.get('name')}] sweeps {names} over values that do not lead to unique log names {list(log_values)}.")
+				seen.add(log_values)
+
+	@property
+	def is_sweep(self) -> bool:
+		return len(self.axes) > 0
+
+	def __len__(self) -> int:
+		return math.prod(len(value_lists[0]) for _, value_lists in self.axes)
+
+	def _values(self, index: int) -> Dict[str, str]:
+		values: Dict[str, str] = {}
+		for names, value_lists in reversed(self.axes):
+			index, point = divmod(index, len(value_lists[0]))
+			for name, axis_values in zip(names, value_lists):
+				values[name] = axis_values[point]
+		return values
+
+	def _log_name(self, values: Dict[str, str]) -> str:
+		base = self.entry.get("log_name", self.entry["name"])
+		return base + "".join(f"_{name}-{_LOG_NAME_UNSAFE.sub('-', values[name])}" for name in self.swept)
+
+	def log_names(self) -> Iterator[str]:
+		"""
+		Log names of all points in index order, without creating their configurations
+		"""
+		for index in range(len(self) if self.is_sweep else 0):
+			yield self._log_name(self._values(index))
+
+	def __getitem__(self, index: int) -> Dict:
+		if not self.is_sweep:
+			if index != 0:
+				raise IndexError(index)
+			return self.entry
+		if index < 0 or index >= len(self):
+			raise IndexError(index)
+		values = self._values(index)
+		point_entry = dict(self.entry)
+		point_entry["arguments"] = {**self.entry["arguments"], **values}
+		point_entry["log_name"] = self._log_name(values)
+		return point_entry
+
+
+class ConfigurationSequence(Sequence):
+	"""
+	Client, server or shaper configurations of an experiment, sweep entries are expanded on access
+	Length and indexing only depend on the number of entries, no configuration is created before it is needed
+	"""
+	def __init__(self, entries: List[SweepEntry] | None = None) -> None:
+		self.entries = list(entries) if entries is not None else []
+		self._offsets: List[int] = []
+		total = 0
+		for entry in self.entries:
+			self._offsets.append(total)
+			total += len(entry)
+		self._length = total
+
+	def __len__(self) -> int:
+		return self._length
+
+	def __getitem__(self, index: int | slice) -> Dict | List[Dict]:
+		if type(index) is slice:
+			return [self[position] for position in range(*index.indices(self._length))]
+		if index < 0:
+			index += self._length
+		if index < 0 or index >= self._length:
+			raise IndexError(index)
+		entry = bisect.bisect_right(self._offsets, index) - 1
+		return self.entries[entry][index - self._offsets[entry]]
+
+	def __iter__(self):
+		for entry in self.entries:
+			for index in range(len(entry)):
+				yield entry[index]
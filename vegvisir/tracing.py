@@ -0,0 +1,144 @@
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+
+class Tracer:
+	"""
+	Records spans of the phases Vegvisir goes through, one JSON object per finished span is appended to trace.jsonl in the campaign logs
+	When tracing stops, the JSONL file is converted into trace.json using the Chrome trace event format (chrome://tracing, https://ui.perfetto.dev)
+	Spans are disabled (no-ops) until start() is called
+	"""
+	JSONL_FILENAME = "trace.jsonl"
+	TRACE_FILENAME = "trace.json"
+
+	_ENVIRONMENT_ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._fp = None
+		self._campaign_path: str | None = None
+		self._async_ids = itertools.count()
+		self._observers: List[Callable[[str, str, float], None]] = []
+
+	@property
+	def enabled(self) -> bool:
+		return self._fp is not None
+
+	def add_observer(self, observer: Callable[[str, str, float], None]) -> None:
+		"""
+		Call observer with the name, category and duration of every recorded span (e.g., to aggregate metrics)
+		"""
+		if observer not in self._observers:
+			self._observers.append(observer)
+
+	def start(self, campaign_path: str) -> None:
+		with self._lock:
+			self._campaign_path = campaign_path
+			# Resumed campaigns append to the spans of earlier attempts
+			self._fp = open(os.path.join(campaign_path, Tracer.JSONL_FILENAME), "a")
+
+	def stop(self) -> str | None:
+		"""
+		Stop recording and convert the recorded spans into a Chrome trace, returns the path of the trace
+		"""
+		with self._lock:
+			if self._fp is None:
+				return None
+			self._fp.close()
+			self._fp = None
+		return self.export(os.path.join(self._campaign_path, Tracer.JSONL_FILENAME), os.path.join(self._campaign_path, Tracer.TRACE_FILENAME))
+
+	def record(self, name: str, category: str, start: float, end: float, asynchronous: bool = False, **args) -> None:
+		"""
+		Record a span from epoch timestamps start and end
+		Asynchronous spans may overlap others of the same thread (e.g., concurrent host commands), they are drawn on a separate track
+		"""
+		for observer in self._observers:
+			observer(name, category, end - start)
+		if self._fp is None:
+			return
+		thread = threading.current_thread()
+		span = {
+			"name": name,
+			"cat": category,
+			"start": start,
+			"duration": end - start,
+			"thread": thread.name,
+			"tid": thread.native_id,
+			"args": args,
+		}
+		if asynchronous:
+			span["async_id"] = next(self._async_ids)
+		with self._lock:
+			if self._fp is not None:
+				self._fp.write(json.dumps(span, default=str) + "\n")
+				self._fp.flush()
+
+	@contextmanager
+	def span(self, name: str, category: str = "vegvisir", **args) -> Iterator[Dict]:
+		"""
+		Trace the enclosed block, the yielded dictionary can be used to add arguments once they are known
+		"""
+		if self._fp is None:
+			yield args
+			return
+		start = time.time()
+		try:
+			yield args
+		except BaseException as e:
+			args["exception"] = repr(e)
+			raise
+		finally:
+			self.record(name, category, start, time.time(), **args)
+
+	@staticmethod
+	def command_name(command: str, words: int = 3) -> str:
+		"""
+		Short span name of a host command, leading environment variable assignments (e.g., compose variables) are left out
+		"""
+		tokens = [token for token in command.split() if not Tracer._ENVIRONMENT_ASSIGNMENT.match(token)]
+		return " ".join(tokens[:words])
+
+	@staticmethod
+	def export(jsonl_path: str, trace_path: str) -> str:
+		"""
+		Stream the spans of jsonl_path into a Chrome trace at trace_path, spans are not loaded in memory all at once
+		"""
+		threads: Dict[int, str] = {}
+		with open(jsonl_path) as source, open(trace_path, "w") as destination:
+			destination.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+			first = True
+			for line in source:
+				try:
+					span = json.loads(line)
+				except json.JSONDecodeError:
+					continue
+				# Epoch microseconds, spans are appended once finished and thus not ordered by start
+				timestamp = span["start"] * 1e6
+				duration = span["duration"] * 1e6
+				threads[span["tid"]] = span["thread"]
+				if "async_id" in span:
+					events = [
+						{"name": span["name"], "cat": span["cat"], "ph": "b", "id": span["async_id"], "ts": timestamp, "pid": 1, "tid": span["tid"], "args": span["args"]},
+						{"name": span["name"], "cat": span["cat"], "ph": "e", "id": span["async_id"], "ts": timestamp + duration, "pid": 1, "tid": span["tid"]},
+					]
+				else:
+					events = [{"name": span["name"], "cat": span["cat"], "ph": "X", "ts": timestamp, "dur": duration, "pid": 1, "tid": span["tid"], "args": span["args"]}]
+				for event in events:
+					destination.write(("" if first else ",\n") + json.dumps(event))
+					first = False
+			for tid, name in threads.items():
+				destination.write(("" if first else ",\n") + json.dumps({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}}))
+				first = False
+			destination.write("\n]}\n")
+		return trace_path
+
+
+# Shared by all components of a campaign, comparable to the logging module its root logger
+tracer = Tracer()
@@ -5,7 +5,10 @@
 # When packets run through ns3 however, the receiving endpoint requires valid checksums.
 # This command makes sure that the endpoints set the checksum on outgoing packets.
 
-DOCKER_BRIDGE=$(ip a | grep "193.167.0.255" | awk 'NF>1{print $NF}')
+# Optional first argument: broadcast address of the leftnet subnet (defaults to the single slot subnet)
+LEFTNET_BROADCAST=${1:-193.167.0.255}
+
+DOCKER_BRIDGE=$(ip a | grep "$LEFTNET_BROADCAST" | awk 'NF>1{print $NF}')
 VETH_IDS=($(ip a | grep "master $DOCKER_BRIDGE" | awk '{sub(/@.*/, ""); print}' | awk 'NF>1{print $NF}'))
 
 for ID in "${VETH_IDS[@]}"